@@ -0,0 +1,527 @@
+"""
+Static opcode cost and program size report for the Ecommerce approval program.
+
+The compiled TEAL is split in basic blocks, and for each ABI method it computes:
+
+- dispatch_cost: opcodes spent by the router before reaching the method.
+- opcode_cost: worst case opcodes of the whole call, dispatch included. Each loop
+  costs its bound times its worst iteration, the bound is taken from the constant
+  bounding it, so nested loops multiply. Subroutines are added on each callsub.
+- bytes: size of the assembled code reachable from the method.
+- scratch_accesses, state_accesses: loads/stores on the worst case path.
+
+Usage:
+    python -m smartcontract.analyze [-o report.json] [--baseline baseline.json]
+
+With --baseline the command fails when a method costs more opcodes or bytes than the baseline.
+"""
+import argparse
+import json
+import math
+import re
+import sys
+from dataclasses import dataclass, field
+from typing import Optional
+
+APP_CALL_BUDGET = 700
+PAGE_SIZE = 2048
+"""Bytes of each page of the programs, an application has 1 page and up to 3 extra pages"""
+MAX_EXTRA_PAGES = 3
+FOREIGN_ACCOUNTS = 4
+"""Accounts on the accounts array of an application call, besides the sender"""
+
+OPCODE_COST = {
+    "sha256": 35,
+    "keccak256": 130,
+    "sha512_256": 45,
+    "sha3_256": 130,
+    "ed25519verify": 1900,
+    "ed25519verify_bare": 1900,
+    "ecdsa_verify": 1700,
+    "ecdsa_pk_decompress": 650,
+    "ecdsa_pk_recover": 2000,
+    "vrf_verify": 5700,
+    "divmodw": 20,
+    "sqrt": 4,
+    "bsqrt": 40,
+    "b+": 10,
+    "b-": 10,
+    "b*": 20,
+    "b/": 20,
+    "b%": 20,
+    "b|": 6,
+    "b&": 6,
+    "b^": 6,
+    "b~": 4,
+}
+"""Opcodes that cost more than 1 unit of the budget"""
+
+SCRATCH_OPS = {"load", "store", "loads", "stores"}
+STATE_OPS = {
+    "app_local_get", "app_local_get_ex", "app_local_put", "app_local_del",
+    "app_global_get", "app_global_get_ex", "app_global_put", "app_global_del",
+    "box_create", "box_extract", "box_replace", "box_del", "box_len", "box_get", "box_put",
+}
+BRANCH_OPS = {"bz", "bnz"}
+TERMINAL_OPS = {"return", "err", "retsub"}
+
+# Size of the immediates of the opcodes, the opcode itself is 1 byte
+IMMEDIATE_SIZE = {
+    "txn": 1, "global": 1, "load": 1, "store": 1, "gloads": 1, "gaid": 1,
+    "txnas": 1, "gtxns": 1, "gtxnsas": 1, "itxn_field": 1, "itxn": 1, "itxnas": 1,
+    "dig": 1, "cover": 1, "uncover": 1, "bury": 1, "popn": 1, "dupn": 1,
+    "frame_dig": 1, "frame_bury": 1, "replace2": 1, "arg": 1, "intc": 1, "bytec": 1,
+    "app_params_get": 1, "asset_params_get": 1, "asset_holding_get": 1, "acct_params_get": 1,
+    "base64_decode": 1, "json_ref": 1, "ecdsa_verify": 1, "ecdsa_pk_decompress": 1,
+    "ecdsa_pk_recover": 1, "vrf_verify": 1, "block": 1,
+    "txna": 2, "gtxn": 2, "gtxnsa": 2, "gload": 2, "gtxnas": 2, "itxna": 2, "gitxn": 2,
+    "gitxnas": 2, "extract": 2, "substring": 2, "proto": 2,
+    "gtxna": 3, "gitxna": 3,
+    "b": 2, "bz": 2, "bnz": 2, "callsub": 2,
+}
+
+
+def varuint_size(n: int) -> int:
+    size = 1
+    while n >= 0x80:
+        n >>= 7
+        size += 1
+    return size
+
+
+def parse_bytes(token: str) -> bytes:
+    if token.startswith("0x"):
+        return bytes.fromhex(token[2:])
+    if token.startswith('"'):
+        return token[1:-1].encode().decode("unicode_escape").encode("latin-1")
+    raise ValueError(f"Can't parse byte constant {token}")
+
+
+def tokenize(line: str) -> list[str]:
+    """Split a TEAL line in tokens, removing the comment, quoted strings are kept as one token."""
+    tokens, current, quoted, i = [], "", False, 0
+    while i < len(line):
+        c = line[i]
+        if quoted:
+            current += c
+            if c == "\\" and i + 1 < len(line):
+                current += line[i + 1]
+                i += 1
+            elif c == '"':
+                quoted = False
+        elif c == '"':
+            current += c
+            quoted = True
+        elif line.startswith("//", i):
+            break
+        elif c.isspace():
+            if current:
+                tokens.append(current)
+            current = ""
+        else:
+            current += c
+        i += 1
+    if current:
+        tokens.append(current)
+    return tokens
+
+
+@dataclass
+class Instruction:
+    op: str
+    args: list[str]
+
+    @property
+    def cost(self) -> int:
+        if self.op == "#pragma":
+            return 0
+        return OPCODE_COST.get(self.op, 1)
+
+    @property
+    def size(self) -> int:
+        """Assembled size of the instruction"""
+        if self.op == "#pragma":
+            return 0
+        if self.op == "intcblock":
+            return 1 + varuint_size(len(self.args)) + sum(varuint_size(int(a)) for a in self.args)
+        if self.op == "bytecblock":
+            values = [parse_bytes(a) for a in self.args]
+            return 1 + varuint_size(len(values)) + sum(varuint_size(len(v)) + len(v) for v in values)
+        if self.op in ("pushint", "int"):
+            return 1 + varuint_size(int(self.args[0]))
+        if self.op in ("pushbytes", "byte"):
+            n = len(parse_bytes(self.args[0]))
+            return 1 + varuint_size(n) + n
+        if self.op == "method":
+            return 1 + 1 + 4
+        if self.op in ("switch", "match"):
+            return 2 + 2 * len(self.args)
+        return 1 + IMMEDIATE_SIZE.get(self.op, 0)
+
+
+@dataclass
+class Block:
+    label: str
+    instructions: list[Instruction] = field(default_factory=list)
+    successors: list[str] = field(default_factory=list)
+    calls: list[str] = field(default_factory=list)
+
+    @property
+    def cost(self) -> int:
+        return sum(i.cost for i in self.instructions)
+
+    @property
+    def size(self) -> int:
+        return sum(i.size for i in self.instructions)
+
+    def count(self, ops: set[str]) -> int:
+        return sum(1 for i in self.instructions if i.op in ops)
+
+
+@dataclass
+class Cost:
+    """Worst case of a path, the cost is maximized and the accesses are the ones along that path"""
+    opcodes: int = 0
+    scratch: int = 0
+    state: int = 0
+
+    def __add__(self, other: "Cost") -> "Cost":
+        return Cost(self.opcodes + other.opcodes, self.scratch + other.scratch, self.state + other.state)
+
+    def __mul__(self, n: int) -> "Cost":
+        return Cost(self.opcodes * n, self.scratch * n, self.state * n)
+
+
+def subroutine_name(label: str) -> str:
+    """Name of the subroutine of a label, `postOrder_12_l3` is on postOrder, `main_l4` on main"""
+    return re.sub(r"_\d+$", "", re.sub(r"_l\d+$", "", label))
+
+
+class Program:
+    """Control flow graph of a TEAL program"""
+
+    def __init__(self, teal: str, loop_bound: int, loop_bounds: Optional[dict[str, tuple[int, ...]]] = None):
+        """
+        loop_bounds gives the bound of the loops of each subroutine by their nesting depth, the loops deeper than
+        the bounds given take the last one. The loops of the other subroutines are bounded by loop_bound.
+        """
+        self.loop_bound = loop_bound
+        self.loop_bounds = loop_bounds or {}
+        self.loops: dict[tuple[str, int], Cost] = {}
+        """Worst iteration of the loops costed so far, keyed by their subroutine and nesting depth"""
+        self.blocks: dict[str, Block] = {}
+        self.order: list[str] = []
+        self.selectors: dict[str, str] = {}
+        self._parse(teal)
+        self._subroutine_cost: dict[str, Cost] = {}
+
+    def _new_block(self, label: str) -> Block:
+        block = Block(label)
+        self.blocks[label] = block
+        self.order.append(label)
+        return block
+
+    def _parse(self, teal: str):
+        block = self._new_block("__entry")
+        previous: list[str] = []
+        auto = 0
+        for line in teal.splitlines():
+            tokens = tokenize(line.strip())
+            if not tokens:
+                continue
+            if tokens[0].endswith(":"):
+                label = tokens[0][:-1]
+                if block.instructions or block.label == "__entry":
+                    if not block.successors and not self._ends(block):
+                        block.successors.append(label)
+                    block = self._new_block(label)
+                else:
+                    # Empty block, it falls through the label
+                    self.blocks.pop(block.label)
+                    self.order.remove(block.label)
+                    for b in self.blocks.values():
+                        b.successors = [label if s == block.label else s for s in b.successors]
+                    block = self._new_block(label)
+                continue
+
+            ins = Instruction(tokens[0], tokens[1:])
+            block.instructions.append(ins)
+            self._match_selector(previous, tokens)
+            previous = (previous + [line.strip()])[-3:]
+
+            if ins.op == "callsub":
+                block.calls.append(ins.args[0])
+            elif ins.op == "b" or ins.op in BRANCH_OPS or ins.op in TERMINAL_OPS:
+                auto += 1
+                next_label = f"__block{auto}"
+                if ins.op == "b":
+                    block.successors.append(ins.args[0])
+                elif ins.op in BRANCH_OPS:
+                    block.successors += [ins.args[0], next_label]
+                block = self._new_block(next_label)
+
+    @staticmethod
+    def _ends(block: Block) -> bool:
+        return bool(block.instructions) and (
+            block.instructions[-1].op in TERMINAL_OPS or block.instructions[-1].op == "b"
+        )
+
+    def _match_selector(self, previous: list[str], tokens: list[str]):
+        """The router compares the method selector and jumps to the handler, `pushbytes sel // "sig"`, `==`, `bnz`"""
+        if tokens[0] != "bnz" or len(previous) < 2 or previous[-1] != "==":
+            return
+        m = re.match(r'(?:pushbytes|method) .*"(.+\(.*\).*)"', previous[-2])
+        if m:
+            self.selectors[m.group(1)] = tokens[1]
+
+    def successors(self, label: str) -> list[str]:
+        return [s for s in self.blocks[label].successors if s in self.blocks]
+
+    def block_cost(self, label: str) -> Cost:
+        block = self.blocks[label]
+        cost = Cost(block.cost, block.count(SCRATCH_OPS), block.count(STATE_OPS))
+        for sub in block.calls:
+            cost = cost + self.subroutine_cost(sub)
+        return cost
+
+    def subroutine_cost(self, label: str) -> Cost:
+        if label not in self._subroutine_cost:
+            self._subroutine_cost[label] = Cost()  # Recursion is not expected, do not loop forever
+            self._subroutine_cost[label] = self.worst_case(label)
+        return self._subroutine_cost[label]
+
+    def reachable(self, start: str, follow_calls: bool = True) -> set[str]:
+        seen, stack = set(), [start]
+        while stack:
+            label = stack.pop()
+            if label in seen or label not in self.blocks:
+                continue
+            seen.add(label)
+            stack += self.successors(label)
+            if follow_calls:
+                stack += self.blocks[label].calls
+        return seen
+
+    def _components(self, labels: set[str], successors) -> dict[str, int]:
+        """Strongly connected components (Tarjan), each loop of the program is one component"""
+        index, low, on_stack, stack, comp = {}, {}, set(), [], {}
+        counter = [0]
+
+        def visit(v):
+            index[v] = low[v] = counter[0]
+            counter[0] += 1
+            stack.append(v)
+            on_stack.add(v)
+            for w in successors(v):
+                if w not in index:
+                    visit(w)
+                    low[v] = min(low[v], low[w])
+                elif w in on_stack:
+                    low[v] = min(low[v], index[w])
+            if low[v] == index[v]:
+                while True:
+                    w = stack.pop()
+                    on_stack.discard(w)
+                    comp[w] = index[v]
+                    if w == v:
+                        break
+
+        for v in sorted(labels, key=self.order.index):
+            if v not in index:
+                visit(v)
+        return comp
+
+    def bound(self, subroutine: str, depth: int) -> int:
+        """Iterations of a loop of the subroutine nested at this depth"""
+        bounds = self.loop_bounds.get(subroutine)
+        return bounds[min(depth, len(bounds) - 1)] if bounds else self.loop_bound
+
+    def worst_case(self, start: str) -> Cost:
+        """Worst case cost from the block until the program (or the subroutine) ends."""
+        sys.setrecursionlimit(max(sys.getrecursionlimit(), 10 * len(self.blocks) + 1000))
+        return self._longest(self.reachable(start, follow_calls=False), start, None, subroutine_name(start), 0)
+
+    def _longest(self, labels: set[str], start: str, header: Optional[str], subroutine: str, depth: int) -> Cost:
+        """
+        Longest path from start inside labels. Each loop is collapsed in one node that costs its bound times
+        its longest iteration, plus the last check of its condition. The iteration is the longest path from
+        the loop header back to it, the loops nested inside are collapsed the same way.
+        Inside a loop, header is its header, the jumps back to it end the path.
+        """
+        def successors(label: str) -> list[str]:
+            return [s for s in self.successors(label) if s in labels and s != header]
+
+        comp = self._components(labels, successors)
+        members: dict[int, list[str]] = {}
+        for label, c in comp.items():
+            members.setdefault(c, []).append(label)
+
+        node_cost: dict[int, Cost] = {}
+        for c, m in members.items():
+            if len(m) == 1 and m[0] not in successors(m[0]):
+                node_cost[c] = self.block_cost(m[0])
+                continue
+            # The header is the entry of the loop, the only block reached from outside
+            entries = [label for label in m if label == start or any(
+                label in successors(other) for other in labels if comp[other] != c)]
+            loop_header = min(entries, key=self.order.index)
+            iteration = self._longest(set(m), loop_header, loop_header, subroutine, depth + 1)
+            if iteration.opcodes >= self.loops.get((subroutine, depth), Cost()).opcodes:
+                self.loops[(subroutine, depth)] = iteration
+            node_cost[c] = iteration * self.bound(subroutine, depth) + self.block_cost(loop_header)
+
+        memo: dict[int, Cost] = {}
+
+        def longest(c: int) -> Cost:
+            if c in memo:
+                return memo[c]
+            best = Cost()
+            for label in members[c]:
+                for s in successors(label):
+                    if comp[s] != c:
+                        candidate = longest(comp[s])
+                        if candidate.opcodes > best.opcodes:
+                            best = candidate
+            memo[c] = node_cost[c] + best
+            return memo[c]
+
+        return longest(comp[start])
+
+    def dispatch_cost(self, handler: str) -> int:
+        """Opcodes spent by the router from the program start to the jump to the handler"""
+        cost, label = 0, "__entry"
+        seen = set()
+        while label in self.blocks and label not in seen:
+            seen.add(label)
+            block = self.blocks[label]
+            cost += block.cost
+            if handler in block.successors:
+                return cost
+            fallthrough = [s for s in block.successors if s.startswith("__block")] or block.successors[-1:]
+            if not fallthrough:
+                break
+            label = fallthrough[0]
+        raise ValueError(f"The router does not jump to {handler}")
+
+    def size(self, labels: set[str] = None) -> int:
+        labels = self.blocks.keys() if labels is None else labels
+        # The program starts with the version byte
+        return sum(self.blocks[label].size for label in labels) + (1 if labels is self.blocks.keys() else 0)
+
+
+def analyze(teal: str, loop_bound: int, loop_bounds: Optional[dict[str, tuple[int, ...]]] = None,
+            extra_pages: int = 0) -> dict:
+    """Build the report for every ABI method of the program, deployed with the extra pages given"""
+    program = Program(teal, loop_bound, loop_bounds)
+    methods = {}
+    for signature, handler in sorted(program.selectors.items()):
+        worst = program.worst_case(handler)
+        dispatch = program.dispatch_cost(handler)
+        methods[signature] = {
+            "opcode_cost": dispatch + worst.opcodes,
+            "dispatch_cost": dispatch,
+            "bytes": program.size(program.reachable(handler)),
+            "scratch_accesses": worst.scratch,
+            "state_accesses": worst.state,
+        }
+    return {
+        "program": {
+            "bytes": program.size(),
+            "max_bytes": PAGE_SIZE * (1 + extra_pages),
+            "extra_pages": extra_pages,
+            "opcode_budget": APP_CALL_BUDGET,
+            "loop_bound": loop_bound,
+            "loop_bounds": {name: list(bounds) for name, bounds in sorted((loop_bounds or {}).items())},
+        },
+        "methods": methods,
+    }
+
+
+def regressions(report: dict, baseline: dict) -> list[str]:
+    """Return a message for each method that costs more than on the baseline"""
+    messages = []
+    for signature, current in report["methods"].items():
+        previous = baseline.get("methods", {}).get(signature)
+        if previous is None:
+            continue
+        for metric in ("opcode_cost", "bytes"):
+            if current[metric] > previous[metric]:
+                messages.append(f"{signature}: {metric} {previous[metric]} -> {current[metric]}")
+    if report["program"]["bytes"] > baseline.get("program", {}).get("bytes", report["program"]["bytes"]):
+        messages.append(f"program: bytes {baseline['program']['bytes']} -> {report['program']['bytes']}")
+    return messages
+
+
+def ecommerce_loop_bounds() -> dict[str, tuple[int, ...]]:
+    """The constant bounding each loop of the Ecommerce subroutines, by nesting depth"""
+    from .contract import Ecommerce
+
+    order_list = Ecommerce._Ecommerce__ORDER_LIST_MAX
+    batch = Ecommerce._Ecommerce__POST_BATCH_MAX
+    queue_pages = Ecommerce._Ecommerce__QUEUE_PAGES
+    bits = 64       # The archive has a peak for each bit of its uint64 count
+    # Budgets requested to ensureBudget: a batch posted or settled, a sweep, and an archive of the whole order list
+    budgets = (
+        batch * max(Ecommerce._post_order_cost, Ecommerce._settle_order_cost),
+        FOREIGN_ACCOUNTS * Ecommerce._sweep_account_cost
+        + Ecommerce._Ecommerce__SWEEP_MAX * Ecommerce._settle_order_cost,
+        order_list * Ecommerce._archive_order_cost,
+    )
+    return {
+        # Each inner call adds one app call budget, up to the largest budget requested
+        "ensureBudget": (math.ceil(max(budgets) / APP_CALL_BUDGET),),
+        "orderList": (order_list,),
+        "getSlotUsage": (order_list,),
+        "getSellerQueue": (queue_pages,),
+        "pushOrderRef": (queue_pages,),
+        "removeOrderRef": (queue_pages, Ecommerce._Ecommerce__QUEUE_PAGE_REFS),
+        "oPostOrdersBatch": (batch,),
+        "placeOrderCart": (batch,),
+        "settleOrders": (batch,),
+        "sweepExpired": (FOREIGN_ACCOUNTS, order_list),
+        "archiveOrders": (order_list, bits),
+        "verifyArchivedOrder": (bits,),
+    }
+
+
+def ecommerce_program() -> Program:
+    from .contract import Ecommerce
+
+    return Program(Ecommerce().approval_program, Ecommerce._Ecommerce__ORDER_LIST_MAX, ecommerce_loop_bounds())
+
+
+def ecommerce_report() -> dict:
+    """The application is created with the extra pages its size needs, up to the max"""
+    from .contract import Ecommerce
+
+    app = Ecommerce()
+    return analyze(app.approval_program, Ecommerce._Ecommerce__ORDER_LIST_MAX, ecommerce_loop_bounds(),
+                   extra_pages=MAX_EXTRA_PAGES)
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-o", "--output", help="write the report to this file instead of stdout")
+    parser.add_argument("--baseline", help="fail if a method costs more than on this report")
+    args = parser.parse_args(argv)
+
+    report = ecommerce_report()
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            messages = regressions(report, json.load(f))
+        for message in messages:
+            print(f"regression: {message}", file=sys.stderr)
+        if messages:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
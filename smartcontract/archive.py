@@ -0,0 +1,171 @@
+"""
+Keep the orders archived by Ecommerce.archiveOrders, and build the proofs of their records.
+
+The application only keeps the root of the archive of each buyer and the number of orders archived,
+the records are logged once with the OrderArchived event. ArchiveStore rebuilds the archive of each
+buyer from the events, to pass its peaks to archiveOrders and to prove a record with verifyArchivedOrder
+when the buyer and the seller dispute a finished order.
+
+The archive is a Merkle mountain range: the leaf of a record is its sha256, a node is the sha256 of
+its two children, and the root is the sha256 of the number of leaves and the peaks from the highest.
+A record is longer than two hashes, so a leaf can't be taken for a node.
+
+Usage:
+    store = ArchiveStore.load("archive.json")
+    store.ingest(stream.poll())
+    client.call(Ecommerce.archiveOrders, acct=buyer, peaks=store.peaks(buyer))
+    ...
+    leaf = store.find(buyer, "order-1")
+    record, proof = store.proof(buyer, leaf)
+    client.call(Ecommerce.verifyArchivedOrder, acct=buyer, record=record, leaf=leaf, proof=proof)
+    store.save("archive.json")
+"""
+import hashlib
+import json
+from typing import Iterable, Optional
+
+from .contract import Ecommerce
+from .events import Event
+
+HASH_LEN = 32
+
+
+def leaf_hash(record: bytes) -> bytes:
+    return hashlib.sha256(record).digest()
+
+
+def node_hash(left: bytes, right: bytes) -> bytes:
+    return hashlib.sha256(left + right).digest()
+
+
+def archive_root(count: int, peaks: bytes) -> bytes:
+    """Root stored by the application, 32 zero bytes while nothing was archived"""
+    return hashlib.sha256(count.to_bytes(8, "big") + peaks).digest() if count else bytes(HASH_LEN)
+
+
+def verify(root: bytes, count: int, record: bytes, leaf: int, proof: bytes) -> bool:
+    """Check the proof of the record as verifyArchivedOrder does, against the root and count stored on chain"""
+    if not 0 <= leaf < count:
+        return False
+    # The peaks are the set bits of the count, the leaf is under the highest bit where it differs from the count
+    height = (count ^ leaf).bit_length() - 1
+    position = bin(count >> (height + 1)).count("1")
+    path, peaks = proof[:height * HASH_LEN], proof[height * HASH_LEN:]
+    if len(path) != height * HASH_LEN or archive_root(count, peaks) != root:
+        return False
+    node = leaf_hash(record)
+    index = leaf & ((1 << height) - 1)
+    for level in reversed(range(height)):
+        sibling = path[level * HASH_LEN:(level + 1) * HASH_LEN]
+        node = node_hash(sibling, node) if index & 1 else node_hash(node, sibling)
+        index >>= 1
+    return peaks[position * HASH_LEN:(position + 1) * HASH_LEN] == node
+
+
+class MerkleArchive:
+    """Archive of one buyer, the records in the order they were archived"""
+
+    def __init__(self, records: Iterable[bytes] = ()):
+        self.records: list[bytes] = []
+        self._peaks: list[tuple[int, bytes]] = []   # Height and hash of each peak, from the highest
+        for record in records:
+            self.append(record)
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def append(self, record: bytes) -> int:
+        """Add the record as archiveOrders does, the peaks of the same height are merged. Return its leaf."""
+        node, height = leaf_hash(record), 0
+        while self._peaks and self._peaks[-1][0] == height:
+            node = node_hash(self._peaks.pop()[1], node)
+            height += 1
+        self._peaks.append((height, node))
+        self.records.append(record)
+        return len(self.records) - 1
+
+    def peaks(self) -> bytes:
+        return b"".join(peak for _, peak in self._peaks)
+
+    def root(self) -> bytes:
+        return archive_root(len(self), self.peaks())
+
+    def proof(self, leaf: int) -> bytes:
+        """The siblings of the leaf from the top of its peak down to the leaf, followed by the peaks"""
+        if not 0 <= leaf < len(self):
+            raise IndexError(f"leaf {leaf} is not archived")
+        start = 0
+        for height, _ in self._peaks:
+            if leaf < start + (1 << height):
+                break
+            start += 1 << height
+        nodes = [leaf_hash(r) for r in self.records[start:start + (1 << height)]]
+        index = leaf - start
+        path = []
+        while len(nodes) > 1:
+            path.append(nodes[index ^ 1])
+            nodes = [node_hash(nodes[i], nodes[i + 1]) for i in range(0, len(nodes), 2)]
+            index >>= 1
+        return b"".join(reversed(path)) + self.peaks()
+
+
+class ArchiveStore:
+    """Archives of all the buyers, rebuilt from the OrderArchived events"""
+
+    def __init__(self):
+        self.archives: dict[str, MerkleArchive] = {}
+
+    def archive(self, buyer: str) -> MerkleArchive:
+        return self.archives.setdefault(buyer, MerkleArchive())
+
+    def ingest(self, events: Iterable[Event]) -> int:
+        """
+        Add the records of the OrderArchived events, the events already read are skipped.
+        Fail if a record is missing, the events must be read from the creation of the application.
+        Return the number of records added.
+        """
+        added = 0
+        for event in events:
+            if event.name != "OrderArchived":
+                continue
+            archive = self.archive(event.args["buyer"])
+            if event.args["leaf"] > len(archive):
+                raise ValueError(f"the records of {event.args['buyer']} before leaf {event.args['leaf']} are missing")
+            if event.args["leaf"] == len(archive):
+                archive.append(event.args["record"])
+                added += 1
+        return added
+
+    def peaks(self, buyer: str) -> bytes:
+        """The peaks passed to archiveOrders"""
+        return self.archive(buyer).peaks()
+
+    def find(self, buyer: str, order_id: str) -> Optional[int]:
+        """Leaf of the last record archived for the order"""
+        order_hash = hashlib.sha256(order_id.encode()).digest()
+        records = self.archive(buyer).records
+        for leaf in reversed(range(len(records))):
+            if records[leaf][Ecommerce.RECORD_HASH:Ecommerce.RECORD_AMOUNT] == order_hash:
+                return leaf
+        return None
+
+    def proof(self, buyer: str, leaf: int) -> tuple[bytes, bytes]:
+        """The record and the proof passed to verifyArchivedOrder"""
+        archive = self.archive(buyer)
+        return archive.records[leaf], archive.proof(leaf)
+
+    def save(self, path: str):
+        with open(path, "w") as f:
+            json.dump({buyer: [r.hex() for r in a.records] for buyer, a in self.archives.items()}, f, indent=1)
+
+    @classmethod
+    def load(cls, path: str) -> "ArchiveStore":
+        store = cls()
+        try:
+            with open(path) as f:
+                archives = json.load(f)
+        except FileNotFoundError:
+            return store
+        for buyer, records in archives.items():
+            store.archives[buyer] = MerkleArchive(bytes.fromhex(r) for r in records)
+        return store
@@ -0,0 +1,118 @@
+"""
+Compiled artifacts of the Ecommerce contract: approval.teal, clear.teal and the ABI contract.json.
+
+Compiling the PyTeal takes most of the time of building Ecommerce(). The artifacts are written with
+a fingerprint of the contract source and of the pyteal and beaker versions. Ecommerce.compile loads
+them instead of compiling while the fingerprint matches, and writes them after compiling when they are
+stale or missing, so only the first run after a change compiles.
+
+Usage:
+    python -m smartcontract.artifacts [-d directory]
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+from importlib.metadata import PackageNotFoundError, version
+from typing import NamedTuple, Optional
+
+from algosdk import abi
+
+ARTIFACTS_DIR = os.path.join(os.path.dirname(__file__), "artifacts")
+CONTRACT_SOURCE = os.path.join(os.path.dirname(__file__), "contract.py")
+MANIFEST = "manifest.json"
+
+
+class Artifacts(NamedTuple):
+    approval: str
+    clear: str
+    contract: abi.Contract
+
+
+def package_version(name: str) -> str:
+    for dist in (name, f"{name}-pyteal"):
+        try:
+            return version(dist)
+        except PackageNotFoundError:
+            continue
+    return "unknown"
+
+
+def fingerprint() -> str:
+    """Hash of the contract source and of the versions of the compilers"""
+    h = hashlib.sha256()
+    with open(CONTRACT_SOURCE, "rb") as f:
+        h.update(f.read())
+    for name in ("pyteal", "beaker"):
+        h.update(f"{name}=={package_version(name)}".encode())
+    return h.hexdigest()
+
+
+def load(directory: str = ARTIFACTS_DIR) -> Optional[Artifacts]:
+    """Return the artifacts when they were built from the current source, None otherwise"""
+    try:
+        with open(os.path.join(directory, MANIFEST)) as f:
+            manifest = json.load(f)
+        if manifest.get("fingerprint") != fingerprint():
+            return None
+        with open(os.path.join(directory, "approval.teal")) as f:
+            approval = f.read()
+        with open(os.path.join(directory, "clear.teal")) as f:
+            clear = f.read()
+        with open(os.path.join(directory, "contract.json")) as f:
+            contract = abi.Contract.undictify(json.load(f))
+    except (OSError, ValueError, KeyError):
+        return None
+    return Artifacts(approval, clear, contract)
+
+
+def build(directory: str = ARTIFACTS_DIR) -> Artifacts:
+    """Compile the PyTeal and write the artifacts"""
+    from .contract import Ecommerce
+
+    return save(Ecommerce(artifacts_dir=None), directory)
+
+
+def save(app, directory: str = ARTIFACTS_DIR) -> Artifacts:
+    """Write the artifacts of the compiled application, the manifest is written last so a partial build is stale"""
+    os.makedirs(directory, exist_ok=True)
+    manifest = os.path.join(directory, MANIFEST)
+    if os.path.exists(manifest):
+        os.remove(manifest)
+    app.dump(directory)
+    with open(manifest, "w") as f:
+        json.dump({
+            "fingerprint": fingerprint(),
+            "pyteal": package_version("pyteal"),
+            "beaker": package_version("beaker"),
+        }, f, indent=2)
+    return Artifacts(app.approval_program, app.clear_program, app.contract)
+
+
+def update_app(algod_client, app_id: int, signer, directory: str = ARTIFACTS_DIR) -> str:
+    """Update a deployed application with the programs of the artifacts, they are built first when stale"""
+    from beaker.client import ApplicationClient
+    from .contract import Ecommerce
+
+    if load(directory) is None:
+        build(directory)
+    app = Ecommerce(artifacts_dir=directory)
+    return ApplicationClient(algod_client, app, app_id, signer=signer).update()
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-d", "--directory", default=ARTIFACTS_DIR, help="where to write the artifacts")
+    args = parser.parse_args(argv)
+
+    if load(args.directory) is not None:
+        print(f"{args.directory} is up to date")
+        return 0
+    build(args.directory)
+    print(f"wrote {args.directory}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
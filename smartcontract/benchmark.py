@@ -0,0 +1,289 @@
+"""
+Benchmark of the order lifecycle, run on the in-process ledger.
+
+The steps are opt-in -> placeOrderToken -> oPostOrderUsdc -> takeOrder. The sweep runs them for
+a buyer that already holds n-1 orders, for n from 1 to the size of the order list, so the cost
+of the order list operations is seen as it fills. The orders already held are accepted by the
+seller, so they are not on the pending queue of the seller. For each step it records:
+
+- opcode_cost: opcodes used by the group, from the dryrun of the signed transactions.
+- fees: fees paid by the group, inner transactions included.
+- state_bytes: size of the keys and values written on the global and local state.
+- latency_ms: wall-clock time to submit the group and wait for its confirmation.
+
+Usage:
+    python -m smartcontract.benchmark [-n 8] [-o results.json] [--baseline baseline.json]
+    python -m smartcontract.benchmark --opt-ins 16
+    python -m smartcontract.benchmark --dispatch
+
+With --baseline the command fails when a step costs more opcodes, fees or state bytes than on
+the baseline. The latency is reported but not compared, it depends on the machine.
+
+With --opt-ins it onboards that many accounts with the lazy opt-in of Ecommerce, and with an
+opt-in that writes the defaults of all the local state keys, and reports the totals of both.
+
+With --dispatch it runs the lifecycle of one order with the router checking Ecommerce.HOT_METHODS
+first, and with the router checking the methods in the order beaker collects them, and reports the
+opcodes saved on each step.
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+
+from algosdk.atomic_transaction_composer import AtomicTransactionComposer, TransactionWithSigner
+from algosdk.future import transaction
+from beaker import client, opt_in
+
+from .contract import Ecommerce
+from .localnet import Ledger, LocalAlgod
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baselines", "benchmark.json")
+"""Results of the current version, new changes are compared against it"""
+
+METRICS = ("opcode_cost", "fees", "state_bytes")
+STEPS = ("opt_in", "placeOrderToken", "oPostOrderUsdc", "takeOrder")
+USDC_SUPPLY = 10**12
+OPT_IN_FUNDS = 10**7
+
+
+def state_bytes(before: list[dict], after: list[dict]) -> int:
+    """Size of the keys written between two reads of a key-value store, as returned by algod"""
+    def decode(kv: list[dict]) -> dict:
+        return {base64.b64decode(v["key"]): v["value"] for v in kv}
+
+    before, after = decode(before), decode(after)
+    total = 0
+    for key in before.keys() | after.keys():
+        value = after.get(key)
+        if value == before.get(key):
+            continue
+        if value is None:
+            total += len(key)
+        elif value["type"] == 2:
+            total += len(key) + 8
+        else:
+            total += len(key) + len(base64.b64decode(value["bytes"]))
+    return total
+
+
+def inner_fees(info: dict) -> int:
+    return sum(i["txn"]["txn"].get("fee", 0) + inner_fees(i) for i in info.get("inner-txns", []))
+
+
+class EagerOptIn(Ecommerce):
+    """Ecommerce with the opt-in writing the defaults of the local state, as before the lazy initialization"""
+
+    @opt_in
+    def opt_in(self):
+        return self.acct_state.initialize()
+
+
+class Lifecycle:
+    """Accounts and application of one scenario, on its own ledger"""
+
+    def __init__(self, app: Ecommerce):
+        self.app = app
+        self.algod = LocalAlgod(Ledger())
+        self.admin, self.seller, self.buyer = self.algod.ledger.get_accounts()
+        self.admin_client = client.ApplicationClient(self.algod, app, signer=self.admin.signer)
+        self.admin_client.create()
+        self.buyer_client = client.ApplicationClient(self.algod, app, self.admin_client.app_id,
+                                                     signer=self.buyer.signer)
+        self.seller_client = client.ApplicationClient(self.algod, app, self.admin_client.app_id,
+                                                      signer=self.seller.signer)
+        self.usdc = self._create_usdc()
+
+        sp = self.algod.suggested_params()
+        self.admin_client.call(Ecommerce.setup, t=TransactionWithSigner(
+            transaction.PaymentTxn(self.admin.address, sp, self.admin_client.app_addr, int(1e7)), self.admin.signer))
+        self.admin_client.call(Ecommerce.addToken, a=self.usdc)
+        # The pending orders are indexed on the local state of the seller
+        self.seller_client.opt_in()
+
+    def _create_usdc(self) -> int:
+        sp = self.algod.suggested_params()
+        txn = transaction.AssetCreateTxn(self.admin.address, sp, USDC_SUPPLY, 6, False, unit_name="tusdc",
+                                         asset_name="USDC")
+        self.algod.send_transaction(txn.sign(self.admin.private_key))
+        usdc = self.algod.pending_transaction_info(txn.get_txid())["asset-index"]
+        for account in (self.seller, self.buyer):
+            self.algod.send_transaction(transaction.AssetOptInTxn(account.address, sp, usdc).sign(account.private_key))
+            self.algod.send_transaction(transaction.AssetTransferTxn(
+                self.admin.address, sp, account.address, 10**9, usdc).sign(self.admin.private_key))
+        return usdc
+
+    def order(self, n: int) -> list:
+        return [self.seller.address, f"order-{n}", 1, self.usdc, Ecommerce.ORDER_PENDING]
+
+    def _state(self, accounts: list[str]) -> list[list[dict]]:
+        app_id = self.admin_client.app_id
+        states = [self.algod.application_info(app_id)["params"].get("global-state", [])]
+        for addr in accounts:
+            info = self.algod.account_info(addr)
+            local = [s for s in info.get("apps-local-state", []) if s["id"] == app_id]
+            states.append(local[0].get("key-value", []) if local else [])
+        return states
+
+    def measure(self, atc: AtomicTransactionComposer, accounts: list[str]) -> dict:
+        """Dryrun the group to get its cost, then execute it"""
+        stxns = atc.gather_signatures()
+        dryrun = self.algod.dryrun(transaction.create_dryrun(self.algod, stxns))
+        opcode_cost = sum(t.get("budget-consumed", t.get("cost")) or 0 for t in dryrun["txns"])
+
+        before = self._state(accounts)
+        start = time.perf_counter()
+        result = atc.execute(self.algod, 4)
+        latency = time.perf_counter() - start
+        after = self._state(accounts)
+
+        fees = 0
+        for stxn, txid in zip(stxns, result.tx_ids):
+            fees += stxn.transaction.fee + inner_fees(self.algod.pending_transaction_info(txid))
+        return {
+            "opcode_cost": opcode_cost,
+            "fees": fees,
+            "state_bytes": sum(state_bytes(b, a) for b, a in zip(before, after)),
+            "latency_ms": round(latency * 1000, 3),
+        }
+
+    def opt_in(self, account=None) -> dict:
+        account = account or self.buyer
+        atc = AtomicTransactionComposer()
+        atc.add_transaction(TransactionWithSigner(transaction.ApplicationOptInTxn(
+            account.address, self.algod.suggested_params(), self.admin_client.app_id), account.signer))
+        return self.measure(atc, [account.address])
+
+    def place_order(self) -> dict:
+        sp = self.algod.suggested_params()
+        app_addr = self.admin_client.app_addr
+        atc = self.buyer_client.add_method_call(
+            AtomicTransactionComposer(), Ecommerce.placeOrderToken,
+            oracle_pay=TransactionWithSigner(
+                transaction.PaymentTxn(self.buyer.address, sp, app_addr, Ecommerce._oracle_fees), self.buyer.signer),
+            product_pay=TransactionWithSigner(
+                transaction.AssetTransferTxn(self.buyer.address, sp, app_addr, 1, self.usdc), self.buyer.signer),
+            token_=self.usdc,
+        )
+        return self.measure(atc, [self.buyer.address])
+
+    def post_order(self, n: int) -> dict:
+        atc = self.admin_client.add_method_call(
+            AtomicTransactionComposer(), Ecommerce.oPostOrderUsdc, acct=self.buyer.address, amt=1, o=self.order(n),
+            accounts=[self.seller.address])
+        return self.measure(atc, [self.buyer.address, self.seller.address])
+
+    def take_order(self, n: int) -> dict:
+        atc = self.seller_client.add_method_call(
+            AtomicTransactionComposer(), Ecommerce.takeOrder, acct=self.buyer.address, order_id=f"order-{n}")
+        return self.measure(atc, [self.buyer.address, self.seller.address])
+
+
+def scenario(app: Ecommerce, n: int) -> dict:
+    """Run the lifecycle of the n-th order of a buyer"""
+    lifecycle = Lifecycle(app)
+    steps = {"opt_in": lifecycle.opt_in()}
+    for i in range(1, n):
+        lifecycle.admin_client.call(Ecommerce.oPostOrderUsdc, acct=lifecycle.buyer.address, amt=1,
+                                    o=lifecycle.order(i), accounts=[lifecycle.seller.address])
+        lifecycle.seller_client.call(Ecommerce.takeOrder, acct=lifecycle.buyer.address, order_id=f"order-{i}")
+    steps["placeOrderToken"] = lifecycle.place_order()
+    steps["oPostOrderUsdc"] = lifecycle.post_order(n)
+    steps["takeOrder"] = lifecycle.take_order(n)
+    return steps
+
+
+def benchmark(orders: int = None) -> dict:
+    app = Ecommerce()
+    orders = orders or Ecommerce._Ecommerce__ORDER_LIST_MAX
+    return {
+        "orders": orders,
+        "scenarios": {str(n): scenario(app, n) for n in range(1, orders + 1)},
+    }
+
+
+def onboarding(app: Ecommerce, accounts: int) -> dict:
+    """Totals of the opt-in of new accounts"""
+    lifecycle = Lifecycle(app)
+    totals = dict.fromkeys(METRICS + ("latency_ms",), 0)
+    for _ in range(accounts):
+        account = lifecycle.algod.ledger.new_account(OPT_IN_FUNDS)
+        for metric, value in lifecycle.opt_in(account).items():
+            totals[metric] += value
+    totals["latency_ms"] = round(totals["latency_ms"], 3)
+    return totals
+
+
+def opt_in_savings(accounts: int = 16) -> dict:
+    """Compare the lazy opt-in with an opt-in that initializes the whole local state"""
+    lazy = onboarding(Ecommerce(), accounts)
+    eager = onboarding(EagerOptIn(artifacts_dir=None), accounts)
+    return {
+        "accounts": accounts,
+        "lazy": lazy,
+        "eager": eager,
+        "saved": {metric: eager[metric] - lazy[metric] for metric in METRICS},
+    }
+
+
+def dispatch_savings() -> dict:
+    """Compare the router checking the hot methods first with the router of beaker"""
+    hot = scenario(Ecommerce(), 1)
+    beaker_order = scenario(Ecommerce(artifacts_dir=None, dispatch_order=()), 1)
+    return {
+        "hot_methods": list(Ecommerce.HOT_METHODS),
+        "opcode_cost": {step: hot[step]["opcode_cost"] for step in STEPS[1:]},
+        "saved": {step: beaker_order[step]["opcode_cost"] - hot[step]["opcode_cost"] for step in STEPS[1:]},
+    }
+
+
+def regressions(report: dict, baseline: dict) -> list[str]:
+    """Return a message for each step that costs more than on the baseline"""
+    messages = []
+    for n, steps in report["scenarios"].items():
+        for step, current in steps.items():
+            previous = baseline.get("scenarios", {}).get(n, {}).get(step)
+            if previous is None:
+                continue
+            for metric in METRICS:
+                if current[metric] > previous[metric]:
+                    messages.append(f"{n} orders, {step}: {metric} {previous[metric]} -> {current[metric]}")
+    return messages
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-n", "--orders", type=int, help="sweep buyers holding from 1 to this number of orders")
+    parser.add_argument("-o", "--output", help="write the results to this file instead of stdout")
+    parser.add_argument("--baseline", help="fail if a step costs more than on these results")
+    parser.add_argument("--opt-ins", type=int, help="compare the lazy and eager opt-in of this number of accounts")
+    parser.add_argument("--dispatch", action="store_true", help="report the opcodes saved by the hot method router")
+    args = parser.parse_args(argv)
+
+    if args.opt_ins:
+        report = opt_in_savings(args.opt_ins)
+    elif args.dispatch:
+        report = dispatch_savings()
+    else:
+        report = benchmark(args.orders)
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline and not (args.opt_ins or args.dispatch):
+        with open(args.baseline) as f:
+            messages = regressions(report, json.load(f))
+        for message in messages:
+            print(f"regression: {message}", file=sys.stderr)
+        if messages:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
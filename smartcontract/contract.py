@@ -1,5 +1,6 @@
 from pyteal import *
-from typing import Final
+from typing import Final, Literal, Optional, Sequence
+from algosdk.encoding import checksum
 from beaker import (
     Application,
     update,
@@ -30,7 +31,75 @@ class Ecommerce(Application):
     """Default comission for sellers"""
     _seller_cost = 4000
     """Default cost to be a seller"""
-    __ORDER_LIST_MAX = 7
+    _post_order_cost = 860
+    """Opcode budget needed to post one order"""
+    _settle_order_cost = 1100
+    """Opcode budget needed to settle one order"""
+    _sweep_account_cost = 700
+    """Opcode budget needed to scan the order list of one account, the orders swept are settled"""
+    _archive_order_cost = 400
+    """Opcode budget needed to archive one order, the peaks of the archive are merged"""
+    _order_ttl = 30000
+    """Default rounds a pending order waits for the seller before it can be swept, about one day"""
+    __ORDER_LIST_MAX = 8
+    """Max orders per account, all the local state keys not used by other variables are used by the order list"""
+    __ORDER_KEY_LEN = 8
+    __ORDER_BITMAP_LEN = (__ORDER_LIST_MAX + 7) // 8
+    __ARCHIVE_ROOT = __ORDER_BITMAP_LEN + __ORDER_KEY_LEN * __ORDER_LIST_MAX
+    __ARCHIVE_COUNT = __ARCHIVE_ROOT + 32
+    __ORDER_KEYS_LEN = __ARCHIVE_COUNT + 8
+    """The order keys end with the root of the archive of the account and the number of orders archived"""
+    __POST_BATCH_MAX = 4
+    """
+    Max orders posted, placed or settled in one call. An application call references at most 4 foreign accounts,
+    and the buyers and the sellers of the pending orders share them: a batch of 4 orders needs the orders to share
+    accounts (one seller and 3 buyers, one buyer and 3 sellers, or several orders of the same buyer and seller),
+    4 distinct buyer/seller pairs take 2 calls of 2 orders. The cart reaches 4 sellers, its buyer is the sender.
+    The events of 4 orders take 688 of the 1024 bytes of logs of a call.
+    """
+    __TOKEN_MAX = 8
+    """Max tokens on the token registry, the slot 0 is used by algos"""
+    __QUEUE_PAGES = 4
+    """Local state keys of the seller queue, all the keys not used by the buyer variables"""
+    __ORDER_REF_LEN = 40
+    __QUEUE_PAGE_REFS = 3
+    """Order references on each page of the seller queue, a local state value has at most 128 bytes with its key"""
+    __ORACLE_MAX = 8
+    """Max oracle workers registered besides the oracle address"""
+    __SWEEP_MAX = 8
+    """
+    Max orders swept in one call, the refunds are one group of inner transactions. Each order swept logs
+    OrderStatus (69 bytes) and Payout (53 bytes), 8 orders take 976 of the 1024 bytes of logs of a call.
+    """
+    __ARCHIVE_MAX = 7
+    """Max orders archived in one call, the OrderArchived events of a call must fit in 1024 bytes of logs"""
+    __FEE_BASE = 100000
+    """The comission fees are in thousandths of a percent"""
+    HOT_METHODS = (
+        "placeOrderToken",
+        "oPostOrderUsdc",
+        "takeOrder",
+        "placeOrderDirect",
+        "placeOrderCart",
+        "oPostOrdersBatch",
+        "takeOrderByKey",
+        "settleOrders",
+        "addDeposit",
+    )
+    """
+    Methods checked first by the router, by expected call frequency: each order is placed, posted,
+    taken and settled, the setup and read-only methods follow in declaration order.
+    """
+
+    # Offsets of the fields on the order record
+    RECORD_SELLER = 0
+    RECORD_HASH = 32
+    RECORD_AMOUNT = 64
+    RECORD_TOKEN = 72
+    RECORD_STATUS = 73
+    RECORD_INDEX = 74
+    RECORD_EXPIRES = 75
+    RECORD_LEN = 83
 
     # Define status for the orders
     ORDER_PENDING = 0
@@ -38,6 +107,22 @@ class Ecommerce(Application):
     ORDER_CANCELLED = 2
     ORDER_COMPLETED = 3
 
+    EVENTS = {
+        "OrderPlaced": (("buyer", "address"), ("token", "uint64"), ("amount", "uint64")),
+        "OrderStored": (("buyer", "address"), ("seller", "address"), ("order_hash", "byte[32]"),
+                        ("amount", "uint64"), ("token", "uint8"), ("status", "uint8"), ("index", "uint8"),
+                        ("expires", "uint64")),
+        "OrderStatus": (("buyer", "address"), ("order_hash", "byte[32]"), ("status", "uint8")),
+        "Deposit": (("account", "address"), ("token", "uint8"), ("amount", "uint64"), ("balance", "uint64")),
+        "Payout": (("receiver", "address"), ("token", "uint8"), ("amount", "uint64"), ("comission", "uint64")),
+        "OrderArchived": (("buyer", "address"), ("leaf", "uint64"), ("record", "byte[83]")),
+    }
+    """
+    ARC-28 events logged when the orders or the deposits change, the arguments of each event.
+    All the arguments have a static size, so the payload has a fixed layout. The tokens are
+    slots of the token registry, except on OrderPlaced where it is the asset id sent by the buyer.
+    """
+
     ###########################################
     # DEFINE STRUCTURES FOR THE SMARTCONTRACT #
     ###########################################
@@ -53,6 +138,49 @@ class Ecommerce(Application):
         token: abi.Field[abi.Uint64]
         status: abi.Field[abi.Uint8]
 
+    class OrderRecord(abi.NamedTuple):
+        """
+        Define how the order is stored on the buyer local state,
+        all the fields have a fixed size, so they are read with extract at static offsets.
+        """
+        seller: abi.Field[abi.Address]
+        order_hash: abi.Field[abi.StaticBytes[Literal[32]]]    # sha256 of the order id
+        amount: abi.Field[abi.Uint64]
+        token: abi.Field[abi.Uint8]                             # Slot of the token on the token registry
+        status: abi.Field[abi.Uint8]
+        index: abi.Field[abi.Uint8]                             # Slot of the order on the order list
+        expires: abi.Field[abi.Uint64]                          # Last round the order can stay pending
+
+    class AccountBalances(abi.NamedTuple):
+        """
+        Deposits of the buyer and incomes of the seller for each slot of the token registry,
+        and the number of slots of the order list used at least once.
+        """
+        deposits: abi.Field[abi.StaticArray[abi.Uint64, Literal[8]]]   # One balance per token slot, __TOKEN_MAX
+        incomes: abi.Field[abi.StaticArray[abi.Uint64, Literal[8]]]
+        order_index: abi.Field[abi.Uint64]
+
+    class OrderRef(abi.NamedTuple):
+        """
+        Reference to an order on the seller queue, the buyer account and the key of the order.
+        """
+        buyer: abi.Field[abi.Address]
+        order_key: abi.Field[abi.StaticBytes[Literal[8]]]
+
+    class CartItem(abi.NamedTuple):
+        """
+        Order of a cart, the token is the one sent to pay the cart and the order is stored pending.
+        """
+        seller: abi.Field[abi.Address]
+        order_id: abi.Field[abi.String]
+        amount: abi.Field[abi.Uint64]
+
+    class SlotUsage(abi.NamedTuple):
+        """
+        Count the slots of the order list used by live orders, and the slots free to be reused.
+        """
+        live: abi.Field[abi.Uint8]
+        free: abi.Field[abi.Uint8]
 
     #################################################
     # DEFINE ALL GLOBAL STATE FOR THE SMARTCONTRACT #
@@ -73,22 +201,43 @@ class Ecommerce(Application):
     )
     """Define the oracle address."""
 
-    ealgos: Final[ApplicationStateValue] = ApplicationStateValue(
+    oracle_workers: Final[DynamicApplicationStateValue] = DynamicApplicationStateValue(
         stack_type=TealType.uint64,
-        default = Int(0)
+        max_keys=__ORACLE_MAX,
+        descr="Oracle workers allowed to act as the oracle address, keyed by the worker address."
     )
-    """Count earning made in algos."""
-    eusdc: Final[ApplicationStateValue] = ApplicationStateValue(
+    """Set of oracle workers, each worker posts orders from its own key so the oracle can run several processes."""
+
+    oracle_count: Final[ApplicationStateValue] = ApplicationStateValue(
         stack_type=TealType.uint64,
-        default = Int(0)
+        key=Bytes("oc"),
+        default=Int(0),
+        descr="Number of oracle workers registered."
+    )
+    """The workers share the uint keys of the global schema with the token slots, the count keeps them to their share."""
+
+    earnings: Final[ApplicationStateValue] = ApplicationStateValue(
+        stack_type=TealType.bytes,
+        key=Bytes("e"),
+        default=BytesZero(Int(8 * __TOKEN_MAX)),
+        descr="Earnings of the smartcontract, one uint64 for each slot of the token registry."
     )
-    """Count earning made in usdc."""
+    """Count earning made in each token."""
 
-    eusdt: Final[ApplicationStateValue] = ApplicationStateValue(
+    tokens: Final[ApplicationStateValue] = ApplicationStateValue(
+        stack_type=TealType.bytes,
+        key=Bytes("tk"),
+        default=Itob(Int(0)),
+        descr="Asset id of the token registered on each slot, the slot 0 is algos."
+    )
+    """Token registry, the asset id of each token enabled for payment."""
+
+    token_slots: Final[DynamicApplicationStateValue] = DynamicApplicationStateValue(
         stack_type=TealType.uint64,
-        default = Int(0)
+        max_keys=__TOKEN_MAX,
+        descr="Slot on the token registry, keyed by the asset id."
     )
-    """Count earning made in usdt."""
+    """Find the slot of a token on the registry without scanning it."""
 
     comission_fees: Final[ApplicationStateValue] = ApplicationStateValue(
         stack_type=TealType.uint64,
@@ -115,6 +264,14 @@ class Ecommerce(Application):
     )
     """Cost for becoming a seller, this algos will use as insurance."""
 
+    order_ttl: Final[ApplicationStateValue] = ApplicationStateValue(
+        stack_type=TealType.uint64,
+        key=Bytes("ot"),
+        default=Int(_order_ttl),
+        descr="Rounds a pending order waits for the seller, after them anyone can cancel it with sweepExpired."
+    )
+    """Time to live of the pending orders, in rounds."""
+
     ################################################
     # DEFINE ALL LOCAL STATE FOR THE SMARTCONTRACT #
     ################################################
@@ -122,88 +279,202 @@ class Ecommerce(Application):
     ###################
     # BUYER VARIABLES #
     ###################
-    dalgo: Final[AccountStateValue] = AccountStateValue(
-        stack_type = TealType.uint64,
-        default = Int(0)
-    )
-    dusdc: Final[AccountStateValue] = AccountStateValue(
-        stack_type = TealType.uint64,
-        default = Int(0)
-    )
-    dusdt: Final[AccountStateValue] = AccountStateValue(
-        stack_type = TealType.uint64,
-        default = Int(0)
-    )
-    dmy_token: Final[AccountStateValue] = AccountStateValue(
-        stack_type = TealType.uint64,
-        default = Int(0)
+    deposits: Final[AccountStateValue] = AccountStateValue(
+        stack_type=TealType.bytes,
+        key=Bytes("d"),
+        default=BytesZero(Int(8 * __TOKEN_MAX)),
+        descr="Deposits of the buyer, one uint64 for each slot of the token registry."
     )
+    """Tokens deposited by the buyer, a new token added to the registry doesn't need a new key."""
 
     orders: Final[DynamicAccountStateValue] = DynamicAccountStateValue(
         stack_type=TealType.bytes,
         max_keys=__ORDER_LIST_MAX,
-        descr="Current order posted by the buyer."
+        descr="Current order posted by the buyer, keyed by the hash of the order id."
     )
     """List of orders posted by the buyer."""
 
+    order_keys: Final[AccountStateValue] = AccountStateValue(
+        stack_type=TealType.bytes,
+        key=Bytes("ok"),
+        default=BytesZero(Int(__ORDER_KEYS_LEN)),
+        descr="Bitmap of the slots used by live orders, the key of the order stored on each slot, "
+              "the root of the archived orders and their number"
+    )
+    """
+    Map each slot of the order list to the key where the order is stored,
+    the first bytes are a bitmap with the slots used by pending or accepted orders.
+    The value ends with the Merkle root of the orders moved to the archive by archiveOrders, and the
+    number of orders archived. Values written before the archive existed end after the keys.
+    """
+
     order_index: Final[AccountStateValue] = AccountStateValue(
         stack_type = TealType.uint64,
         default = Int(0),
         key=Bytes("oi"),
-        descr = "Manage the current index for the order list array"
+        descr = "Number of slots of the order list used at least once"
     )
-    """Manage the current key position for the orders"""
+    """Manage the current key position for the orders, slots bellow this index were used at least once"""
 
     ####################
     # SELLER VARIABLES #
     ####################
-    ialgo: Final[AccountStateValue] = AccountStateValue(
-        stack_type = TealType.uint64,
-        default = Int(0)
-    )
-    iusdc: Final[AccountStateValue] = AccountStateValue(
-        stack_type = TealType.uint64,
-        default = Int(0)
-    )
-    iusdt: Final[AccountStateValue] = AccountStateValue(
-        stack_type = TealType.uint64,
-        default = Int(0)
+    seller_queue: Final[DynamicAccountStateValue] = DynamicAccountStateValue(
+        stack_type=TealType.bytes,
+        max_keys=__QUEUE_PAGES,
+        descr="Pending orders addressed to the seller, each page has up to 3 references: buyer address and order key."
     )
-    imy_token: Final[AccountStateValue] = AccountStateValue(
-        stack_type = TealType.uint64,
-        default = Int(0)
+    """Queue of the pending orders of the seller, so the seller can find them without knowing the buyers."""
+
+    incomes: Final[AccountStateValue] = AccountStateValue(
+        stack_type=TealType.bytes,
+        key=Bytes("i"),
+        default=BytesZero(Int(8 * __TOKEN_MAX)),
+        descr="Incomes of the seller, one uint64 for each slot of the token registry."
     )
+    """Tokens received by the seller for selling products."""
+
+    def __init__(self, artifacts_dir: Optional[str] = "", dispatch_order: Optional[Sequence[str]] = None):
+        """
+        The programs are loaded from the artifacts in artifacts_dir (the default directory when empty)
+        if they were built from this source. With None the PyTeal is always compiled.
+        dispatch_order replaces HOT_METHODS, e.g. with the method names sorted by the calls measured
+        on the network, the programs are compiled then.
+        """
+        self.artifacts_dir = artifacts_dir
+        self.dispatch_order = dispatch_order
+        super().__init__()
+
+    def compile(self):
+        """
+        Use the cached artifacts when they are fresh, otherwise compile the PyTeal and write them for the next run.
+        Subclasses are always compiled.
+        """
+        from .artifacts import ARTIFACTS_DIR, load, save
+
+        cached = self.artifacts_dir is not None and self.dispatch_order is None and type(self) is Ecommerce
+        directory = self.artifacts_dir or ARTIFACTS_DIR
+        artifacts = load(directory) if cached else None
+        if artifacts is None:
+            self.methods = self.routed_methods()
+            programs = super().compile()
+            if cached:
+                try:
+                    save(self, directory)
+                except OSError:
+                    pass    # A read-only install compiles on each run
+            return programs
+        self.approval_program, self.clear_program, self.contract = artifacts
+
+    def routed_methods(self) -> dict:
+        """
+        The methods in the order the router compares their selectors, each comparison costs 4 opcodes.
+        AVM 7 has no match opcode for a jump table, so the most called methods are compared first.
+        """
+        hot = self.HOT_METHODS if self.dispatch_order is None else self.dispatch_order
+        unknown = set(hot) - set(self.methods)
+        if unknown:
+            raise ValueError(f"Unknown methods on the dispatch order: {sorted(unknown)}")
+        first = {name: self.methods[name] for name in hot}
+        return {**first, **{name: m for name, m in self.methods.items() if name not in first}}
 
     @create
     def create(self):
         """On deploy application."""
         return Seq(
             self.initialize_application_state(),
-            self.admin.set(Txn.sender())
+            self.admin.set(Txn.sender()),
+            self.token_slots[Itob(Int(0))].set(Int(0))
         )
 
+    @update(authorize=Authorize.only(Global.creator_address()))
+    def update(self):
+        """Upgrade the programs, they are deployed from the cached artifacts by artifacts.update_app"""
+        return Approve()
+
     @opt_in
     def opt_in(self):
-        """Account registered into the smartcontract"""
-        return self.acct_state.initialize()
-        return self.initialize_account_state()
+        """
+        Account registered into the smartcontract, the local state is not written:
+        the keys are created on the first write, and a missing key is read as its default.
+        """
+        return Approve()
+
+    @classmethod
+    def event_signature(cls, event: str) -> str:
+        return f"{event}({','.join(arc4_type for _, arc4_type in cls.EVENTS[event])})"
+
+    @classmethod
+    def event_selector(cls, event: str) -> bytes:
+        """First 4 bytes of the sha512/256 of the event signature"""
+        return checksum(cls.event_signature(event).encode())[:4]
+
+    def emit(self, event: str, *args: Expr) -> Expr:
+        """Log the event, the arguments must be already encoded."""
+        return Log(Concat(Bytes(self.event_selector(event)), *args))
+
+    def stored(self, value: AccountStateValue) -> Expr:
+        """Read the account state value, or its default when the key was not written yet."""
+        # AccountStateValue.get_else doesn't evaluate app_local_get_ex before reading its result
+        return Seq(
+            (v := value.get_maybe()),
+            If(v.hasValue(), v.value(), value.default)
+        )
+
+    @internal(TealType.bytes)
+    def storedOrderKeys(self, acct):
+        """
+        Read the order keys of the account, or their default. The program is close to the 256 scratch slots,
+        each inline read takes its own slots, the reads through this subroutine share them.
+        """
+        return self.stored(self.order_keys[acct])
+
+    @internal(TealType.bytes)
+    def storedDeposits(self, acct):
+        """Read the deposits of the account, or their default."""
+        return self.stored(self.deposits[acct])
+
+    @internal(TealType.none)
+    def ensureBudget(self, budget):
+        """Increase the opcode budget with inner calls paid by the fee of the transaction, OpUp takes its own slots."""
+        return OpUp(OpUpMode.OnCall).ensure_budget(budget)
 
     @internal(TealType.uint64)
     def isAdmin(self):
-        """Check if the sender is the administrator for the smarcontract."""
+        """Check if the sender is the administrator for the smarcontract, the oracle or a registered oracle worker."""
         return Or(
             Txn.sender() == self.admin,
-            Txn.sender() == self.oracle_address
+            Txn.sender() == self.oracle_address,
+            self.isOracleWorker(Txn.sender())
         )
 
         # return If( Txn.sender() == self.admin, Return(Int(1)),Return(Int(0)))
 
+    @internal(TealType.uint64)
+    def isOracleWorker(self, addr):
+        """Check if the address is a registered oracle worker, the checks of all the methods share the slots."""
+        a = ScratchVar(TealType.bytes)
+        return Seq(
+            a.store(addr),
+            self.oracle_workers[a.load()].exists()
+        )
+
     @external(authorize=Authorize.only(Global.creator_address()))
     def addToken(self,
                  a: abi.Asset,
                  *, output:abi.String):
         """Enable new tokens for payment"""
+        slot = ScratchVar(TealType.uint64)
         return Seq(
+            Assert(
+                Not(self.token_slots[Itob(a.asset_id())].exists()),
+            ),
+            slot.store(Len(self.tokens) / Int(8)),
+            Assert(
+                slot.load() < Int(self.__TOKEN_MAX), # The token registry is full
+            ),
+            self.tokens.set(Concat(self.tokens, Itob(a.asset_id()))),
+            self.token_slots[Itob(a.asset_id())].set(slot.load()),
             InnerTxnBuilder.Begin(),
             InnerTxnBuilder.SetFields(
                 {
@@ -217,6 +488,64 @@ class Ecommerce(Application):
             output.set("new_token_added")
         )
 
+    @external(authorize=Authorize.only(Global.creator_address()))
+    def addOracle(self,
+                  a: abi.Address,
+                  *, output: abi.String):
+        """Register a new oracle worker, up to __ORACLE_MAX."""
+        return Seq(
+            Assert(
+                Not(self.isOracleWorker(a.get())),
+                self.oracle_count < Int(self.__ORACLE_MAX),    # The set of workers is full
+            ),
+            self.oracle_workers[a.get()].set(Int(1)),
+            self.oracle_count.increment(),
+            output.set("oracle_added")
+        )
+
+    @external(authorize=Authorize.only(Global.creator_address()))
+    def removeOracle(self,
+                     a: abi.Address,
+                     *, output: abi.String):
+        """Remove the oracle worker, its calls are rejected from now on."""
+        return Seq(
+            Assert(
+                self.isOracleWorker(a.get()),
+            ),
+            self.oracle_workers[a.get()].delete(),
+            self.oracle_count.decrement(),
+            output.set("oracle_removed")
+        )
+
+    @external(authorize=Authorize.only(Global.creator_address()))
+    def rotateOracle(self,
+                     old: abi.Address,
+                     new: abi.Address,
+                     *, output: abi.String):
+        """Replace the key of an oracle worker in one call, the old key is rejected from now on."""
+        return Seq(
+            Assert(
+                self.isOracleWorker(old.get()),
+                Not(self.isOracleWorker(new.get())),
+            ),
+            self.oracle_workers[old.get()].delete(),
+            self.oracle_workers[new.get()].set(Int(1)),
+            output.set("oracle_rotated")
+        )
+
+    @external(authorize=Authorize.only(Global.creator_address()))
+    def setOrderTtl(self,
+                    rounds: abi.Uint64,
+                    *, output: abi.String):
+        """Set the rounds a new order can stay pending, the orders already stored keep their expiry round."""
+        return Seq(
+            Assert(
+                rounds.get() > Int(0),
+            ),
+            self.order_ttl.set(rounds.get()),
+            output.set("order_ttl_updated")
+        )
+
     @external(authorize=Authorize.only(Global.creator_address()))
     def setup(self,
               t: abi.PaymentTransaction,
@@ -241,75 +570,125 @@ class Ecommerce(Application):
         return Int(1)
 
     @external
-    def addDepositUsdc(
+    def addDeposit(
             self,
             acct: abi.Account,
+            token: abi.Uint64,      # Asset id, 0 for algos
             amt: abi.Uint64
         ):
-        # TODO: only admin or the oracle  can do this
-        #
-        return Seq(
-            Assert(
-                self.isAdmin() == Int(1)
-            ),
-            self.dusdc[acct.address()].increment(amt.get())
-        )
-    @external
-    def addDepositAlgo(
-            self,
-            acct: abi.Account,
-            amount: abi.Uint64
-        ):
         return Seq(
             Assert(
                 self.isAdmin() == Int(1)
             ),
-            self.dalgo[acct.address()].increment(amount.get())
+            self.deposit(acct.address(), self.tokenSlot(token.get()), amt.get())
         )
 
     @external(read_only=True)
-    def getDepositUsdc(self,acct: abi.Account,*,output: abi.Uint64):
-        """Get deposit for a specific token using the index"""
-        return Seq(
-            output.set(self.dusdc[acct.address()]),
+    def getDeposit(self,acct: abi.Account,token: abi.Uint64,*,output: abi.Uint64):
+        """Get deposit for a specific token, 0 is algos"""
+        return output.set(self.balance(self.storedDeposits(acct.address()), self.tokenSlot(token.get())))
 
-        )
+    @external(read_only=True)
+    def getIncome(self,acct: abi.Account,token: abi.Uint64,*,output: abi.Uint64):
+        """Get income for a specific token, 0 is algos"""
+        return output.set(self.balance(self.stored(self.incomes[acct.address()]), self.tokenSlot(token.get())))
 
     @external(read_only=True)
-    def getDepositAlgo(self,acct: abi.Account,*,output: abi.Uint64):
-        """Get deposit for a specific token using the index"""
-        return Seq(
-            output.set(self.dalgo[acct.address()]),
-        )
+    def getCurrentIndex(
+            self,
+            acct: abi.Account,
+            *, output: abi.Uint64):
+        return output.set(self.order_index[acct.address()])
+
     @external(read_only=True)
-    def getIncomeUsdc(self,addr: abi.Account,*,output: abi.Uint64):
-        """Get income for a specific token using the index"""
-        return Seq(
-            output.set(self.iusdc[addr.address()]),
-        )
+    def getOrderIndex(
+            self,
+            i: abi.Uint8,
+            acct: abi.Account,
+            *, output: OrderRecord):
+        return output.decode(self.orders[self.slotKey(acct.address(), i.get())][acct.address()])
 
     @external(read_only=True)
-    def getIncomeAlgo(self,acct: abi.Account,*,output: abi.Uint64):
-        """Get income for a specific token using the index"""
+    def getOrders(
+            self,
+            start: abi.Uint8,
+            count: abi.Uint8,
+            acct: abi.Account,
+            *, output: abi.DynamicArray[OrderRecord]):
+        """Get the orders stored on count slots of the order list from start, the slots never used are skipped."""
+        end = ScratchVar(TealType.uint64)
         return Seq(
-            output.set(self.ialgo[acct.address()]),
+            end.store(start.get() + count.get()),
+            If(end.load() > self.order_index[acct.address()]).Then(
+                end.store(self.order_index[acct.address()])
+            ),
+            If(start.get() > end.load()).Then(
+                end.store(start.get())
+            ),
+            output.decode(self.orderList(acct.address(), start.get(), end.load()))
         )
 
     @external(read_only=True)
-    def getCurrentIndex(
+    def getAccountSnapshot(
             self,
             acct: abi.Account,
-            *, output: abi.Uint64):
-        return output.set(self.order_index[acct.address()])
+            *, output: abi.Tuple2[AccountBalances, abi.DynamicArray[OrderRecord]]):
+        """
+        Get the deposits, incomes, order index and all the orders of the account in one call,
+        instead of one call for each field and each slot of the order list.
+        """
+        return output.decode(
+            # The balance vectors are already encoded as uint64[8], the head of the tuple ends with
+            # the offset of the order list
+            Concat(
+                self.storedDeposits(acct.address()),
+                self.stored(self.incomes[acct.address()]),
+                Itob(self.order_index[acct.address()]),
+                Suffix(Itob(Int(2 * 8 * self.__TOKEN_MAX + 8 + 2)), Int(6)),
+                self.orderList(acct.address(), Int(0), self.order_index[acct.address()])
+            )
+        )
 
     @external(read_only=True)
-    def getOrderIndex(
+    def getSellerQueue(
+            self,
+            seller: abi.Account,
+            *, output: abi.DynamicArray[OrderRef]):
+        """Get the references of the pending orders addressed to the seller."""
+        page = ScratchVar(TealType.uint64)
+        refs = ScratchVar(TealType.bytes)
+        return Seq(
+            refs.store(Bytes("")),
+            For(page.store(Int(0)), page.load() < Int(self.__QUEUE_PAGES), page.store(page.load() + Int(1))).Do(
+                (stored := self.seller_queue[self.queueKey(page.load())][seller.address()].get_maybe()),
+                If(stored.hasValue()).Then(
+                    refs.store(Concat(refs.load(), stored.value()))
+                )
+            ),
+            output.decode(
+                Concat(Suffix(Itob(Len(refs.load()) / Int(self.__ORDER_REF_LEN)), Int(6)), refs.load())
+            )
+        )
+
+    @external(read_only=True)
+    def getSlotUsage(
             self,
-            i: abi.Uint8,
             acct: abi.Account,
-            *, output: abi.String):
-        # TODO: Error when using read_only
-        return output.decode(self.orders[i][acct.address()])
+            *, output: SlotUsage):
+        """Count the slots used by live orders and the slots that can be used by new orders."""
+        bitmap = ScratchVar(TealType.bytes)
+        i = ScratchVar(TealType.uint64)
+        n = ScratchVar(TealType.uint64)
+        return Seq(
+            bitmap.store(self.storedOrderKeys(acct.address())),
+            n.store(Int(0)),
+            For(i.store(Int(0)), i.load() < Int(self.__ORDER_LIST_MAX), i.store(i.load() + Int(1))).Do(
+                n.store(n.load() + GetBit(bitmap.load(), i.load()))
+            ),
+            (live := abi.Uint8()).set(n.load()),
+            (free := abi.Uint8()).set(Int(self.__ORDER_LIST_MAX) - n.load()),
+            output.set(live, free)
+        )
 
     @external(authorize=Authorize.only(Global.creator_address()))
     def setOrderIndex(
@@ -320,33 +699,382 @@ class Ecommerce(Application):
             ):
         return Seq(
             Assert(
-                self.isAdmin() == Int(1)
+                self.isAdmin() == Int(1),
+                i.get() < Int(self.__ORDER_LIST_MAX)
+            ),
+            self.storeOrder(acct.address(), i.get(), self.orderRecord(o))
+        )
+
+    @external(authorize=Authorize.only(Global.creator_address()))
+    def migrateOrder(
+            self,
+            i: abi.Uint8,
+            acct: abi.Account,
+            *, output: abi.String):
+        """
+        Encode again the order stored on the slot i with the old Order tuple, as an OrderRecord.
+        The order keeps its key, both encodings are keyed by the hash of the order id.
+        The records stored before the expiry round was added expire after the time to live from now.
+        The orders of an application deployed with the first program (keyed by the slot, with the deposits on
+        their own keys) can't be migrated: that program can't be updated, and the local schema is fixed on
+        create. Those applications must be redeployed, and the buyers post their live orders again.
+        """
+        v = ScratchVar(TealType.bytes)
+        return Seq(
+            Assert(
+                i.get() < Int(self.__ORDER_LIST_MAX)
             ),
-            self.orders[i][acct.address()].set(o.encode())
+            v.store(self.orders[self.slotKey(acct.address(), i.get())][acct.address()].get()),   # Fails below when missing
+            # The Order tuple has 51 bytes of head, the order id offset is 51 and the string is the tail
+            If(
+                And(
+                    ExtractUint16(v.load(), Int(32)) == Int(51),
+                    Len(v.load()) == Int(53) + ExtractUint16(v.load(), Int(51))
+                )
+            )
+            .Then(
+                (o := self.Order()).decode(v.load()),
+                self.storeOrder(acct.address(), i.get(), self.orderRecord(o)),
+                output.set("order_migrated")
+            )
+            .ElseIf(Len(v.load()) == Int(self.RECORD_EXPIRES))
+            .Then(
+                self.orders[self.slotKey(acct.address(), i.get())][acct.address()].set(
+                    Concat(v.load(), Itob(Global.round() + self.order_ttl))
+                ),
+                output.set("order_migrated")
+            )
+            .Else(
+                output.set("order_already_migrated")
+            )
         )
 
     @internal(TealType.uint64)
-    def searchOrderIndex(self,acct,order_id: abi.String):
+    def tokenSlot(self, asset_id):
+        """Return the slot of the token on the registry, fail if the token was not added."""
+        return self.token_slots[Itob(asset_id)].get_must()
+
+    @internal(TealType.uint64)
+    def balance(self, balances, slot):
+        """Read the balance of the token slot on a balance vector, the uint64 of each slot is at offset 8 * slot."""
+        return ExtractUint64(balances, slot * Int(8))
+
+    @internal(TealType.bytes)
+    def credit(self, balances, slot, amount):
+        """Return the balance vector with amount added to the balance of the token slot."""
+        return Replace(balances, slot * Int(8), Itob(ExtractUint64(balances, slot * Int(8)) + amount))
+
+    @internal(TealType.none)
+    def deposit(self, acct, slot, amount):
+        """Add amount to the deposit of the account in the token slot, and log the Deposit event."""
+        balances = ScratchVar(TealType.bytes)
+        return Seq(
+            balances.store(self.credit(self.storedDeposits(acct), slot, amount)),
+            self.deposits[acct].set(balances.load()),
+            self.emit("Deposit", acct, Suffix(Itob(slot), Int(7)), Itob(amount),
+                      Extract(balances.load(), slot * Int(8), Int(8)))
+        )
+
+    @internal(TealType.bytes)
+    def debit(self, balances, slot, amount):
+        """Return the balance vector with amount taken from the balance of the token slot, fail if it is not enough."""
+        return Replace(balances, slot * Int(8), Itob(ExtractUint64(balances, slot * Int(8)) - amount))
+
+    @internal(TealType.none)
+    def payout(self, receiver, slot, amount, comission):
         """
-        Check if the account has the order on his list, and return the index,
-        Return 0 if doesn't has the order, otherwise return the index + 1,
-        because pyteal do not support negative numbers.
+        Set the fields of the inner transaction sending amount of the token slot to the receiver,
+        the fee is 0 so it is paid by the outer transaction.
+        """
+        token = ScratchVar(TealType.uint64)
+        return Seq(
+            token.store(ExtractUint64(self.tokens, slot * Int(8))),
+            If(token.load() == Int(0))
+            .Then(
+                InnerTxnBuilder.SetFields({
+                    TxnField.type_enum: TxnType.Payment,
+                    TxnField.receiver: receiver,
+                    TxnField.amount: amount,
+                    TxnField.fee: Int(0),
+                })
+            )
+            .Else(
+                InnerTxnBuilder.SetFields({
+                    TxnField.type_enum: TxnType.AssetTransfer,
+                    TxnField.xfer_asset: token.load(),
+                    TxnField.asset_receiver: receiver,
+                    TxnField.asset_amount: amount,
+                    TxnField.fee: Int(0),
+                })
+            ),
+            self.emit("Payout", receiver, Suffix(Itob(slot), Int(7)), Itob(amount), Itob(comission))
+        )
+
+    @internal(TealType.none)
+    def settleOrder(self, acct, order_key, status):
+        """
+        Complete or cancel the order, and set the fields of the inner transaction paying it.
+        A completed order pays the seller, minus the comission that is added to the earnings.
+        A cancelled order refunds the buyer. Both take the amount of the order from the buyer deposit.
+        """
+        key = ScratchVar(TealType.bytes)
+        record = ScratchVar(TealType.bytes)
+        slot = ScratchVar(TealType.uint64)
+        amount = ScratchVar(TealType.uint64)
+        fee = ScratchVar(TealType.uint64)
+        return Seq(
+            Assert(
+                Or(status == Int(self.ORDER_COMPLETED), status == Int(self.ORDER_CANCELLED))
+            ),
+            key.store(order_key),
+            record.store(self.orders[key.load()][acct].get()),     # A missing order is read as 0 and fails below
+            slot.store(GetByte(record.load(), Int(self.RECORD_TOKEN))),
+            amount.store(ExtractUint64(record.load(), Int(self.RECORD_AMOUNT))),
+            self.setOrderStatus(acct, key.load(), status),   # Only accepted orders complete, and pending orders cancel
+            self.deposits[acct].set(self.debit(self.storedDeposits(acct), slot.load(), amount.load())),
+            If(status == Int(self.ORDER_COMPLETED))
+            .Then(
+                fee.store(WideRatio([amount.load(), self.comission_fees], [Int(self.__FEE_BASE)])),
+                self.earnings.set(self.credit(self.earnings, slot.load(), fee.load())),
+                self.payout(Extract(record.load(), Int(self.RECORD_SELLER), Int(32)), slot.load(),
+                            amount.load() - fee.load(), fee.load())
+            )
+            .Else(
+                self.payout(acct, slot.load(), amount.load(), Int(0))
+            )
+        )
+
+    @internal(TealType.bytes)
+    def orderRecord(self, o: Order):
+        """
+        Encode the order as it is stored on the local state, the token is replaced by its slot on the registry.
+        The fields are read at their offsets on the Order tuple, it has 51 bytes of head and the order id is the tail,
+        so no scratch slot is used for each field.
+        """
+        return Concat(
+            Extract(o.encode(), Int(0), Int(32)),                                       # Seller
+            Sha256(Suffix(o.encode(), ExtractUint16(o.encode(), Int(32)) + Int(2))),    # Hash of the order id
+            Extract(o.encode(), Int(34), Int(8)),                                       # Amount
+            Suffix(Itob(self.tokenSlot(ExtractUint64(o.encode(), Int(42)))), Int(7)),   # Slot of the token
+            Extract(o.encode(), Int(50), Int(1)),                                       # Status
+            Bytes(b"\x00"),                                                            # Index, set when the order is stored
+            Itob(Global.round() + self.order_ttl),                                      # Expiry round
+        )
+
+    @internal(TealType.bytes)
+    def orderKey(self, order_id):
+        """
+        Return the key where the order is stored in the buyer local state,
+        it is derived from the order id, so the order can be found without scanning the list.
+        """
+        return Extract(Sha256(order_id), Int(0), Int(self.__ORDER_KEY_LEN))
+
+    @internal(TealType.bytes)
+    def slotKey(self, acct, i):
+        """Return the key of the order stored on the slot i of the account order list."""
+        return Extract(
+            self.storedOrderKeys(acct),
+            Int(self.__ORDER_BITMAP_LEN) + i * Int(self.__ORDER_KEY_LEN),
+            Int(self.__ORDER_KEY_LEN)
+        )
+
+    @internal(TealType.bytes)
+    def orderList(self, acct, start, end):
+        """
+        Encode the records stored on the slots from start to end of the account order list as an OrderRecord[].
+        The slots of the archived orders are skipped, their key is zero.
         """
-        idx = abi.make(abi.Uint8)
         i = ScratchVar(TealType.uint64)
-        r = ScratchVar(TealType.uint64) # the return value
-        return Seq(
-            r.store(Int(0)),
-            For(i.store(Int(0)), i.load() < self.order_index[acct], i.store(i.load() + Int(1))).Do(
-                    idx.set(i.load()),
-                    (_order := self.Order()).decode(self.orders[idx][acct]),
-                    (_order_id := abi.String()).set(_order.order_id),
-                    If(_order_id.get() == order_id.get())
-                    .Then(
-                        r.store(i.load()+Int(1))
+        n = ScratchVar(TealType.uint64)
+        records = ScratchVar(TealType.bytes)
+        return Seq(
+            records.store(Bytes("")),
+            n.store(Int(0)),
+            For(i.store(start), i.load() < end, i.store(i.load() + Int(1))).Do(
+                If(self.slotKey(acct, i.load()) != BytesZero(Int(self.__ORDER_KEY_LEN))).Then(
+                    records.store(Concat(records.load(), self.orders[self.slotKey(acct, i.load())][acct].get())),
+                    n.store(n.load() + Int(1))
+                )
+            ),
+            Concat(Suffix(Itob(n.load()), Int(6)), records.load())
+        )
+
+    @internal(TealType.bytes)
+    def queueKey(self, page):
+        """Return the key of the page of the seller queue."""
+        return Concat(Bytes("q"), Suffix(Itob(page), Int(7)))
+
+    @internal(TealType.none)
+    def pushOrderRef(self, seller, ref):
+        """
+        Add the order reference to the first page of the seller queue with room for it. When the queue is full
+        the reference is left out and the order is still stored, so filling the queue of a seller doesn't block
+        the orders of the other buyers. The orders left out are found on the OrderStored events.
+        """
+        page = ScratchVar(TealType.uint64)
+        done = ScratchVar(TealType.uint64)
+        return Seq(
+            done.store(Int(0)),
+            For(
+                page.store(Int(0)),
+                And(page.load() < Int(self.__QUEUE_PAGES), Not(done.load())),
+                page.store(page.load() + Int(1))
+            ).Do(
+                (stored := self.seller_queue[self.queueKey(page.load())][seller].get_maybe()),
+                If(Not(stored.hasValue()))
+                .Then(
+                    self.seller_queue[self.queueKey(page.load())][seller].set(ref),
+                    done.store(Int(1))
+                )
+                .ElseIf(Len(stored.value()) < Int(self.__QUEUE_PAGE_REFS * self.__ORDER_REF_LEN))
+                .Then(
+                    self.seller_queue[self.queueKey(page.load())][seller].set(Concat(stored.value(), ref)),
+                    done.store(Int(1))
+                )
+            )
+        )
+
+    @internal(TealType.none)
+    def removeOrderRef(self, seller, ref):
+        """
+        Remove the order reference from the seller queue, the page is deleted when it is empty.
+        Orders posted before the queue existed have no reference, so nothing is removed for them.
+        The loops only search the reference, it is removed once after them.
+        """
+        page = ScratchVar(TealType.uint64)
+        pos = ScratchVar(TealType.uint64)
+        found = ScratchVar(TealType.uint64)
+        value = ScratchVar(TealType.bytes)
+        return Seq(
+            found.store(Int(0)),
+            pos.store(Int(0)),
+            value.store(Bytes("")),
+            For(page.store(Int(0)), page.load() < Int(self.__QUEUE_PAGES), page.store(page.load() + Int(1))).Do(
+                (stored := self.seller_queue[self.queueKey(page.load())][seller].get_maybe()),
+                If(stored.hasValue()).Then(
+                    value.store(stored.value()),
+                    For(
+                        pos.store(Int(0)),
+                        pos.load() < Len(value.load()),
+                        pos.store(pos.load() + Int(self.__ORDER_REF_LEN))
+                    ).Do(
+                        If(Extract(value.load(), pos.load(), Int(self.__ORDER_REF_LEN)) == ref).Then(
+                            found.store(Int(1)),
+                            Break()
+                        )
+                    ),
+                    If(found.load()).Then(Break())
+                )
+            ),
+            If(found.load()).Then(
+                value.store(Concat(
+                    Extract(value.load(), Int(0), pos.load()),
+                    Suffix(value.load(), pos.load() + Int(self.__ORDER_REF_LEN))
+                )),
+                If(Len(value.load()) == Int(0))
+                .Then(self.seller_queue[self.queueKey(page.load())][seller].delete())
+                .Else(self.seller_queue[self.queueKey(page.load())][seller].set(value.load()))
+            )
+        )
+
+    @internal(TealType.uint64)
+    def freeSlot(self, acct):
+        """
+        Return the first slot not used by a live order, cancelled and completed orders are overwritten.
+        Slot i is the bit i from the left of the bitmap, so the first free slot is the highest bit set on
+        the negated bitmap, it takes constant time.
+        Return a value >= __ORDER_LIST_MAX when the order list is full.
+        """
+        return Int(8 * self.__ORDER_BITMAP_LEN) - BitLen(
+            BitwiseXor(
+                Btoi(Extract(self.storedOrderKeys(acct), Int(0), Int(self.__ORDER_BITMAP_LEN))),
+                Int(2 ** (8 * self.__ORDER_BITMAP_LEN) - 1)
+            )
+        )
+
+    @internal(TealType.none)
+    def storeOrder(self, acct, i, record):
+        """
+        Store the order record on the slot i of the account order list, the key is taken from the order hash.
+        The key can't be used by other slot, otherwise two slots would point to the same order.
+        The slot is marked as free when the order is cancelled or completed, so it can be reused.
+        """
+        r = ScratchVar(TealType.bytes)
+        k = ScratchVar(TealType.bytes)
+        status = ScratchVar(TealType.uint64)
+        keys = ScratchVar(TealType.bytes)       # The order keys are read once, they may not be written yet
+        previous = ScratchVar(TealType.bytes)   # Key of the order previously stored on the slot
+        return Seq(
+            r.store(SetByte(record, Int(self.RECORD_INDEX), i)),
+            k.store(Extract(r.load(), Int(self.RECORD_HASH), Int(self.__ORDER_KEY_LEN))),
+            status.store(GetByte(r.load(), Int(self.RECORD_STATUS))),
+            keys.store(self.storedOrderKeys(acct)),
+            previous.store(Extract(keys.load(), Int(self.__ORDER_BITMAP_LEN) + i * Int(self.__ORDER_KEY_LEN),
+                                   Int(self.__ORDER_KEY_LEN))),
+            (stored := self.orders[k.load()][acct].get_maybe()),
+            Assert(
+                Or(
+                    Not(stored.hasValue()),
+                    previous.load() == k.load()
+                )
+            ),
+            self.orders[previous.load()][acct].delete(), # Free the order previously stored on the slot
+            self.orders[k.load()][acct].set(r.load()),
+            self.order_keys[acct].set(
+                SetBit(
+                    Replace(
+                        keys.load(),
+                        Int(self.__ORDER_BITMAP_LEN) + i * Int(self.__ORDER_KEY_LEN),
+                        k.load()
+                    ),
+                    i,
+                    And(status.load() != Int(self.ORDER_CANCELLED), status.load() != Int(self.ORDER_COMPLETED))
+                )
+            ),
+            If(i >= self.order_index[acct]).Then(
+                self.order_index[acct].set(i + Int(1))
+            ),
+            self.emit("OrderStored", acct, r.load())
+        )
+
+    @internal(TealType.none)
+    def setOrderStatus(self, acct, key, status):
+        """
+        Move the order stored on the key to a new status, only the status byte of the record is changed.
+        The allowed transitions are PENDING -> ACCEPTED -> COMPLETED and PENDING -> CANCELLED,
+        the slot of a cancelled or completed order is freed.
+        """
+        k = ScratchVar(TealType.bytes)
+        record = ScratchVar(TealType.bytes)
+        current = ScratchVar(TealType.uint64)
+        return Seq(
+            k.store(key),
+            record.store(self.orders[k.load()][acct].get()),       # A missing order is read as 0 and fails below
+            current.store(GetByte(record.load(), Int(self.RECORD_STATUS))),
+            Assert(
+                Or(
+                    And(
+                        current.load() == Int(self.ORDER_PENDING),
+                        Or(status == Int(self.ORDER_ACCEPTED), status == Int(self.ORDER_CANCELLED))
+                    ),
+                    And(
+                        current.load() == Int(self.ORDER_ACCEPTED),
+                        status == Int(self.ORDER_COMPLETED)
                     )
+                )
             ),
-            Return(r.load())
+            self.orders[k.load()][acct].set(SetByte(record.load(), Int(self.RECORD_STATUS), status)),
+            If(current.load() == Int(self.ORDER_PENDING)).Then(
+                # The order leaves the seller queue once it is accepted or cancelled
+                self.removeOrderRef(Extract(record.load(), Int(self.RECORD_SELLER), Int(32)), Concat(acct, k.load()))
+            ),
+            self.emit("OrderStatus", acct, Extract(record.load(), Int(self.RECORD_HASH), Int(32)),
+                      Suffix(Itob(status), Int(7))),
+            If(status != Int(self.ORDER_ACCEPTED)).Then(
+                self.order_keys[acct].set(
+                    SetBit(self.storedOrderKeys(acct), GetByte(record.load(), Int(self.RECORD_INDEX)), Int(0))
+                )
+            )
         )
 
     @external
@@ -355,17 +1083,313 @@ class Ecommerce(Application):
                        amt: abi.Uint64,
                        o: Order,
                        ):
-        i = abi.make(abi.Uint8)
         """The oracle validated the order, and if using usdc token call this method"""
         return Seq(
             Assert(
                 self.isAdmin() == Int(1),
             ),
-            i.set(self.order_index[acct.address()]),
-            self.orders[i][acct.address()].set(o.encode()), # Store the order in the array
-            self.dusdc[acct.address()].increment(amt.get()), # increment the balance in usdc tokens
-            self.order_index[acct.address()].increment(Int(1)), # update for the next index
+            self.postOrder(acct.address(), amt.get(), o)
+        )
 
+    @external
+    def oPostOrdersBatch(self,
+                         orders: abi.DynamicArray[abi.Tuple3[abi.Uint8, abi.Uint64, Order]],
+                         ):
+        """
+        The oracle validated several orders, and post all of them in one call.
+        Each item is the buyer index on the accounts array, the amount and the order. The amount is in the
+        token of the order, it is credited on the deposit of the token slot of the registry. The sellers of the pending orders must be on the accounts array too. The buyers and the sellers
+        share the 4 foreign accounts, so distinct buyer/seller pairs are posted 2 per call.
+        The opcode budget is taken from the other application calls of the group,
+        or from inner calls paid with the fee of this transaction.
+        """
+        n = ScratchVar(TealType.uint64)
+        i = ScratchVar(TealType.uint64)
+        item = abi.make(abi.Tuple3[abi.Uint8, abi.Uint64, self.Order])
+        o = abi.make(self.Order)
+        return Seq(
+            n.store(orders.length()),
+            Assert(
+                self.isAdmin() == Int(1),
+                n.load() <= Int(self.__POST_BATCH_MAX),
+            ),
+            self.ensureBudget(n.load() * Int(self._post_order_cost)),
+            For(i.store(Int(0)), i.load() < n.load(), i.store(i.load() + Int(1))).Do(
+                orders[i.load()].store_into(item),
+                item[2].store_into(o),
+                # The buyer index and the amount are read at their offsets on the item, without a slot for each
+                self.postOrder(Txn.accounts[GetByte(item.encode(), Int(0))], ExtractUint64(item.encode(), Int(1)), o)
+            )
+        )
+
+    @external
+    def settleOrders(self,
+                     orders: abi.DynamicArray[abi.Tuple3[abi.Uint8, abi.String, abi.Uint8]],
+                     ):
+        """
+        Complete or cancel several orders in one call, each item is the buyer index on the accounts array,
+        the order id and the new status. The sellers of the orders must be on the accounts array,
+        and the tokens on the assets array.
+        All the payments are sent as one group of inner transactions with fee 0, the fee of this
+        transaction must pay for them, and for the inner calls increasing the opcode budget.
+        """
+        n = ScratchVar(TealType.uint64)
+        i = ScratchVar(TealType.uint64)
+        item = abi.make(abi.Tuple3[abi.Uint8, abi.String, abi.Uint8])
+        return Seq(
+            n.store(orders.length()),
+            Assert(
+                self.isAdmin() == Int(1),
+                n.load() > Int(0),
+                n.load() <= Int(self.__POST_BATCH_MAX),
+            ),
+            self.ensureBudget(n.load() * Int(self._settle_order_cost)),
+            InnerTxnBuilder.Begin(),
+            For(i.store(Int(0)), i.load() < n.load(), i.store(i.load() + Int(1))).Do(
+                orders[i.load()].store_into(item),
+                If(i.load() > Int(0)).Then(InnerTxnBuilder.Next()),
+                # The head of the item is the buyer index, the offset of the order id and the status,
+                # the order id follows with its length
+                self.settleOrder(Txn.accounts[GetByte(item.encode(), Int(0))], self.orderKey(Suffix(item.encode(), Int(6))),
+                                 GetByte(item.encode(), Int(3)))
+            ),
+            InnerTxnBuilder.Submit()
+        )
+
+    @external
+    def sweepExpired(self,
+                     max_orders: abi.Uint8,
+                     *, output: abi.Uint8):
+        """
+        Cancel the pending orders of the foreign accounts that passed their expiry round, and refund
+        the buyers, up to max_orders orders. Anyone can call it, no oracle call is needed.
+        The sellers of the expired orders must be on the accounts array too, and the tokens on the assets array.
+        The refunds are sent as one group of inner transactions with fee 0, the fee of this transaction
+        must pay for them, and for the inner calls increasing the opcode budget. Return the orders swept.
+        """
+        a = ScratchVar(TealType.uint64)
+        i = ScratchVar(TealType.uint64)
+        swept = ScratchVar(TealType.uint64)
+        keys = ScratchVar(TealType.bytes)
+        k = ScratchVar(TealType.bytes)
+        record = ScratchVar(TealType.bytes)
+        acct = Txn.accounts[a.load()]
+        return Seq(
+            Assert(
+                max_orders.get() > Int(0),
+                max_orders.get() <= Int(self.__SWEEP_MAX),
+            ),
+            self.ensureBudget(
+                Txn.accounts.length() * Int(self._sweep_account_cost) + max_orders.get() * Int(self._settle_order_cost)
+            ),
+            swept.store(Int(0)),
+            For(
+                a.store(Int(1)),
+                And(a.load() <= Txn.accounts.length(), swept.load() < max_orders.get()),
+                a.store(a.load() + Int(1))
+            ).Do(
+                # The order keys are written with the first order, the state is read without defaults
+                If(self.order_index[acct] > Int(0)).Then(
+                    keys.store(self.order_keys[acct].get()),
+                    For(
+                        i.store(Int(0)),
+                        And(i.load() < self.order_index[acct], swept.load() < max_orders.get()),
+                        i.store(i.load() + Int(1))
+                    ).Do(
+                        If(GetBit(keys.load(), i.load())).Then(
+                            k.store(Extract(keys.load(), Int(self.__ORDER_BITMAP_LEN) + i.load() * Int(self.__ORDER_KEY_LEN),
+                                            Int(self.__ORDER_KEY_LEN))),
+                            record.store(self.orders[k.load()][acct].get()),   # A live slot always has its order
+                            # The records stored before the expiry round was added are migrated first
+                            If(Len(record.load()) == Int(self.RECORD_LEN)).Then(
+                                If(
+                                    And(
+                                        GetByte(record.load(), Int(self.RECORD_STATUS)) == Int(self.ORDER_PENDING),
+                                        ExtractUint64(record.load(), Int(self.RECORD_EXPIRES)) < Global.round()
+                                    )
+                                ).Then(
+                                    If(swept.load() == Int(0), InnerTxnBuilder.Begin(), InnerTxnBuilder.Next()),
+                                    self.settleOrder(acct, k.load(), Int(self.ORDER_CANCELLED)),
+                                    swept.store(swept.load() + Int(1))
+                                )
+                            )
+                        )
+                    )
+                )
+            ),
+            If(swept.load() > Int(0)).Then(InnerTxnBuilder.Submit()),
+            output.set(swept.load())
+        )
+
+    @external
+    def archiveOrders(self,
+                      acct: abi.Account,
+                      peaks: abi.DynamicBytes,
+                      *, output: abi.Uint64):
+        """
+        Move the cancelled and completed orders of the account to its archive, and free their records.
+        The archive is a Merkle mountain range of the archived records, only its root and the number of
+        orders archived are stored, the records are kept off-chain from the OrderArchived events.
+        The leaf of a record is its sha256 and a node is the sha256 of its two children,
+        the root is the sha256 of the number of leaves and the peaks from the highest.
+        peaks are the current peaks of the archive, they are checked against the root.
+        The key of an archived order is set to zero on its slot.
+        Anyone can call it, the orders must be migrated first. Up to 7 orders are archived on each call,
+        return the number of orders archived.
+        """
+        keys = ScratchVar(TealType.bytes)
+        count = ScratchVar(TealType.uint64)
+        p = ScratchVar(TealType.bytes)
+        i = ScratchVar(TealType.uint64)
+        k = ScratchVar(TealType.bytes)
+        record = ScratchVar(TealType.bytes)
+        m = ScratchVar(TealType.uint64)
+        return Seq(
+            self.ensureBudget(self.order_index[acct.address()] * Int(self._archive_order_cost)),
+            keys.store(self.storedOrderKeys(acct.address())),
+            If(Len(keys.load()) < Int(self.__ORDER_KEYS_LEN)).Then(
+                keys.store(Concat(keys.load(), BytesZero(Int(self.__ORDER_KEYS_LEN) - Len(keys.load()))))
+            ),
+            count.store(ExtractUint64(keys.load(), Int(self.__ARCHIVE_COUNT))),
+            p.store(peaks.get()),
+            Assert(
+                If(
+                    count.load() == Int(0),
+                    Len(p.load()) == Int(0),
+                    Sha256(Concat(Itob(count.load()), p.load())) == Extract(keys.load(), Int(self.__ARCHIVE_ROOT), Int(32))
+                )
+            ),
+            For(
+                i.store(Int(0)),
+                And(
+                    i.load() < self.order_index[acct.address()],
+                    count.load() - ExtractUint64(keys.load(), Int(self.__ARCHIVE_COUNT)) < Int(self.__ARCHIVE_MAX)
+                ),
+                i.store(i.load() + Int(1))
+            ).Do(
+                k.store(Extract(keys.load(), Int(self.__ORDER_BITMAP_LEN) + i.load() * Int(self.__ORDER_KEY_LEN),
+                                Int(self.__ORDER_KEY_LEN))),
+                # A free slot keeps its finished order until it is reused or archived
+                If(And(Not(GetBit(keys.load(), i.load())), k.load() != BytesZero(Int(self.__ORDER_KEY_LEN)))).Then(
+                    record.store(self.orders[k.load()][acct.address()].get()),
+                    # Records stored before the expiry round was added have another leaf
+                    If(Len(record.load()) == Int(self.RECORD_LEN)).Then(
+                        self.emit("OrderArchived", acct.address(), Itob(count.load()), record.load()),
+                        record.store(Sha256(record.load())),
+                        # Each set bit of the count from the lowest is a peak of the same height, merged with the node
+                        For(m.store(count.load()), BitwiseAnd(m.load(), Int(1)), m.store(ShiftRight(m.load(), Int(1)))).Do(
+                            record.store(Sha256(Concat(Suffix(p.load(), Len(p.load()) - Int(32)), record.load()))),
+                            p.store(Extract(p.load(), Int(0), Len(p.load()) - Int(32)))
+                        ),
+                        p.store(Concat(p.load(), record.load())),
+                        count.store(count.load() + Int(1)),
+                        self.orders[k.load()][acct.address()].delete(),
+                        keys.store(Replace(keys.load(), Int(self.__ORDER_BITMAP_LEN) + i.load() * Int(self.__ORDER_KEY_LEN),
+                                           BytesZero(Int(self.__ORDER_KEY_LEN))))
+                    )
+                )
+            ),
+            output.set(count.load() - ExtractUint64(keys.load(), Int(self.__ARCHIVE_COUNT))),
+            If(output.get() > Int(0)).Then(
+                self.order_keys[acct.address()].set(
+                    Replace(
+                        Replace(keys.load(), Int(self.__ARCHIVE_ROOT), Sha256(Concat(Itob(count.load()), p.load()))),
+                        Int(self.__ARCHIVE_COUNT),
+                        Itob(count.load())
+                    )
+                )
+            )
+        )
+
+    @external(read_only=True)
+    def verifyArchivedOrder(self,
+                            acct: abi.Account,
+                            record: abi.StaticBytes[Literal[RECORD_LEN]],
+                            leaf: abi.Uint64,
+                            proof: abi.DynamicBytes,
+                            *, output: abi.Bool):
+        """
+        Check that the record was archived by the account as the leaf, to settle disputes about finished orders.
+        proof are the siblings of the leaf from the top of its peak down to the leaf, followed by the peaks of the archive.
+        Each level of the peak costs about 90 opcodes, the proofs of large archives need the budget
+        of other application calls of the group.
+        """
+        count = ScratchVar(TealType.uint64)
+        start = ScratchVar(TealType.uint64)     # First leaf under the peak, then the position of the node
+        h = ScratchVar(TealType.uint64)         # Height of the peak
+        pos = ScratchVar(TealType.uint64)       # Position of the peak
+        node = ScratchVar(TealType.bytes)
+        keys = self.storedOrderKeys(acct.address())
+        return Seq(
+            output.set(False),
+            count.store(If(Len(keys) == Int(self.__ORDER_KEYS_LEN), ExtractUint64(keys, Int(self.__ARCHIVE_COUNT)), Int(0))),
+            If(leaf.get() < count.load()).Then(
+                # The peaks are the set bits of the count from the highest, a peak of height h has 2^h leaves
+                start.store(Int(0)),
+                pos.store(Int(0)),
+                For(
+                    h.store(BitLen(count.load()) - Int(1)),
+                    leaf.get() >= start.load() + BitwiseAnd(count.load(), ShiftLeft(Int(1), h.load())),
+                    h.store(h.load() - Int(1))
+                ).Do(
+                    If(BitwiseAnd(count.load(), ShiftLeft(Int(1), h.load()))).Then(
+                        start.store(start.load() + ShiftLeft(Int(1), h.load())),
+                        pos.store(pos.load() + Int(1))
+                    )
+                ),
+                If(
+                    And(
+                        Len(proof.get()) >= h.load() * Int(32),
+                        Sha256(Concat(Itob(count.load()), Suffix(proof.get(), h.load() * Int(32))))
+                        == Extract(keys, Int(self.__ARCHIVE_ROOT), Int(32))
+                    )
+                ).Then(
+                    node.store(Sha256(record.get())),
+                    pos.store(h.load() * Int(32) + pos.load() * Int(32)),   # Offset of the peak on the proof
+                    # The path is read from the leaf up, the lowest bit of the position tells if the node is the right child
+                    For(
+                        start.store(leaf.get() - start.load()),
+                        h.load() > Int(0),
+                        start.store(ShiftRight(start.load(), Int(1)))
+                    ).Do(
+                        h.store(h.load() - Int(1)),
+                        node.store(Sha256(If(
+                            BitwiseAnd(start.load(), Int(1)),
+                            Concat(Extract(proof.get(), h.load() * Int(32), Int(32)), node.load()),
+                            Concat(node.load(), Extract(proof.get(), h.load() * Int(32), Int(32)))
+                        )))
+                    ),
+                    output.set(Extract(proof.get(), pos.load(), Int(32)) == node.load())
+                )
+            )
+        )
+
+    @internal(TealType.none)
+    def postOrder(self, acct, amt, o: Order):
+        """
+        Store the order on the first free slot of the buyer, and increase the deposit in the token of the order.
+        The amount of the order can't be 0. A pending order is added to the queue of the seller, so the seller
+        must be opted in and on the accounts array.
+        """
+        i = ScratchVar(TealType.uint64)
+        record = ScratchVar(TealType.bytes)
+        return Seq(
+            i.store(self.freeSlot(acct)),
+            Assert(
+                i.load() < Int(self.__ORDER_LIST_MAX), # The order list is full
+            ),
+            record.store(self.orderRecord(o)),
+            Assert(
+                ExtractUint64(record.load(), Int(self.RECORD_AMOUNT)) > Int(0), # An empty order only takes a slot
+            ),
+            self.storeOrder(acct, i.load(), record.load()), # Store the order in the array
+            If(GetByte(record.load(), Int(self.RECORD_STATUS)) == Int(self.ORDER_PENDING)).Then(
+                self.pushOrderRef(
+                    Extract(record.load(), Int(self.RECORD_SELLER), Int(32)),
+                    Concat(acct, Extract(record.load(), Int(self.RECORD_HASH), Int(self.__ORDER_KEY_LEN)))
+                )
+            ),
+            self.deposit(acct, GetByte(record.load(), Int(self.RECORD_TOKEN)), amt),
         )
 
     @external
@@ -388,14 +1412,93 @@ class Ecommerce(Application):
                 oracle_pay.get().receiver() == Global.current_application_address(),
 
                 product_pay.get().asset_receiver() == self.address,
-                # product_pay.get().xfer_asset() == self.token,
+                product_pay.get().xfer_asset() == token_.asset_id(),
+                self.token_slots[Itob(token_.asset_id())].exists(),    # The token is enabled for payment
                 product_pay.get().asset_amount() >= Int(0),
             ),
-
+            self.emit("OrderPlaced", Txn.sender(), Itob(product_pay.get().xfer_asset()),
+                      Itob(product_pay.get().asset_amount())),
             output.set(Int(1))
         )
 
 
+    @external
+    def placeOrderDirect(self,
+                         product_pay: abi.AssetTransferTransaction,
+                         o: Order,
+                         *, output: abi.String):
+        """
+        The buyer pays and posts the order in the same group, without waiting for the oracle.
+        The asset transfer is validated on chain: it must send the amount of the order in the token
+        of the order to the application. The order is stored pending and the deposit is credited,
+        the oracle is only needed if there is a dispute. The seller must be on the accounts array.
+        """
+        # The amount, the token and the status are read at their offsets on the Order head
+        return Seq(
+            Assert(
+                product_pay.get().sender() == Txn.sender(),
+                product_pay.get().asset_receiver() == self.address,
+                product_pay.get().xfer_asset() == ExtractUint64(o.encode(), Int(42)),
+                product_pay.get().asset_amount() == ExtractUint64(o.encode(), Int(34)),
+                product_pay.get().asset_close_to() == Global.zero_address(),
+                GetByte(o.encode(), Int(50)) == Int(self.ORDER_PENDING),
+            ),
+            self.postOrder(Txn.sender(), ExtractUint64(o.encode(), Int(34)), o),
+            output.set("order_placed")
+        )
+
+    @external
+    def placeOrderCart(self,
+                       oracle_pay: abi.PaymentTransaction,
+                       product_pay: abi.AssetTransferTransaction,
+                       items: abi.DynamicArray[CartItem],
+                       *, output: abi.Uint8):
+        """
+        The buyer pays several orders, from one or more sellers, with one asset transfer and one oracle fee.
+        The asset transfer must send the sum of the amounts of the items, each item is stored as a pending
+        order in the token of the transfer, and the deposit is credited. Up to 4 items, the sellers must be
+        on the accounts array. The opcode budget is taken from inner calls paid with the fee of this transaction.
+        Return the number of orders placed.
+        """
+        n = ScratchVar(TealType.uint64)
+        i = ScratchVar(TealType.uint64)
+        total = ScratchVar(TealType.uint64)
+        item = abi.make(self.CartItem)
+        o = abi.make(self.Order)
+        return Seq(
+            n.store(items.length()),
+            Assert(
+                n.load() > Int(0),
+                n.load() <= Int(self.__POST_BATCH_MAX),
+                oracle_pay.get().amount() >= self.oracle_fees,
+                oracle_pay.get().receiver() == Global.current_application_address(),
+                product_pay.get().sender() == Txn.sender(),
+                product_pay.get().asset_receiver() == self.address,
+                product_pay.get().asset_close_to() == Global.zero_address(),
+            ),
+            self.ensureBudget(n.load() * Int(self._post_order_cost)),
+            total.store(Int(0)),
+            For(i.store(Int(0)), i.load() < n.load(), i.store(i.load() + Int(1))).Do(
+                items[i.load()].store_into(item),
+                # The head of the item is the seller, the offset of the order id and the amount,
+                # the head of the Order adds the token and the status, so the order id offset is 51
+                o.decode(Concat(
+                    Extract(item.encode(), Int(0), Int(32)),
+                    Suffix(Itob(Int(51)), Int(6)),
+                    Extract(item.encode(), Int(34), Int(8)),
+                    Itob(product_pay.get().xfer_asset()),
+                    Suffix(Itob(Int(self.ORDER_PENDING)), Int(7)),
+                    Suffix(item.encode(), Int(42))
+                )),
+                total.store(total.load() + ExtractUint64(item.encode(), Int(34))),
+                self.postOrder(Txn.sender(), ExtractUint64(item.encode(), Int(34)), o)
+            ),
+            Assert(
+                total.load() == product_pay.get().asset_amount(),   # The transfer pays the whole cart
+            ),
+            output.set(n.load())
+        )
+
     @external
     def takeOrder(self,
                     acct: abi.Account,
@@ -407,43 +1510,49 @@ class Ecommerce(Application):
         The seller accept the order request from the buyer,
         and increase the deposit on the seller account.
         """
-        r = abi.make(abi.Uint8)            # Return value for teh search
-        i = abi.make(abi.Uint8)            # Real index
-        s = abi.make(abi.Uint8)
         return Seq(
             Assert(
                 self.isSeller() == Int(1),
             ),
-            r.set(self.searchOrderIndex(acct.address(),order_id)),
-            If(r.get() != Int(0))
+            output.set(self.acceptOrder(acct.address(), self.orderKey(order_id.get())))
+        )
+
+    @external
+    def takeOrderByKey(self,
+                       acct: abi.Account,
+                       order_key: abi.StaticBytes[Literal[8]],
+                       *,
+                       output: abi.String
+                       ):
+        """The seller accept the order found on its queue, the order is given by its key instead of its id."""
+        return Seq(
+            Assert(
+                self.isSeller() == Int(1),
+            ),
+            output.set(self.acceptOrder(acct.address(), order_key.get()))
+        )
+
+    @internal(TealType.bytes)
+    def acceptOrder(self, acct, key):
+        """Accept the order stored on the key if the sender is its seller, return the result message."""
+        k = ScratchVar(TealType.bytes)   # Key where the order is stored
+        return Seq(
+            k.store(key),
+            (stored := self.orders[k.load()][acct].get_maybe()),
+            If(stored.hasValue())
             .Then(
                 # Found the order, now it process to check the seller address
-                i.set(r.get()-Int(1)),
-                (_order := self.Order()).decode(self.orders[i][acct.address()]),
-                (seller := abi.Address()).set(_order.seller),
-                If(seller.get() != Txn.sender())
+                If(Extract(stored.value(), Int(self.RECORD_SELLER), Int(32)) != Txn.sender())
                 .Then(
-                    # output.set("sender_is_not_the_seller")     # The sender is not the seller for this order.
-                    output.set("sender_is_not_the_seller_order")
+                    Bytes("sender_is_not_the_seller_order")     # The sender is not the seller for this order.
                 )
                 .Else(
-                    (order_id := abi.String()).set(_order.order_id),
-                    (amount := abi.Uint64()).set(_order.amount),
-                    (token := abi.Uint64()).set(_order.token),
-                    (status := abi.Uint8()).set(_order.status),
-
-                    Assert( status.get() == Int(0)),
-
-                    status.set(self.ORDER_ACCEPTED),
-                    _order.set(seller,order_id,amount,token,status),
-                    self.orders[i][acct.address()].set(_order.encode()),
-
-                    (_order := self.Order()).decode(self.orders[i][acct.address()]),
-                    output.set("status_order_updated")
+                    self.setOrderStatus(acct, k.load(), Int(self.ORDER_ACCEPTED)),
+                    Bytes("status_order_updated")
                 )
             )
             .Else(
-                # The order was not found, return 0
-                output.set("order_not_found"),
-            ),
+                # The order was not found
+                Bytes("order_not_found")
+            )
         )
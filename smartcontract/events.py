@@ -0,0 +1,91 @@
+"""
+Decode the ARC-28 events logged by the Ecommerce application from the confirmed blocks.
+
+The events are the ones of Ecommerce.EVENTS: a 4 bytes selector followed by the arguments,
+all of them with a static size. EventStream reads the blocks after the last one it read, so the
+oracle work depends on the transactions of the application instead of on the number of accounts.
+
+Usage:
+    stream = EventStream(algod_client, app_id)
+    for event in stream.follow():
+        print(event.round, event.name, event.args)
+"""
+import base64
+from typing import Iterator, NamedTuple, Optional
+
+from algosdk import abi
+
+from .contract import Ecommerce
+
+
+class Event(NamedTuple):
+    round: int
+    position: int           # Position of the transaction in the block
+    name: str
+    args: dict
+
+
+EVENT_TYPES: dict[bytes, tuple[str, tuple[str, ...], abi.TupleType]] = {
+    Ecommerce.event_selector(name): (
+        name,
+        tuple(arg for arg, _ in args),
+        abi.TupleType([abi.ABIType.from_string(arc4_type) for _, arc4_type in args]),
+    )
+    for name, args in Ecommerce.EVENTS.items()
+}
+"""Name, argument names and ABI type of the payload of each event, keyed by the selector"""
+
+
+def decode_event(log: bytes) -> Optional[tuple[str, dict]]:
+    """Return the name and the arguments of the event, None if the log is not an event of the application"""
+    event = EVENT_TYPES.get(log[:4])
+    if event is None:
+        return None
+    name, arg_names, payload = event
+    if len(log) - 4 != payload.byte_len():
+        return None     # The ABI return of a method may start with the same 4 bytes
+    values = payload.decode(log[4:])
+    return name, {arg: bytes(v) if isinstance(v, list) else v for arg, v in zip(arg_names, values)}
+
+
+def block_events(block: dict, app_id: int) -> list[Event]:
+    """Events logged by the calls to the application in the block, inner calls included"""
+    events = []
+
+    def walk(txn: dict, position: int):
+        if txn["txn"].get("type") == "appl" and txn["txn"].get("apid", txn.get("apid")) == app_id:
+            for log in txn.get("dt", {}).get("lg", []):
+                event = decode_event(base64.b64decode(log))
+                if event is not None:
+                    events.append(Event(block["rnd"], position, *event))
+        for inner in txn.get("dt", {}).get("itx", []):
+            walk(inner, position)
+
+    for position, txn in enumerate(block.get("txns", [])):
+        walk(txn, position)
+    return events
+
+
+class EventStream:
+    """Read the events of the application from the blocks confirmed after the last one read"""
+
+    def __init__(self, algod_client, app_id: int, start_round: int = None):
+        self.algod_client = algod_client
+        self.app_id = app_id
+        self.next_round = self.algod_client.status()["last-round"] + 1 if start_round is None else start_round
+
+    def poll(self) -> list[Event]:
+        """Events of the blocks confirmed since the last poll"""
+        events = []
+        last_round = self.algod_client.status()["last-round"]
+        while self.next_round <= last_round:
+            block = self.algod_client.block_info(self.next_round)["block"]
+            events.extend(block_events(block, self.app_id))
+            self.next_round += 1
+        return events
+
+    def follow(self) -> Iterator[Event]:
+        """Yield the events as the blocks are confirmed, waiting for the next block when there are none"""
+        while True:
+            yield from self.poll()
+            self.algod_client.status_after_block(self.next_round - 1)
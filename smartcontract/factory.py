@@ -0,0 +1,273 @@
+"""
+Deploy the Ecommerce application as several shards, each buyer is served by one of them.
+
+The local state of an account and the opcode budget of a call are bounded, and every call of the
+Ecommerce application is sequenced by the same global state. The ShardFactory creates N instances
+of Ecommerce with inner transactions, the factory is their creator and admin: the setup of the
+shards (tokens and oracle workers) is made on the factory and relayed to all of them, so their
+token registries have the same slots.
+
+A buyer is assigned to the shard at the index sha256(address) mod N, see getShard and
+smartcontract/shards.py. The sellers opt in to all the shards, their queues are kept by the shard
+of each buyer. The earnings of the shards are added up on the factory by syncEarnings.
+
+Usage:
+    factory = client.ApplicationClient(algod_client, ShardFactory(), signer=admin.signer)
+    factory.create(shards=4)
+    # fund the factory address, then
+    for _ in range(4):
+        factory.call(ShardFactory.createShard)
+"""
+from pyteal import *
+from typing import Final, Literal
+from algosdk.constants import APP_PAGE_MAX_SIZE
+from beaker import (
+    Application,
+    create,
+    ApplicationStateValue,
+    DynamicApplicationStateValue,
+    Authorize,
+    external,
+    internal,
+)
+from beaker.application import get_method_signature
+from beaker.precompile import Precompile
+
+from .contract import Ecommerce
+
+
+class ShardFactory(Application):
+    """Creates the shards of the Ecommerce application, relays their setup and aggregates their earnings."""
+
+    _shard_funds = 100000
+    """Algos sent to a new shard, the minimum balance of its account"""
+    _token_funds = 100000
+    """Algos sent to each shard when a token is added, the minimum balance of the opt-in"""
+    __SHARD_MAX = 7
+    """Max shards, the calls relayed to the shards reference all of them and one token"""
+    __TOKEN_MAX = Ecommerce._Ecommerce__TOKEN_MAX
+    PAGE_LEN = 4096
+    """Bytes of each page of the programs of the shards, the max length of a byte string"""
+
+    shard: Final[Ecommerce] = Ecommerce()
+    shard_approval: Final[Precompile] = Precompile(shard.approval_program)
+    shard_clear: Final[Precompile] = Precompile(shard.clear_program)
+
+    shard_count: Final[ApplicationStateValue] = ApplicationStateValue(
+        stack_type=TealType.uint64,
+        key=Bytes("n"),
+        static=True,
+        descr="Number of shards, set on create so the shard of a buyer never changes."
+    )
+    """The buyers are assigned to the shards by the hash of their address modulo this number."""
+
+    deployed: Final[ApplicationStateValue] = ApplicationStateValue(
+        stack_type=TealType.uint64,
+        key=Bytes("d"),
+        default=Int(0),
+        descr="Number of shards created."
+    )
+    """The shards are created in order, one on each createShard call."""
+
+    shards: Final[DynamicApplicationStateValue] = DynamicApplicationStateValue(
+        stack_type=TealType.uint64,
+        max_keys=__SHARD_MAX,
+        descr="Application id of each shard, keyed by its index."
+    )
+    """Find the shard of a buyer without scanning them."""
+
+    tokens: Final[ApplicationStateValue] = ApplicationStateValue(
+        stack_type=TealType.bytes,
+        key=Bytes("tk"),
+        default=Itob(Int(0)),
+        descr="Asset id of the token registered on each slot of the shards, the slot 0 is algos."
+    )
+    """Token registry, the same on all the shards."""
+
+    earnings: Final[ApplicationStateValue] = ApplicationStateValue(
+        stack_type=TealType.bytes,
+        key=Bytes("e"),
+        default=BytesZero(Int(8 * __TOKEN_MAX)),
+        descr="Earnings of all the shards on the last sync, one uint64 for each slot of the token registry."
+    )
+    """Sum of the earnings of the shards."""
+
+    synced: Final[ApplicationStateValue] = ApplicationStateValue(
+        stack_type=TealType.uint64,
+        key=Bytes("sr"),
+        default=Int(0),
+        descr="Round of the last sync of the earnings."
+    )
+    """The earnings are read from the shards periodically, this is the round they were read."""
+
+    @create
+    def create(self, shards: abi.Uint8):
+        """On deploy application, the number of shards can't be changed later."""
+        return Seq(
+            Assert(
+                shards.get() > Int(0),
+                shards.get() <= Int(self.__SHARD_MAX),
+            ),
+            self.initialize_application_state(),
+            self.shard_count.set(shards.get())
+        )
+
+    def pages(self, program: Precompile) -> list[Expr]:
+        """The binary of the program split in pages, the programs of a shard are longer than a byte string."""
+        return [Bytes(program.binary[i:i + self.PAGE_LEN]) for i in range(0, len(program.binary), self.PAGE_LEN)]
+
+    @internal(TealType.none)
+    def fund(self, app_id, amount):
+        """Send algos to the account of the application."""
+        addr = AppParam.address(app_id)
+        return Seq(
+            addr,
+            InnerTxnBuilder.Begin(),
+            InnerTxnBuilder.SetFields(
+                {
+                    TxnField.type_enum: TxnType.Payment,
+                    TxnField.receiver: addr.value(),
+                    TxnField.amount: amount,
+                    TxnField.fee: Int(0),
+                }
+            ),
+            InnerTxnBuilder.Submit(),
+        )
+
+    def relay(self, method, *args: abi.BaseType, funds: int = 0) -> Expr:
+        """
+        Call the method on every shard, with the algos it needs sent before. All the shards must be created,
+        a shard created later would miss the call, and they must be on the foreign apps. The inner
+        transactions have fee 0, they are paid by the fee of the call.
+        """
+        i = ScratchVar(TealType.uint64)
+        app_id = ScratchVar(TealType.uint64)
+        return Seq(
+            Assert(
+                self.deployed == self.shard_count,
+            ),
+            For(i.store(Int(0)), i.load() < self.shard_count, i.store(i.load() + Int(1))).Do(
+                app_id.store(self.shards[Itob(i.load())].get()),
+                self.fund(app_id.load(), Int(funds)) if funds else Seq(),
+                InnerTxnBuilder.ExecuteMethodCall(
+                    app_id=app_id.load(),
+                    method_signature=get_method_signature(method),
+                    args=list(args),
+                    extra_fields={TxnField.fee: Int(0)},
+                )
+            )
+        )
+
+    @external(authorize=Authorize.only(Global.creator_address()))
+    def createShard(self, *, output: abi.Uint64):
+        """
+        Create the next shard, this application is its creator and admin. The shard is funded by this
+        application, which pays the minimum balance of the shard programs and state too.
+        The fee must pay the 2 inner transactions. Return the application id of the shard.
+        """
+        i = ScratchVar(TealType.uint64)
+        global_schema = self.shard.app_state.schema()
+        local_schema = self.shard.acct_state.schema()
+        return Seq(
+            i.store(self.deployed),
+            Assert(
+                i.load() < self.shard_count,
+            ),
+            InnerTxnBuilder.Begin(),
+            InnerTxnBuilder.SetFields(
+                {
+                    TxnField.type_enum: TxnType.ApplicationCall,
+                    TxnField.approval_program_pages: self.pages(self.shard_approval),
+                    TxnField.clear_state_program_pages: self.pages(self.shard_clear),
+                    TxnField.global_num_uints: Int(global_schema.num_uints),
+                    TxnField.global_num_byte_slices: Int(global_schema.num_byte_slices),
+                    TxnField.local_num_uints: Int(local_schema.num_uints),
+                    TxnField.local_num_byte_slices: Int(local_schema.num_byte_slices),
+                    TxnField.extra_program_pages: Int(
+                        (len(self.shard_approval.binary) + len(self.shard_clear.binary) - 1) // APP_PAGE_MAX_SIZE
+                    ),
+                    TxnField.fee: Int(0),
+                }
+            ),
+            InnerTxnBuilder.Submit(),
+            self.shards[Itob(i.load())].set(InnerTxn.created_application_id()),
+            self.deployed.set(i.load() + Int(1)),
+            self.fund(InnerTxn.created_application_id(), Int(self._shard_funds)),
+            output.set(self.shards[Itob(i.load())].get())
+        )
+
+    @external(authorize=Authorize.only(Global.creator_address()))
+    def addToken(self,
+                 a: abi.Asset,
+                 *, output: abi.String):
+        """
+        Enable the token for payment on all the shards, each shard is funded for the opt-in.
+        The fee must pay 3 inner transactions for each shard.
+        """
+        return Seq(
+            Assert(
+                Len(self.tokens) / Int(8) < Int(self.__TOKEN_MAX), # The token registry is full
+            ),
+            self.relay(Ecommerce.addToken, a, funds=self._token_funds),
+            self.tokens.set(Concat(self.tokens, Itob(a.asset_id()))),
+            output.set("new_token_added")
+        )
+
+    @external(authorize=Authorize.only(Global.creator_address()))
+    def addOracle(self,
+                  a: abi.Address,
+                  *, output: abi.String):
+        """Register the oracle worker on all the shards, so any worker can post the orders of any buyer."""
+        return Seq(
+            self.relay(Ecommerce.addOracle, a),
+            output.set("oracle_added")
+        )
+
+    @external(authorize=Authorize.only(Global.creator_address()))
+    def removeOracle(self,
+                     a: abi.Address,
+                     *, output: abi.String):
+        """Remove the oracle worker from all the shards."""
+        return Seq(
+            self.relay(Ecommerce.removeOracle, a),
+            output.set("oracle_removed")
+        )
+
+    @external
+    def syncEarnings(self, *, output: abi.StaticArray[abi.Uint64, Literal[__TOKEN_MAX]]):
+        """
+        Add up the earnings of all the shards, anyone can call it. The shards must be on the foreign apps.
+        The earnings are read from the global state of the shards and the total replaces the earnings of
+        this application, so calling it again is harmless. The funds stay on the shards.
+        Return the earnings of all the shards.
+        """
+        i = ScratchVar(TealType.uint64)
+        slot = ScratchVar(TealType.uint64)
+        total = ScratchVar(TealType.bytes)
+        shard_earnings = App.globalGetEx(self.shards[Itob(i.load())].get(), Ecommerce.earnings.key)
+        return Seq(
+            total.store(BytesZero(Int(8 * self.__TOKEN_MAX))),
+            For(i.store(Int(0)), i.load() < self.deployed, i.store(i.load() + Int(1))).Do(
+                shard_earnings,
+                Assert(
+                    shard_earnings.hasValue(),
+                ),
+                For(slot.store(Int(0)), slot.load() < Int(8 * self.__TOKEN_MAX), slot.store(slot.load() + Int(8))).Do(
+                    total.store(Replace(total.load(), slot.load(), Itob(
+                        ExtractUint64(total.load(), slot.load()) + ExtractUint64(shard_earnings.value(), slot.load())
+                    )))
+                )
+            ),
+            self.earnings.set(total.load()),
+            self.synced.set(Global.round()),
+            output.decode(total.load())
+        )
+
+    @external(read_only=True)
+    def getShard(self,
+                 acct: abi.Address,
+                 *, output: abi.Uint64):
+        """Application id of the shard of the buyer, 0 while the shard is not created."""
+        return output.set(
+            self.shards[Itob(Btoi(Extract(Sha256(acct.get()), Int(0), Int(8))) % self.shard_count)].get()
+        )
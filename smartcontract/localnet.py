@@ -0,0 +1,1953 @@
+"""
+In-process stand-in for the sandbox: a ledger kept in memory, a TEAL evaluator and an algod client over them.
+
+ApplicationClient and the AtomicTransactionComposer only use a handful of algod endpoints.
+LocalAlgod implements them over a Ledger, so the contract can be deployed and called
+without a node:
+
+    ledger = Ledger()
+    accounts = ledger.get_accounts()
+    algod_client = LocalAlgod(ledger)
+    app_client = ApplicationClient(algod_client, Ecommerce(), signer=accounts[0].signer)
+
+compile doesn't assemble the program. The "binary" is the TEAL source itself, and the evaluator
+runs it line by line, so the pc of a logic error is a line of the program, same as the source map
+returned by compile. Programs given as real bytecode (the inner app of OpUp) support only the few
+opcodes they use.
+
+A group is applied on a copy of the ledger, and the copy replaces the ledger only when every
+transaction succeeds. Each group is confirmed in its own round right away.
+
+Known differences with algod: programs aren't limited in size (ExtraProgramPages is charged
+but not checked), and logic signatures, key registration, asset freeze and box storage
+aren't supported.
+"""
+import base64
+import copy
+import hashlib
+import threading
+from dataclasses import dataclass, field
+from math import isqrt
+from typing import Callable, Optional, Union
+
+from algosdk import encoding, logic
+from algosdk.error import AlgodHTTPError
+from algosdk.future import transaction
+from algosdk.atomic_transaction_composer import AccountTransactionSigner
+from beaker.sandbox import SandboxAccount
+from nacl.exceptions import BadSignatureError
+from nacl.signing import SigningKey, VerifyKey
+
+from .analyze import APP_CALL_BUDGET, OPCODE_COST, parse_bytes, tokenize
+
+Value = Union[int, bytes]
+
+MAX_UINT64 = 2**64 - 1
+MAX_BYTES = 4096
+MAX_KEY_LEN = 64
+MAX_KEY_VALUE_LEN = 128
+MAX_LOGS = 32
+MAX_LOG_SIZE = 1024
+MAX_INNER_TXNS = 256
+MAX_CALL_DEPTH = 8
+MAX_STACK = 1000
+MAX_TXN_LIFE = 1000
+MAX_GROUP_SIZE = 16
+
+MIN_TXN_FEE = 1000
+MIN_BALANCE = 100000
+ASSET_MIN_BALANCE = 100000
+APP_MIN_BALANCE = 100000
+APP_PAGE_MIN_BALANCE = 100000
+SCHEMA_MIN_BALANCE = 25000
+SCHEMA_UINT_MIN_BALANCE = 3500
+SCHEMA_BYTES_MIN_BALANCE = 25000
+
+GENESIS_ID = "localnet-v1"
+GENESIS_HASH = base64.b64encode(hashlib.sha256(GENESIS_ID.encode()).digest()).decode()
+GENESIS_TIMESTAMP = 1660000000
+BLOCK_TIME = 4
+ACCOUNT_BALANCE = 10**11
+ZERO_ADDRESS = encoding.encode_address(bytes(32))
+
+TYPE_ENUM = {"pay": 1, "keyreg": 2, "acfg": 3, "axfer": 4, "afrz": 5, "appl": 6}
+ON_COMPLETION = {
+    "NoOp": 0, "OptIn": 1, "CloseOut": 2, "ClearState": 3, "UpdateApplication": 4, "DeleteApplication": 5,
+}
+NOOP, OPT_IN, CLOSE_OUT, CLEAR_STATE, UPDATE, DELETE = range(6)
+
+
+class LogicError(Exception):
+    """The program failed, pc is the line of the TEAL source"""
+
+    def __init__(self, msg: str, pc: int = 0, op: str = ""):
+        super().__init__(msg)
+        self.msg = msg
+        self.pc = pc
+        self.op = op
+        self.txid = ""
+
+
+class TxnError(Exception):
+    """The transaction is invalid, the group is rejected"""
+
+    def __init__(self, msg: str, txid: str = ""):
+        super().__init__(msg)
+        self.txid = txid
+
+
+@dataclass
+class Txn:
+    """A transaction in the form seen by the programs, the fields are the ones of the txn opcode"""
+    type: str
+    sender: str
+    fee: Optional[int] = None
+    first_valid: int = 0
+    last_valid: int = 0
+    note: bytes = b""
+    lease: bytes = bytes(32)
+    group: bytes = bytes(32)
+    rekey_to: str = ZERO_ADDRESS
+    # pay
+    receiver: str = ZERO_ADDRESS
+    amount: int = 0
+    close_remainder_to: str = ZERO_ADDRESS
+    # axfer
+    xfer_asset: int = 0
+    asset_amount: int = 0
+    asset_sender: str = ZERO_ADDRESS
+    asset_receiver: str = ZERO_ADDRESS
+    asset_close_to: str = ZERO_ADDRESS
+    # acfg
+    config_asset: int = 0
+    config_asset_total: int = 0
+    config_asset_decimals: int = 0
+    config_asset_default_frozen: int = 0
+    config_asset_unit_name: bytes = b""
+    config_asset_name: bytes = b""
+    config_asset_url: bytes = b""
+    config_asset_metadata_hash: bytes = b""
+    config_asset_manager: str = ZERO_ADDRESS
+    config_asset_reserve: str = ZERO_ADDRESS
+    config_asset_freeze: str = ZERO_ADDRESS
+    config_asset_clawback: str = ZERO_ADDRESS
+    # appl
+    application_id: int = 0
+    on_completion: int = NOOP
+    application_args: list[bytes] = field(default_factory=list)
+    accounts: list[str] = field(default_factory=list)
+    assets: list[int] = field(default_factory=list)
+    applications: list[int] = field(default_factory=list)
+    approval_program: bytes = b""
+    clear_state_program: bytes = b""
+    global_num_uint: int = 0
+    global_num_byte_slice: int = 0
+    local_num_uint: int = 0
+    local_num_byte_slice: int = 0
+    extra_program_pages: int = 0
+    # set when the transaction is applied
+    txid: str = ""
+    group_index: int = 0
+    logs: list[bytes] = field(default_factory=list)
+    created_asset_id: int = 0
+    created_application_id: int = 0
+    inner: list["Txn"] = field(default_factory=list)
+    cost: int = 0
+
+    @classmethod
+    def from_sdk(cls, txn: transaction.Transaction) -> "Txn":
+        t = cls(
+            type=txn.type,
+            sender=txn.sender,
+            fee=txn.fee,
+            first_valid=txn.first_valid_round,
+            last_valid=txn.last_valid_round,
+            note=txn.note or b"",
+            lease=txn.lease or bytes(32),
+            group=txn.group or bytes(32),
+            rekey_to=txn.rekey_to or ZERO_ADDRESS,
+            txid=txn.get_txid(),
+        )
+        if txn.type == "pay":
+            t.receiver = txn.receiver or ZERO_ADDRESS
+            t.amount = txn.amt or 0
+            t.close_remainder_to = txn.close_remainder_to or ZERO_ADDRESS
+        elif txn.type == "axfer":
+            t.xfer_asset = txn.index
+            t.asset_amount = txn.amount or 0
+            t.asset_receiver = txn.receiver or ZERO_ADDRESS
+            t.asset_sender = txn.revocation_target or ZERO_ADDRESS
+            t.asset_close_to = txn.close_assets_to or ZERO_ADDRESS
+        elif txn.type == "acfg":
+            t.config_asset = txn.index or 0
+            t.config_asset_total = txn.total or 0
+            t.config_asset_decimals = txn.decimals or 0
+            t.config_asset_default_frozen = int(bool(txn.default_frozen))
+            t.config_asset_unit_name = (txn.unit_name or "").encode()
+            t.config_asset_name = (txn.asset_name or "").encode()
+            t.config_asset_url = (txn.url or "").encode()
+            t.config_asset_metadata_hash = txn.metadata_hash or b""
+            t.config_asset_manager = txn.manager or ZERO_ADDRESS
+            t.config_asset_reserve = txn.reserve or ZERO_ADDRESS
+            t.config_asset_freeze = txn.freeze or ZERO_ADDRESS
+            t.config_asset_clawback = txn.clawback or ZERO_ADDRESS
+        elif txn.type == "appl":
+            t.application_id = txn.index or 0
+            t.on_completion = int(txn.on_complete)
+            t.application_args = list(txn.app_args or [])
+            t.accounts = list(txn.accounts or [])
+            t.assets = list(txn.foreign_assets or [])
+            t.applications = list(txn.foreign_apps or [])
+            t.approval_program = txn.approval_program or b""
+            t.clear_state_program = txn.clear_program or b""
+            if txn.global_schema:
+                t.global_num_uint = txn.global_schema.num_uints or 0
+                t.global_num_byte_slice = txn.global_schema.num_byte_slices or 0
+            if txn.local_schema:
+                t.local_num_uint = txn.local_schema.num_uints or 0
+                t.local_num_byte_slice = txn.local_schema.num_byte_slices or 0
+            t.extra_program_pages = txn.extra_pages or 0
+        else:
+            raise TxnError(f"transaction type {txn.type} is not supported")
+        return t
+
+    def to_json(self) -> dict:
+        """Transaction fields as algod returns them, only the ones that are set"""
+        d = {"type": self.type, "snd": self.sender, "fee": self.fee, "fv": self.first_valid, "lv": self.last_valid}
+        if self.note:
+            d["note"] = b64(self.note)
+        if self.type == "pay":
+            d.update(rcv=self.receiver, amt=self.amount)
+            if self.close_remainder_to != ZERO_ADDRESS:
+                d["close"] = self.close_remainder_to
+        elif self.type == "axfer":
+            d.update(xaid=self.xfer_asset, aamt=self.asset_amount, arcv=self.asset_receiver)
+            if self.asset_sender != ZERO_ADDRESS:
+                d["asnd"] = self.asset_sender
+            if self.asset_close_to != ZERO_ADDRESS:
+                d["aclose"] = self.asset_close_to
+        elif self.type == "acfg":
+            d["caid"] = self.config_asset
+        elif self.type == "appl":
+            d.update(apid=self.application_id, apan=self.on_completion)
+            if self.application_args:
+                d["apaa"] = [b64(a) for a in self.application_args]
+            if self.accounts:
+                d["apat"] = self.accounts
+            if self.assets:
+                d["apas"] = self.assets
+            if self.applications:
+                d["apfa"] = self.applications
+        return d
+
+
+def b64(value: bytes) -> str:
+    return base64.b64encode(value).decode()
+
+
+def address_bytes(addr: str) -> bytes:
+    return encoding.decode_address(addr)
+
+
+# TEAL name of the transaction fields, and the attribute of Txn holding them
+TXN_FIELDS = {
+    "Sender": "sender", "Fee": "fee", "FirstValid": "first_valid", "LastValid": "last_valid",
+    "Note": "note", "Lease": "lease", "Receiver": "receiver", "Amount": "amount",
+    "CloseRemainderTo": "close_remainder_to", "Type": "type", "TypeEnum": "type",
+    "XferAsset": "xfer_asset", "AssetAmount": "asset_amount", "AssetSender": "asset_sender",
+    "AssetReceiver": "asset_receiver", "AssetCloseTo": "asset_close_to", "GroupIndex": "group_index",
+    "TxID": "txid", "ApplicationID": "application_id", "OnCompletion": "on_completion",
+    "ApplicationArgs": "application_args", "NumAppArgs": "application_args",
+    "Accounts": "accounts", "NumAccounts": "accounts", "Assets": "assets", "NumAssets": "assets",
+    "Applications": "applications", "NumApplications": "applications",
+    "ApprovalProgram": "approval_program", "ClearStateProgram": "clear_state_program",
+    "ApprovalProgramPages": "approval_program", "ClearStateProgramPages": "clear_state_program",
+    "RekeyTo": "rekey_to", "ConfigAsset": "config_asset", "ConfigAssetTotal": "config_asset_total",
+    "ConfigAssetDecimals": "config_asset_decimals", "ConfigAssetDefaultFrozen": "config_asset_default_frozen",
+    "ConfigAssetUnitName": "config_asset_unit_name", "ConfigAssetName": "config_asset_name",
+    "ConfigAssetURL": "config_asset_url", "ConfigAssetMetadataHash": "config_asset_metadata_hash",
+    "ConfigAssetManager": "config_asset_manager", "ConfigAssetReserve": "config_asset_reserve",
+    "ConfigAssetFreeze": "config_asset_freeze", "ConfigAssetClawback": "config_asset_clawback",
+    "GlobalNumUint": "global_num_uint", "GlobalNumByteSlice": "global_num_byte_slice",
+    "LocalNumUint": "local_num_uint", "LocalNumByteSlice": "local_num_byte_slice",
+    "ExtraProgramPages": "extra_program_pages", "Logs": "logs", "NumLogs": "logs", "LastLog": "logs",
+    "CreatedAssetID": "created_asset_id", "CreatedApplicationID": "created_application_id",
+}
+ADDRESS_FIELDS = {
+    "sender", "receiver", "close_remainder_to", "asset_sender", "asset_receiver", "asset_close_to",
+    "rekey_to", "config_asset_manager", "config_asset_reserve", "config_asset_freeze", "config_asset_clawback",
+}
+ARRAY_FIELDS = {"ApplicationArgs", "Accounts", "Assets", "Applications", "Logs"}
+COUNT_FIELDS = {"NumAppArgs", "NumAccounts", "NumAssets", "NumApplications", "NumLogs"}
+PAGE_FIELDS = {"ApprovalProgramPages", "ClearStateProgramPages"}
+"""The programs set page by page, each page is appended to the program"""
+INNER_FIELDS = {
+    "Sender", "Fee", "Note", "Receiver", "Amount", "CloseRemainderTo", "Type", "TypeEnum", "XferAsset",
+    "AssetAmount", "AssetSender", "AssetReceiver", "AssetCloseTo", "RekeyTo", "ConfigAsset",
+    "ConfigAssetTotal", "ConfigAssetDecimals", "ConfigAssetDefaultFrozen", "ConfigAssetUnitName",
+    "ConfigAssetName", "ConfigAssetURL", "ConfigAssetMetadataHash", "ConfigAssetManager",
+    "ConfigAssetReserve", "ConfigAssetFreeze", "ConfigAssetClawback", "ApplicationID", "OnCompletion",
+    "ApplicationArgs", "Accounts", "Assets", "Applications", "ApprovalProgram", "ClearStateProgram",
+    "ApprovalProgramPages", "ClearStateProgramPages",
+    "GlobalNumUint", "GlobalNumByteSlice", "LocalNumUint", "LocalNumByteSlice", "ExtraProgramPages",
+}
+
+
+def txid_bytes(txid: str) -> bytes:
+    return base64.b32decode(txid + "=" * (-len(txid) % 8))
+
+
+def txn_field(t: Txn, name: str, index: Optional[int] = None) -> Value:
+    if name not in TXN_FIELDS:
+        raise LogicError(f"invalid txn field {name}")
+    attr = TXN_FIELDS[name]
+    value = getattr(t, attr)
+    if name == "TypeEnum":
+        return TYPE_ENUM[value]
+    if name == "Type":
+        return value.encode()
+    if name == "TxID":
+        return txid_bytes(value)
+    if name in COUNT_FIELDS:
+        return len(value)
+    if name == "LastLog":
+        return value[-1] if value else b""
+    if name in PAGE_FIELDS:
+        if index is None or index * MAX_BYTES >= max(len(value), 1):
+            raise LogicError(f"invalid {name} index {index}")
+        return value[index * MAX_BYTES:(index + 1) * MAX_BYTES]
+    if name in ARRAY_FIELDS:
+        if name == "Accounts":
+            value = [t.sender] + value
+        if index is None or index >= len(value):
+            raise LogicError(f"invalid {name} index {index}")
+        value = value[index]
+        return address_bytes(value) if name == "Accounts" else value
+    if attr in ADDRESS_FIELDS:
+        return address_bytes(value)
+    if value is None:
+        return 0
+    return value
+
+
+@dataclass
+class Account:
+    balance: int = 0
+    assets: dict[int, int] = field(default_factory=dict)
+    local: dict[int, dict[bytes, Value]] = field(default_factory=dict)
+    auth_addr: str = ZERO_ADDRESS
+
+
+@dataclass
+class App:
+    id: int
+    creator: str
+    approval: bytes
+    clear: bytes
+    global_schema: tuple[int, int]
+    local_schema: tuple[int, int]
+    extra_pages: int = 0
+    state: dict[bytes, Value] = field(default_factory=dict)
+
+    @property
+    def address(self) -> str:
+        return logic.get_application_address(self.id)
+
+    def params_json(self) -> dict:
+        return {
+            "creator": self.creator,
+            "approval-program": b64(self.approval),
+            "clear-state-program": b64(self.clear),
+            "global-state": state_json(self.state),
+            "global-state-schema": {"num-uint": self.global_schema[0], "num-byte-slice": self.global_schema[1]},
+            "local-state-schema": {"num-uint": self.local_schema[0], "num-byte-slice": self.local_schema[1]},
+            "extra-program-pages": self.extra_pages,
+        }
+
+
+@dataclass
+class Asset:
+    id: int
+    creator: str
+    total: int
+    decimals: int = 0
+    default_frozen: int = 0
+    unit_name: bytes = b""
+    name: bytes = b""
+    url: bytes = b""
+    metadata_hash: bytes = b""
+    manager: str = ZERO_ADDRESS
+    reserve: str = ZERO_ADDRESS
+    freeze: str = ZERO_ADDRESS
+    clawback: str = ZERO_ADDRESS
+
+    def params_json(self) -> dict:
+        return {
+            "creator": self.creator,
+            "total": self.total,
+            "decimals": self.decimals,
+            "default-frozen": bool(self.default_frozen),
+            "unit-name": self.unit_name.decode(errors="replace"),
+            "name": self.name.decode(errors="replace"),
+            "url": self.url.decode(errors="replace"),
+            "metadata-hash": b64(self.metadata_hash),
+            "manager": self.manager,
+            "reserve": self.reserve,
+            "freeze": self.freeze,
+            "clawback": self.clawback,
+        }
+
+
+def state_json(state: dict[bytes, Value]) -> list[dict]:
+    """Key-value store in the format of algod"""
+    values = []
+    for k, v in state.items():
+        if isinstance(v, int):
+            values.append({"key": b64(k), "value": {"type": 2, "uint": v, "bytes": ""}})
+        else:
+            values.append({"key": b64(k), "value": {"type": 1, "uint": 0, "bytes": b64(v)}})
+    return values
+
+
+@dataclass
+class Instruction:
+    line: int
+    op: str
+    args: list
+
+
+BRANCH_OPS = {"b", "bz", "bnz", "callsub"}
+BYTES_IMMEDIATE_OPS = {"pushbytes", "bytecblock", "byte"}
+
+
+@dataclass
+class TealProgram:
+    code: list[Instruction]
+    labels: dict[str, int]
+    source: list[str]
+
+
+_programs: dict[bytes, TealProgram] = {}
+
+
+def load_program(program: bytes) -> TealProgram:
+    """Parse a program, either TEAL source or bytecode, the parsed programs are cached"""
+    if program not in _programs:
+        teal = program.decode() if program.startswith(b"#pragma") else disassemble(program)
+        _programs[program] = parse_teal(teal)
+    return _programs[program]
+
+
+def parse_teal(teal: str) -> TealProgram:
+    code, labels, pending = [], {}, []
+    lines = teal.splitlines()
+    for n, line in enumerate(lines):
+        tokens = tokenize(line)
+        if not tokens or tokens[0] == "#pragma":
+            continue
+        if tokens[0].endswith(":"):
+            labels[tokens[0][:-1]] = len(code)
+            continue
+        op, raw = tokens[0], tokens[1:]
+        if op in BYTES_IMMEDIATE_OPS:
+            args = [parse_bytes(a) for a in raw]
+        elif op == "addr":
+            args = [address_bytes(raw[0])]
+        elif op == "method":
+            args = [hashlib.new("sha512_256", parse_bytes(raw[0])).digest()[:4]]
+        elif op in BRANCH_OPS:
+            args = raw
+            pending.append(len(code))
+        else:
+            args = [int(a, 0) if a[0].isdigit() else a for a in raw]
+        code.append(Instruction(n, op, args))
+    for i in pending:
+        label = code[i].args[0]
+        if label not in labels:
+            raise LogicError(f"reference to undefined label {label}", code[i].line, code[i].op)
+        code[i].args = [labels[label]]
+    return TealProgram(code, labels, lines)
+
+
+# Bytecode of the few opcodes used by the programs built on-chain, like the OpUp target app
+BYTECODE_OPS = {0x00: "err", 0x22: "intc_0", 0x23: "intc_1", 0x24: "intc_2", 0x25: "intc_3",
+                0x43: "return", 0x44: "assert", 0x48: "pop"}
+
+
+def read_varuint(program: bytes, i: int) -> tuple[int, int]:
+    value, shift = 0, 0
+    while True:
+        b = program[i]
+        value |= (b & 0x7F) << shift
+        i += 1
+        if b < 0x80:
+            return value, i
+        shift += 7
+
+
+def disassemble(program: bytes) -> str:
+    if not program:
+        raise LogicError("empty program")
+    lines, i = [f"#pragma version {program[0]}"], 1
+    while i < len(program):
+        op = program[i]
+        i += 1
+        if op in BYTECODE_OPS:
+            lines.append(BYTECODE_OPS[op])
+        elif op == 0x81:
+            value, i = read_varuint(program, i)
+            lines.append(f"pushint {value}")
+        elif op == 0x80:
+            n, i = read_varuint(program, i)
+            lines.append(f"pushbytes 0x{program[i:i + n].hex()}")
+            i += n
+        elif op == 0x20:
+            n, i = read_varuint(program, i)
+            values = []
+            for _ in range(n):
+                value, i = read_varuint(program, i)
+                values.append(str(value))
+            lines.append("intcblock " + " ".join(values))
+        else:
+            raise LogicError(f"bytecode opcode 0x{op:02x} is not supported")
+    return "\n".join(lines)
+
+
+def teal_source_map(teal: str) -> dict:
+    """Source map where each pc is a line of the program"""
+    n = max(len(teal.splitlines()), 1)
+    return {"version": 3, "sources": [], "names": [], "mapping": "", "mappings": ";".join(["AAAA"] + ["AACA"] * (n - 1))}
+
+
+class Evaluator:
+    """Runs a program for one application call"""
+
+    def __init__(self, group: "Group", txns: list[Txn], gi: int, app: App, program: bytes, depth: int = 0,
+                 caller: int = 0):
+        self.group = group
+        self.ledger = group.ledger
+        self.txns = txns
+        self.gi = gi
+        self.txn = txns[gi]
+        self.app = app
+        self.program = load_program(program)
+        self.depth = depth
+        self.caller = caller
+        self.stack: list[Value] = []
+        self.scratch: list[Value] = [0] * 256
+        self.intc: list[int] = []
+        self.bytec: list[bytes] = []
+        self.callstack: list[int] = []
+        self.pc = 0
+        self.inner: Optional[list[Txn]] = None
+        self.last_inner: list[Txn] = []
+
+    def fail(self, msg: str):
+        raise LogicError(msg)
+
+    # stack
+
+    def push(self, v: Value):
+        if isinstance(v, int) and not 0 <= v <= MAX_UINT64:
+            self.fail(f"{v} overflows uint64")
+        if isinstance(v, bytes) and len(v) > MAX_BYTES:
+            self.fail(f"value of {len(v)} bytes exceeds {MAX_BYTES}")
+        self.stack.append(v)
+        if len(self.stack) > MAX_STACK:
+            self.fail("stack overflow")
+
+    def pop(self) -> Value:
+        if not self.stack:
+            self.fail("stack underflow")
+        return self.stack.pop()
+
+    def pop_int(self) -> int:
+        v = self.pop()
+        if not isinstance(v, int):
+            self.fail("expected uint64 but got []byte")
+        return v
+
+    def pop_bytes(self) -> bytes:
+        v = self.pop()
+        if not isinstance(v, bytes):
+            self.fail("expected []byte but got uint64")
+        return v
+
+    # run
+
+    def run(self) -> bool:
+        code = self.program.code
+        while self.pc < len(code):
+            ins = code[self.pc]
+            self.pc += 1
+            cost = OPCODE_COST.get(ins.op, 1)
+            self.group.budget -= cost
+            self.txn.cost += cost
+            try:
+                if self.group.budget < 0:
+                    self.fail("dynamic cost budget exceeded")
+                handler = OPS.get(ins.op)
+                if handler is None:
+                    self.fail(f"unsupported opcode {ins.op}")
+                if handler(self, *ins.args) is STOP:
+                    break
+            except LogicError as e:
+                if not e.op:
+                    e.pc, e.op = ins.line, ins.op
+                raise
+        if len(self.stack) != 1:
+            raise LogicError(f"stack len is {len(self.stack)} instead of 1", self._line(), "return")
+        result = self.stack[0]
+        if not isinstance(result, int):
+            raise LogicError("stack finished with bytes not int", self._line(), "return")
+        return result != 0
+
+    def _line(self) -> int:
+        code = self.program.code
+        return code[min(self.pc, len(code)) - 1].line if code else 0
+
+    # references
+
+    def available_accounts(self) -> list[str]:
+        t = self.txn
+        apps = [*t.applications, *self.group.created_apps]
+        return [t.sender, *t.accounts, self.app.address, *(logic.get_application_address(a) for a in apps)]
+
+    def account_ref(self, ref: Value) -> str:
+        if isinstance(ref, int):
+            accounts = [self.txn.sender] + self.txn.accounts
+            if ref >= len(accounts):
+                self.fail(f"invalid Account reference {ref}")
+            return accounts[ref]
+        if len(ref) != 32:
+            self.fail(f"invalid Account reference of {len(ref)} bytes")
+        addr = encoding.encode_address(ref)
+        if addr not in self.available_accounts():
+            self.fail(f"invalid Account reference {addr}")
+        return addr
+
+    def app_ref(self, ref: int) -> int:
+        apps = [self.app.id] + self.txn.applications
+        if ref < len(apps):
+            return apps[ref]
+        if ref not in apps and ref not in self.group.created_apps:
+            self.fail(f"unavailable App {ref}")
+        return ref
+
+    def asset_ref(self, ref: int) -> int:
+        assets = self.txn.assets
+        if ref < len(assets):
+            return assets[ref]
+        if ref not in assets:
+            self.fail(f"unavailable Asset {ref}")
+        return ref
+
+    def local_state(self, addr: str, app_id: int) -> dict[bytes, Value]:
+        local = self.ledger.account(addr).local
+        if app_id not in local:
+            self.fail(f"account {addr} is not opted in to app {app_id}")
+        return local[app_id]
+
+    def put(self, state: dict[bytes, Value], schema: tuple[int, int], key: bytes, value: Value):
+        if len(key) > MAX_KEY_LEN:
+            self.fail(f"key too long: length was {len(key)}, maximum is {MAX_KEY_LEN}")
+        if isinstance(value, bytes) and len(key) + len(value) > MAX_KEY_VALUE_LEN:
+            self.fail(f"key/value total too long for key {key!r}")
+        state[key] = value
+        uints = sum(1 for v in state.values() if isinstance(v, int))
+        if uints > schema[0] or len(state) - uints > schema[1]:
+            self.fail(f"store integer count {uints} or bytes count {len(state) - uints} exceeds schema {schema}")
+
+    # inner transactions
+
+    def new_inner(self) -> Txn:
+        return Txn(type="", sender=self.app.address, first_valid=self.txn.first_valid,
+                   last_valid=self.txn.last_valid)
+
+    def set_inner_field(self, name: str, value: Value):
+        if name not in INNER_FIELDS:
+            self.fail(f"{name} is not allowed in itxn_field")
+        t = self.inner[-1]
+        attr = TXN_FIELDS[name]
+        if name == "Type":
+            if value.decode(errors="replace") not in TYPE_ENUM:
+                self.fail(f"{value!r} is not a valid Type")
+            t.type = value.decode()
+        elif name == "TypeEnum":
+            types = {v: k for k, v in TYPE_ENUM.items()}
+            if value not in types:
+                self.fail(f"{value} is not a valid TypeEnum")
+            t.type = types[value]
+        elif name == "Accounts":
+            t.accounts.append(self.account_ref(value))
+        elif name in ARRAY_FIELDS:
+            getattr(t, attr).append(value)
+        elif name in PAGE_FIELDS:
+            setattr(t, attr, getattr(t, attr) + value)
+        elif attr in ADDRESS_FIELDS:
+            if not isinstance(value, bytes) or len(value) != 32:
+                self.fail(f"{name} must be an address")
+            addr = encoding.encode_address(value)
+            if attr not in ("sender", "rekey_to") and addr != ZERO_ADDRESS and addr not in self.available_accounts():
+                self.fail(f"invalid Account reference {addr}")
+            setattr(t, attr, addr)
+        elif name == "XferAsset":
+            t.xfer_asset = self.asset_ref(value)
+        else:
+            setattr(t, attr, value)
+
+    def submit_inner(self):
+        if not self.inner:
+            self.fail("itxn_submit without itxn_begin")
+        if self.depth + 1 >= MAX_CALL_DEPTH:
+            self.fail("appl depth exceeded")
+        txns, self.inner = self.inner, None
+        for i, t in enumerate(txns):
+            t.group_index = i
+            t.txid = self.group.inner_txid(self.txn, t)
+            try:
+                self.group.apply(t, txns, self.depth + 1, caller=self.app.id)
+            except (LogicError, TxnError) as e:
+                self.fail(f"inner tx {i} failed: {e}")
+        self.txn.inner.extend(txns)
+        self.last_inner = txns
+
+
+STOP = object()
+
+
+def binary_int(f: Callable[[int, int], int]):
+    def op(ev: Evaluator):
+        b = ev.pop_int()
+        a = ev.pop_int()
+        ev.push(f(ev, a, b))
+    return op
+
+
+def binary_bytes(f: Callable[[int, int], Value], max_len: int = 64):
+    """Byte math, the operands are big-endian unsigned ints of at most 64 bytes"""
+    def op(ev: Evaluator):
+        b = ev.pop_bytes()
+        a = ev.pop_bytes()
+        if len(a) > max_len or len(b) > max_len:
+            ev.fail("math attempted on large byte-array")
+        r = f(ev, int.from_bytes(a, "big"), int.from_bytes(b, "big"))
+        ev.push(int(r) if isinstance(r, bool) else to_bytes(r))
+    return op
+
+
+def bitwise_bytes(f: Callable[[int, int], int]):
+    def op(ev: Evaluator):
+        b = ev.pop_bytes()
+        a = ev.pop_bytes()
+        n = max(len(a), len(b))
+        ev.push(f(int.from_bytes(a, "big"), int.from_bytes(b, "big")).to_bytes(n, "big"))
+    return op
+
+
+def to_bytes(n: int) -> bytes:
+    return n.to_bytes((n.bit_length() + 7) // 8, "big")
+
+
+def checked(ev: Evaluator, r: int, op: str) -> int:
+    if r > MAX_UINT64:
+        ev.fail(f"{op} overflowed")
+    if r < 0:
+        ev.fail(f"{op} would result negative")
+    return r
+
+
+def nonzero(ev: Evaluator, b: int, op: str) -> int:
+    if b == 0:
+        ev.fail(f"{op} 0")
+    return b
+
+
+def op_eq(ev: Evaluator, negate: bool = False):
+    b = ev.pop()
+    a = ev.pop()
+    if type(a) != type(b):
+        ev.fail("cannot compare uint64 to []byte")
+    ev.push(int((a == b) != negate))
+
+
+def op_bitlen(ev: Evaluator):
+    v = ev.pop()
+    ev.push(v.bit_length() if isinstance(v, int) else int.from_bytes(v, "big").bit_length())
+
+
+def op_btoi(ev: Evaluator):
+    v = ev.pop_bytes()
+    if len(v) > 8:
+        ev.fail(f"btoi arg too long, got [{len(v)}]bytes")
+    ev.push(int.from_bytes(v, "big"))
+
+
+def substring(ev: Evaluator, a: bytes, start: int, end: int) -> bytes:
+    if start > end or end > len(a):
+        ev.fail(f"substring range beyond length of string: {start}:{end} of {len(a)}")
+    return a[start:end]
+
+
+def op_extract(ev: Evaluator, start: int, length: int):
+    a = ev.pop_bytes()
+    ev.push(substring(ev, a, start, len(a) if length == 0 and start <= len(a) else start + length))
+
+
+def op_extract3(ev: Evaluator):
+    length = ev.pop_int()
+    start = ev.pop_int()
+    a = ev.pop_bytes()
+    ev.push(substring(ev, a, start, start + length))
+
+
+def op_substring3(ev: Evaluator):
+    end = ev.pop_int()
+    start = ev.pop_int()
+    a = ev.pop_bytes()
+    ev.push(substring(ev, a, start, end))
+
+
+def extract_uint(size: int):
+    def op(ev: Evaluator):
+        start = ev.pop_int()
+        a = ev.pop_bytes()
+        ev.push(int.from_bytes(substring(ev, a, start, start + size), "big"))
+    return op
+
+
+def replace(ev: Evaluator, start: int):
+    b = ev.pop_bytes()
+    a = ev.pop_bytes()
+    if start + len(b) > len(a):
+        ev.fail(f"replacement end {start + len(b)} beyond original length {len(a)}")
+    ev.push(a[:start] + b + a[start + len(b):])
+
+
+def op_replace3(ev: Evaluator):
+    b = ev.pop_bytes()
+    start = ev.pop_int()
+    ev.push(b)
+    replace(ev, start)
+
+
+def op_getbit(ev: Evaluator):
+    i = ev.pop_int()
+    v = ev.pop()
+    if isinstance(v, int):
+        if i >= 64:
+            ev.fail(f"getbit index {i} beyond 64 bits")
+        ev.push((v >> i) & 1)
+    else:
+        if i >= len(v) * 8:
+            ev.fail(f"getbit index {i} beyond byteslice")
+        ev.push((v[i // 8] >> (7 - i % 8)) & 1)
+
+
+def op_setbit(ev: Evaluator):
+    bit = ev.pop_int()
+    i = ev.pop_int()
+    v = ev.pop()
+    if bit > 1:
+        ev.fail("setbit value > 1")
+    if isinstance(v, int):
+        if i >= 64:
+            ev.fail(f"setbit index {i} beyond 64 bits")
+        ev.push(v | (1 << i) if bit else v & ~(1 << i))
+    else:
+        if i >= len(v) * 8:
+            ev.fail(f"setbit index {i} beyond byteslice")
+        b, mask = bytearray(v), 1 << (7 - i % 8)
+        b[i // 8] = b[i // 8] | mask if bit else b[i // 8] & ~mask
+        ev.push(bytes(b))
+
+
+def op_getbyte(ev: Evaluator):
+    i = ev.pop_int()
+    v = ev.pop_bytes()
+    if i >= len(v):
+        ev.fail(f"getbyte index {i} beyond length {len(v)}")
+    ev.push(v[i])
+
+
+def op_setbyte(ev: Evaluator):
+    c = ev.pop_int()
+    i = ev.pop_int()
+    v = ev.pop_bytes()
+    if i >= len(v):
+        ev.fail(f"setbyte index {i} beyond length {len(v)}")
+    if c > 255:
+        ev.fail("setbyte value > 255")
+    ev.push(v[:i] + bytes([c]) + v[i + 1:])
+
+
+def op_bzero(ev: Evaluator):
+    n = ev.pop_int()
+    if n > MAX_BYTES:
+        ev.fail("bzero attempted to create a too large string")
+    ev.push(bytes(n))
+
+
+def op_concat(ev: Evaluator):
+    b = ev.pop_bytes()
+    a = ev.pop_bytes()
+    if len(a) + len(b) > MAX_BYTES:
+        ev.fail("concat produced a too big byte-array")
+    ev.push(a + b)
+
+
+def hash_op(name: str):
+    def op(ev: Evaluator):
+        ev.push(hashlib.new(name, ev.pop_bytes()).digest())
+    return op
+
+
+def op_keccak256(ev: Evaluator):
+    try:
+        from Crypto.Hash import keccak
+    except ImportError:
+        ev.fail("keccak256 needs pycryptodome")
+    ev.push(keccak.new(data=ev.pop_bytes(), digest_bits=256).digest())
+
+
+def op_ed25519verify_bare(ev: Evaluator):
+    pk = ev.pop_bytes()
+    sig = ev.pop_bytes()
+    data = ev.pop_bytes()
+    try:
+        VerifyKey(pk).verify(data, sig)
+        ev.push(1)
+    except (BadSignatureError, ValueError):
+        ev.push(0)
+
+
+def op_mulw(ev: Evaluator):
+    b = ev.pop_int()
+    a = ev.pop_int()
+    r = a * b
+    ev.push(r >> 64)
+    ev.push(r & MAX_UINT64)
+
+
+def op_addw(ev: Evaluator):
+    b = ev.pop_int()
+    a = ev.pop_int()
+    r = a + b
+    ev.push(r >> 64)
+    ev.push(r & MAX_UINT64)
+
+
+def op_divmodw(ev: Evaluator):
+    b = ev.pop_int()
+    b = (ev.pop_int() << 64) | b
+    a = ev.pop_int()
+    a = (ev.pop_int() << 64) | a
+    q, r = divmod(a, nonzero(ev, b, "/"))
+    for v in (q >> 64, q & MAX_UINT64, r >> 64, r & MAX_UINT64):
+        ev.push(v)
+
+
+def op_divw(ev: Evaluator):
+    b = ev.pop_int()
+    lo = ev.pop_int()
+    hi = ev.pop_int()
+    ev.push(checked(ev, ((hi << 64) | lo) // nonzero(ev, b, "/"), "divw"))
+
+
+def op_exp(ev: Evaluator):
+    b = ev.pop_int()
+    a = ev.pop_int()
+    if a == 0 and b == 0:
+        ev.fail("0^0 is undefined")
+    if a > 1 and b >= 64:
+        ev.fail("exp overflowed")
+    ev.push(checked(ev, a ** b, "exp"))
+
+
+def op_expw(ev: Evaluator):
+    b = ev.pop_int()
+    a = ev.pop_int()
+    if a == 0 and b == 0:
+        ev.fail("0^0 is undefined")
+    if a > 1 and b > 128:
+        ev.fail("expw overflowed")
+    r = a ** b
+    if r > 2**128 - 1:
+        ev.fail("expw overflowed")
+    ev.push(r >> 64)
+    ev.push(r & MAX_UINT64)
+
+
+def op_dig(ev: Evaluator, n: int):
+    if n >= len(ev.stack):
+        ev.fail(f"dig {n} with stack size {len(ev.stack)}")
+    ev.push(ev.stack[-1 - n])
+
+
+def op_cover(ev: Evaluator, n: int):
+    if n >= len(ev.stack):
+        ev.fail(f"cover {n} with stack size {len(ev.stack)}")
+    ev.stack.insert(len(ev.stack) - 1 - n, ev.stack.pop())
+
+
+def op_uncover(ev: Evaluator, n: int):
+    if n >= len(ev.stack):
+        ev.fail(f"uncover {n} with stack size {len(ev.stack)}")
+    ev.stack.append(ev.stack.pop(-1 - n))
+
+
+def op_select(ev: Evaluator):
+    c = ev.pop_int()
+    b = ev.pop()
+    a = ev.pop()
+    ev.push(b if c else a)
+
+
+def op_swap(ev: Evaluator):
+    b = ev.pop()
+    a = ev.pop()
+    ev.push(b)
+    ev.push(a)
+
+
+def op_dup2(ev: Evaluator):
+    op_dig(ev, 1)
+    op_dig(ev, 1)
+
+
+def op_int(ev: Evaluator, v):
+    if isinstance(v, str):
+        if v in ON_COMPLETION:
+            v = ON_COMPLETION[v]
+        elif v in TYPE_ENUM:
+            v = TYPE_ENUM[v]
+        else:
+            ev.fail(f"unknown int constant {v}")
+    ev.push(v)
+
+
+def op_intcblock(ev: Evaluator, *values: int):
+    ev.intc = list(values)
+
+
+def op_bytecblock(ev: Evaluator, *values: bytes):
+    ev.bytec = list(values)
+
+
+def op_intc(ev: Evaluator, i: int):
+    if i >= len(ev.intc):
+        ev.fail(f"intc {i} beyond {len(ev.intc)} constants")
+    ev.push(ev.intc[i])
+
+
+def op_bytec(ev: Evaluator, i: int):
+    if i >= len(ev.bytec):
+        ev.fail(f"bytec {i} beyond {len(ev.bytec)} constants")
+    ev.push(ev.bytec[i])
+
+
+def op_bnz(ev: Evaluator, target: int, zero: bool = False):
+    if (ev.pop_int() == 0) == zero:
+        ev.pc = target
+
+
+def op_return(ev: Evaluator):
+    v = ev.pop()
+    ev.stack = [v]
+    return STOP
+
+
+def op_assert(ev: Evaluator):
+    if ev.pop_int() == 0:
+        ev.fail("assert failed")
+
+
+def op_callsub(ev: Evaluator, target: int):
+    if len(ev.callstack) >= 1024:
+        ev.fail("callsub depth exceeded")
+    ev.callstack.append(ev.pc)
+    ev.pc = target
+
+
+def op_retsub(ev: Evaluator):
+    if not ev.callstack:
+        ev.fail("retsub with empty callstack")
+    ev.pc = ev.callstack.pop()
+
+
+def op_store(ev: Evaluator, i: int):
+    ev.scratch[i] = ev.pop()
+
+
+def op_stores(ev: Evaluator):
+    v = ev.pop()
+    i = ev.pop_int()
+    if i >= 256:
+        ev.fail(f"invalid Scratch index {i}")
+    ev.scratch[i] = v
+
+
+def op_loads(ev: Evaluator):
+    i = ev.pop_int()
+    if i >= 256:
+        ev.fail(f"invalid Scratch index {i}")
+    ev.push(ev.scratch[i])
+
+
+def gload(ev: Evaluator, t: int, i: int):
+    if ev.depth > 0 or t >= ev.gi:
+        ev.fail(f"can't use gload on txn {t} from txn {ev.gi}")
+    scratch = ev.group.scratch.get(t)
+    if scratch is None:
+        ev.fail(f"txn {t} is not an app call")
+    ev.push(scratch[i])
+
+
+def gtxn(ev: Evaluator, t: int, name: str, index: Optional[int] = None):
+    if t >= len(ev.txns):
+        ev.fail(f"gtxn lookup TxnGroup[{t}] but it only has {len(ev.txns)}")
+    ev.push(txn_field(ev.txns[t], name, index))
+
+
+def op_global(ev: Evaluator, name: str):
+    group = ev.group
+    values = {
+        "MinTxnFee": lambda: MIN_TXN_FEE,
+        "MinBalance": lambda: MIN_BALANCE,
+        "MaxTxnLife": lambda: MAX_TXN_LIFE,
+        "ZeroAddress": lambda: bytes(32),
+        "GroupSize": lambda: len(ev.txns),
+        "LogicSigVersion": lambda: 7,
+        "Round": lambda: group.round,
+        "LatestTimestamp": lambda: group.timestamp,
+        "CurrentApplicationID": lambda: ev.app.id,
+        "CreatorAddress": lambda: address_bytes(ev.app.creator),
+        "CurrentApplicationAddress": lambda: address_bytes(ev.app.address),
+        "GroupID": lambda: ev.txn.group,
+        "OpcodeBudget": lambda: group.budget,
+        "CallerApplicationID": lambda: ev.caller,
+        "CallerApplicationAddress": lambda: address_bytes(logic.get_application_address(ev.caller))
+        if ev.caller else bytes(32),
+    }
+    if name not in values:
+        ev.fail(f"invalid global field {name}")
+    ev.push(values[name]())
+
+
+def op_balance(ev: Evaluator, minimum: bool = False):
+    addr = ev.account_ref(ev.pop())
+    ev.push(ev.ledger.min_balance(addr) if minimum else ev.ledger.account(addr).balance)
+
+
+def op_app_opted_in(ev: Evaluator):
+    app_id = ev.app_ref(ev.pop_int())
+    addr = ev.account_ref(ev.pop())
+    ev.push(int(app_id in ev.ledger.account(addr).local))
+
+
+def op_app_local_get(ev: Evaluator):
+    key = ev.pop_bytes()
+    addr = ev.account_ref(ev.pop())
+    ev.push(ev.local_state(addr, ev.app.id).get(key, 0))
+
+
+def op_app_local_get_ex(ev: Evaluator):
+    key = ev.pop_bytes()
+    app_id = ev.app_ref(ev.pop_int())
+    addr = ev.account_ref(ev.pop())
+    local = ev.local_state(addr, app_id)
+    ev.push(local.get(key, 0))
+    ev.push(int(key in local))
+
+
+def op_app_local_put(ev: Evaluator):
+    value = ev.pop()
+    key = ev.pop_bytes()
+    addr = ev.account_ref(ev.pop())
+    ev.put(ev.local_state(addr, ev.app.id), ev.app.local_schema, key, value)
+
+
+def op_app_local_del(ev: Evaluator):
+    key = ev.pop_bytes()
+    addr = ev.account_ref(ev.pop())
+    ev.local_state(addr, ev.app.id).pop(key, None)
+
+
+def op_app_global_get(ev: Evaluator):
+    ev.push(ev.app.state.get(ev.pop_bytes(), 0))
+
+
+def op_app_global_get_ex(ev: Evaluator):
+    key = ev.pop_bytes()
+    app_id = ev.app_ref(ev.pop_int())
+    app = ev.ledger.apps.get(app_id)
+    state = app.state if app else {}
+    ev.push(state.get(key, 0))
+    ev.push(int(key in state))
+
+
+def op_app_global_put(ev: Evaluator):
+    value = ev.pop()
+    key = ev.pop_bytes()
+    ev.put(ev.app.state, ev.app.global_schema, key, value)
+
+
+def op_app_global_del(ev: Evaluator):
+    ev.app.state.pop(ev.pop_bytes(), None)
+
+
+def op_asset_holding_get(ev: Evaluator, name: str):
+    asset_id = ev.asset_ref(ev.pop_int())
+    addr = ev.account_ref(ev.pop())
+    assets = ev.ledger.account(addr).assets
+    if name not in ("AssetBalance", "AssetFrozen"):
+        ev.fail(f"invalid asset_holding_get field {name}")
+    ev.push(assets.get(asset_id, 0) if name == "AssetBalance" else 0)
+    ev.push(int(asset_id in assets))
+
+
+def op_asset_params_get(ev: Evaluator, name: str):
+    asset = ev.ledger.assets.get(ev.asset_ref(ev.pop_int()))
+    attr = {
+        "AssetTotal": "total", "AssetDecimals": "decimals", "AssetDefaultFrozen": "default_frozen",
+        "AssetUnitName": "unit_name", "AssetName": "name", "AssetURL": "url", "AssetMetadataHash": "metadata_hash",
+        "AssetManager": "manager", "AssetReserve": "reserve", "AssetFreeze": "freeze", "AssetClawback": "clawback",
+        "AssetCreator": "creator",
+    }.get(name)
+    if attr is None:
+        ev.fail(f"invalid asset_params_get field {name}")
+    if asset is None:
+        ev.push(0)
+        ev.push(0)
+        return
+    value = getattr(asset, attr)
+    ev.push(address_bytes(value) if attr in ("manager", "reserve", "freeze", "clawback", "creator") else value)
+    ev.push(1)
+
+
+def op_app_params_get(ev: Evaluator, name: str):
+    app = ev.ledger.apps.get(ev.app_ref(ev.pop_int()))
+    values = {
+        "AppApprovalProgram": lambda: app.approval, "AppClearStateProgram": lambda: app.clear,
+        "AppGlobalNumUint": lambda: app.global_schema[0], "AppGlobalNumByteSlice": lambda: app.global_schema[1],
+        "AppLocalNumUint": lambda: app.local_schema[0], "AppLocalNumByteSlice": lambda: app.local_schema[1],
+        "AppExtraProgramPages": lambda: app.extra_pages, "AppCreator": lambda: address_bytes(app.creator),
+        "AppAddress": lambda: address_bytes(app.address),
+    }
+    if name not in values:
+        ev.fail(f"invalid app_params_get field {name}")
+    ev.push(values[name]() if app else 0)
+    ev.push(int(app is not None))
+
+
+def op_acct_params_get(ev: Evaluator, name: str):
+    addr = ev.account_ref(ev.pop())
+    account = ev.ledger.accounts.get(addr)
+    values = {
+        "AcctBalance": lambda: account.balance,
+        "AcctMinBalance": lambda: ev.ledger.min_balance(addr),
+        "AcctAuthAddr": lambda: address_bytes(account.auth_addr),
+    }
+    if name not in values:
+        ev.fail(f"invalid acct_params_get field {name}")
+    ev.push(values[name]() if account else 0)
+    ev.push(int(account is not None and account.balance > 0))
+
+
+def op_log(ev: Evaluator):
+    msg = ev.pop_bytes()
+    logs = ev.txn.logs
+    if len(logs) >= MAX_LOGS:
+        ev.fail(f"too many log calls in program. up to {MAX_LOGS} is allowed")
+    if sum(map(len, logs)) + len(msg) > MAX_LOG_SIZE:
+        ev.fail(f"program logs too large. {MAX_LOG_SIZE} bytes is allowed")
+    logs.append(msg)
+
+
+def op_itxn_begin(ev: Evaluator, next_: bool = False):
+    if next_ and not ev.inner:
+        ev.fail("itxn_next without itxn_begin")
+    if not next_ and ev.inner is not None:
+        ev.fail("itxn_begin without itxn_submit")
+    if next_:
+        ev.inner.append(ev.new_inner())
+    else:
+        ev.inner = [ev.new_inner()]
+    ev.group.inner_count += 1
+    if ev.group.inner_count > MAX_INNER_TXNS:
+        ev.fail(f"too many inner transactions {ev.group.inner_count}")
+
+
+def op_itxn_field(ev: Evaluator, name: str):
+    if not ev.inner:
+        ev.fail("itxn_field without itxn_begin")
+    ev.set_inner_field(name, ev.pop())
+
+
+def itxn(ev: Evaluator, t: Optional[int], name: str, index: Optional[int] = None):
+    txns = ev.last_inner
+    if not txns:
+        ev.fail("no inner transaction available")
+    t = len(txns) - 1 if t is None else t
+    if t >= len(txns):
+        ev.fail(f"gitxn {t} beyond {len(txns)} inner transactions")
+    ev.push(txn_field(txns[t], name, index))
+
+
+OPS: dict[str, Callable] = {
+    "err": lambda ev: ev.fail("err opcode executed"),
+    "+": binary_int(lambda ev, a, b: checked(ev, a + b, "+")),
+    "-": binary_int(lambda ev, a, b: checked(ev, a - b, "-")),
+    "*": binary_int(lambda ev, a, b: checked(ev, a * b, "*")),
+    "/": binary_int(lambda ev, a, b: a // nonzero(ev, b, "/")),
+    "%": binary_int(lambda ev, a, b: a % nonzero(ev, b, "%")),
+    "<": binary_int(lambda ev, a, b: int(a < b)),
+    ">": binary_int(lambda ev, a, b: int(a > b)),
+    "<=": binary_int(lambda ev, a, b: int(a <= b)),
+    ">=": binary_int(lambda ev, a, b: int(a >= b)),
+    "&&": binary_int(lambda ev, a, b: int(bool(a and b))),
+    "||": binary_int(lambda ev, a, b: int(bool(a or b))),
+    "|": binary_int(lambda ev, a, b: a | b),
+    "&": binary_int(lambda ev, a, b: a & b),
+    "^": binary_int(lambda ev, a, b: a ^ b),
+    "shl": binary_int(lambda ev, a, b: (a << b) & MAX_UINT64 if b < 64 else ev.fail(f"shl arg too big, ({b})")),
+    "shr": binary_int(lambda ev, a, b: a >> b if b < 64 else ev.fail(f"shr arg too big, ({b})")),
+    "==": op_eq,
+    "!=": lambda ev: op_eq(ev, negate=True),
+    "!": lambda ev: ev.push(int(ev.pop_int() == 0)),
+    "~": lambda ev: ev.push(MAX_UINT64 ^ ev.pop_int()),
+    "sqrt": lambda ev: ev.push(isqrt(ev.pop_int())),
+    "bitlen": op_bitlen,
+    "exp": op_exp,
+    "expw": op_expw,
+    "mulw": op_mulw,
+    "addw": op_addw,
+    "divmodw": op_divmodw,
+    "divw": op_divw,
+    "len": lambda ev: ev.push(len(ev.pop_bytes())),
+    "itob": lambda ev: ev.push(ev.pop_int().to_bytes(8, "big")),
+    "btoi": op_btoi,
+    "concat": op_concat,
+    "substring": lambda ev, s, e: ev.push(substring(ev, ev.pop_bytes(), s, e)),
+    "substring3": op_substring3,
+    "extract": op_extract,
+    "extract3": op_extract3,
+    "extract_uint16": extract_uint(2),
+    "extract_uint32": extract_uint(4),
+    "extract_uint64": extract_uint(8),
+    "replace2": replace,
+    "replace3": op_replace3,
+    "getbit": op_getbit,
+    "setbit": op_setbit,
+    "getbyte": op_getbyte,
+    "setbyte": op_setbyte,
+    "bzero": op_bzero,
+    "sha256": hash_op("sha256"),
+    "sha512_256": hash_op("sha512_256"),
+    "sha3_256": hash_op("sha3_256"),
+    "keccak256": op_keccak256,
+    "ed25519verify_bare": op_ed25519verify_bare,
+    "b+": binary_bytes(lambda ev, a, b: a + b),
+    "b-": binary_bytes(lambda ev, a, b: a - b if a >= b else ev.fail("byte math would have negative result")),
+    "b*": binary_bytes(lambda ev, a, b: a * b),
+    "b/": binary_bytes(lambda ev, a, b: a // nonzero(ev, b, "b/")),
+    "b%": binary_bytes(lambda ev, a, b: a % nonzero(ev, b, "b%")),
+    "b<": binary_bytes(lambda ev, a, b: a < b),
+    "b>": binary_bytes(lambda ev, a, b: a > b),
+    "b<=": binary_bytes(lambda ev, a, b: a <= b),
+    "b>=": binary_bytes(lambda ev, a, b: a >= b),
+    "b==": binary_bytes(lambda ev, a, b: a == b),
+    "b!=": binary_bytes(lambda ev, a, b: a != b),
+    "b|": bitwise_bytes(lambda a, b: a | b),
+    "b&": bitwise_bytes(lambda a, b: a & b),
+    "b^": bitwise_bytes(lambda a, b: a ^ b),
+    "b~": lambda ev: ev.push(bytes(~c & 0xFF for c in ev.pop_bytes())),
+    "bsqrt": lambda ev: ev.push(to_bytes(isqrt(int.from_bytes(ev.pop_bytes(), "big")))),
+    "pop": lambda ev: ev.pop(),
+    "dup": lambda ev: op_dig(ev, 0),
+    "dup2": op_dup2,
+    "dig": op_dig,
+    "swap": op_swap,
+    "select": op_select,
+    "cover": op_cover,
+    "uncover": op_uncover,
+    "intcblock": op_intcblock,
+    "intc": op_intc,
+    "intc_0": lambda ev: op_intc(ev, 0),
+    "intc_1": lambda ev: op_intc(ev, 1),
+    "intc_2": lambda ev: op_intc(ev, 2),
+    "intc_3": lambda ev: op_intc(ev, 3),
+    "bytecblock": op_bytecblock,
+    "bytec": op_bytec,
+    "bytec_0": lambda ev: op_bytec(ev, 0),
+    "bytec_1": lambda ev: op_bytec(ev, 1),
+    "bytec_2": lambda ev: op_bytec(ev, 2),
+    "bytec_3": lambda ev: op_bytec(ev, 3),
+    "pushint": lambda ev, v: ev.push(v),
+    "pushbytes": lambda ev, v: ev.push(v),
+    "int": op_int,
+    "byte": lambda ev, v: ev.push(v),
+    "addr": lambda ev, v: ev.push(v),
+    "method": lambda ev, v: ev.push(v),
+    "b": lambda ev, target: setattr(ev, "pc", target),
+    "bz": lambda ev, target: op_bnz(ev, target, zero=True),
+    "bnz": op_bnz,
+    "return": op_return,
+    "assert": op_assert,
+    "callsub": op_callsub,
+    "retsub": op_retsub,
+    "load": lambda ev, i: ev.push(ev.scratch[i]),
+    "store": op_store,
+    "loads": op_loads,
+    "stores": op_stores,
+    "gload": gload,
+    "gloads": lambda ev, i: gload(ev, ev.pop_int(), i),
+    "txn": lambda ev, name, index=None: ev.push(txn_field(ev.txn, name, index)),
+    "txna": lambda ev, name, index: ev.push(txn_field(ev.txn, name, index)),
+    "txnas": lambda ev, name: ev.push(txn_field(ev.txn, name, ev.pop_int())),
+    "gtxn": gtxn,
+    "gtxna": gtxn,
+    "gtxnas": lambda ev, t, name: gtxn(ev, t, name, ev.pop_int()),
+    "gtxns": lambda ev, name, index=None: gtxn(ev, ev.pop_int(), name, index),
+    "gtxnsa": lambda ev, name, index: gtxn(ev, ev.pop_int(), name, index),
+    "gtxnsas": lambda ev, name: (lambda i: gtxn(ev, ev.pop_int(), name, i))(ev.pop_int()),
+    "gaid": lambda ev, t: ev.push(ev.txns[t].created_application_id or ev.txns[t].created_asset_id),
+    "gaids": lambda ev: ev.push((lambda t: t.created_application_id or t.created_asset_id)(ev.txns[ev.pop_int()])),
+    "global": op_global,
+    "balance": op_balance,
+    "min_balance": lambda ev: op_balance(ev, minimum=True),
+    "app_opted_in": op_app_opted_in,
+    "app_local_get": op_app_local_get,
+    "app_local_get_ex": op_app_local_get_ex,
+    "app_local_put": op_app_local_put,
+    "app_local_del": op_app_local_del,
+    "app_global_get": op_app_global_get,
+    "app_global_get_ex": op_app_global_get_ex,
+    "app_global_put": op_app_global_put,
+    "app_global_del": op_app_global_del,
+    "asset_holding_get": op_asset_holding_get,
+    "asset_params_get": op_asset_params_get,
+    "app_params_get": op_app_params_get,
+    "acct_params_get": op_acct_params_get,
+    "log": op_log,
+    "itxn_begin": op_itxn_begin,
+    "itxn_next": lambda ev: op_itxn_begin(ev, next_=True),
+    "itxn_field": op_itxn_field,
+    "itxn_submit": lambda ev: ev.submit_inner(),
+    "itxn": lambda ev, name, index=None: itxn(ev, None, name, index),
+    "itxna": lambda ev, name, index: itxn(ev, None, name, index),
+    "itxnas": lambda ev, name: itxn(ev, None, name, ev.pop_int()),
+    "gitxn": itxn,
+    "gitxna": itxn,
+    "gitxnas": lambda ev, t, name: itxn(ev, t, name, ev.pop_int()),
+}
+
+
+class Group:
+    """Applies a group of transactions on a working copy of the ledger"""
+
+    def __init__(self, ledger: "Ledger", txns: list[Txn]):
+        self.ledger = ledger
+        self.txns = txns
+        self.round = ledger.round + 1
+        self.timestamp = ledger.timestamp
+        self.budget = APP_CALL_BUDGET * sum(1 for t in txns if t.type == "appl")
+        self.fee_credit = sum(t.fee for t in txns) - MIN_TXN_FEE * len(txns)
+        self.inner_count = 0
+        self.scratch: dict[int, list[Value]] = {}
+        self.touched: set[str] = set()
+        self.created_apps: list[int] = []
+        """Applications created by the group, available to the later transactions as the foreign apps"""
+
+    def run(self):
+        if self.fee_credit < 0:
+            raise TxnError(f"txgroup had {self.fee_credit + MIN_TXN_FEE * len(self.txns)} in fees, "
+                           f"which is less than the minimum {MIN_TXN_FEE * len(self.txns)}")
+        for i, t in enumerate(self.txns):
+            t.group_index = i
+            try:
+                self.apply(t, self.txns, 0)
+            except (LogicError, TxnError) as e:
+                e.txid = e.txid or t.txid
+                raise
+        for addr in self.touched:
+            account = self.ledger.accounts.get(addr)
+            if account is None or account == Account():
+                continue
+            if account.balance < self.ledger.min_balance(addr):
+                raise TxnError(f"account {addr} balance {account.balance} below min "
+                               f"{self.ledger.min_balance(addr)}")
+
+    def inner_txid(self, parent: Txn, t: Txn) -> str:
+        digest = hashlib.new("sha512_256", f"{parent.txid}/{len(parent.inner)}/{t.group_index}".encode()).digest()
+        return base64.b32encode(digest).decode().strip("=")
+
+    def debit(self, addr: str, amount: int):
+        account = self.ledger.account(addr)
+        if account.balance < amount:
+            raise TxnError(f"overspend (account {addr}, tried to spend {amount} with balance {account.balance})")
+        account.balance -= amount
+        self.touched.add(addr)
+
+    def credit(self, addr: str, amount: int):
+        self.ledger.account(addr).balance += amount
+        self.touched.add(addr)
+
+    def apply(self, t: Txn, txns: list[Txn], depth: int, caller: int = 0):
+        if depth > 0:
+            if t.fee is None:
+                t.fee = max(0, MIN_TXN_FEE - self.fee_credit)
+            self.fee_credit += t.fee - MIN_TXN_FEE
+            if self.fee_credit < 0:
+                raise TxnError("fee too small")
+            if t.sender != logic.get_application_address(caller):
+                raise TxnError(f"unauthorized inner sender {t.sender}")
+        self.debit(t.sender, t.fee)
+        if t.type == "pay":
+            self.pay(t)
+        elif t.type == "axfer":
+            self.asset_transfer(t)
+        elif t.type == "acfg":
+            self.asset_config(t)
+        elif t.type == "appl":
+            self.app_call(t, txns, depth, caller)
+        else:
+            raise TxnError(f"transaction type {t.type or 'unknown'} is not supported")
+        if t.rekey_to != ZERO_ADDRESS:
+            self.ledger.account(t.sender).auth_addr = t.rekey_to if t.rekey_to != t.sender else ZERO_ADDRESS
+
+    def pay(self, t: Txn):
+        self.debit(t.sender, t.amount)
+        self.credit(t.receiver, t.amount)
+        if t.close_remainder_to != ZERO_ADDRESS:
+            account = self.ledger.account(t.sender)
+            if account.assets or account.local or self.ledger.created(t.sender):
+                raise TxnError(f"account {t.sender} can't be closed while it holds assets or apps")
+            self.credit(t.close_remainder_to, account.balance)
+            del self.ledger.accounts[t.sender]
+
+    def asset_transfer(self, t: Txn):
+        asset = self.ledger.assets.get(t.xfer_asset)
+        if asset is None:
+            raise TxnError(f"asset {t.xfer_asset} does not exist")
+        source = t.sender
+        if t.asset_sender != ZERO_ADDRESS:
+            if t.sender != asset.clawback:
+                raise TxnError(f"{t.sender} is not the clawback of asset {asset.id}")
+            source = t.asset_sender
+        holdings = self.ledger.account(source).assets
+        # Opt-in
+        if t.asset_receiver == source and t.asset_amount == 0 and asset.id not in holdings:
+            holdings[asset.id] = 0
+            self.touched.add(source)
+            return
+        receiver = self.ledger.account(t.asset_receiver).assets
+        if asset.id not in holdings:
+            raise TxnError(f"asset {asset.id} missing from {source}")
+        if asset.id not in receiver:
+            raise TxnError(f"receiver {t.asset_receiver} is not opted in to asset {asset.id}")
+        if holdings[asset.id] < t.asset_amount:
+            raise TxnError(f"underflow on subtracting {t.asset_amount} from sender amount {holdings[asset.id]}")
+        holdings[asset.id] -= t.asset_amount
+        receiver[asset.id] += t.asset_amount
+        if t.asset_close_to != ZERO_ADDRESS:
+            close_to = self.ledger.account(t.asset_close_to).assets
+            if asset.id not in close_to:
+                raise TxnError(f"{t.asset_close_to} is not opted in to asset {asset.id}")
+            close_to[asset.id] += holdings.pop(asset.id)
+        self.touched.add(source)
+
+    def asset_config(self, t: Txn):
+        if t.config_asset == 0:
+            asset_id = self.ledger.new_index()
+            self.ledger.assets[asset_id] = Asset(
+                asset_id, t.sender, t.config_asset_total, t.config_asset_decimals, t.config_asset_default_frozen,
+                t.config_asset_unit_name, t.config_asset_name, t.config_asset_url, t.config_asset_metadata_hash,
+                t.config_asset_manager, t.config_asset_reserve, t.config_asset_freeze, t.config_asset_clawback,
+            )
+            self.ledger.account(t.sender).assets[asset_id] = t.config_asset_total
+            t.created_asset_id = asset_id
+            self.touched.add(t.sender)
+            return
+        asset = self.ledger.assets.get(t.config_asset)
+        if asset is None or t.sender != asset.manager:
+            raise TxnError(f"{t.sender} can't configure asset {t.config_asset}")
+        if all(getattr(t, f) == ZERO_ADDRESS for f in
+               ("config_asset_manager", "config_asset_reserve", "config_asset_freeze", "config_asset_clawback")):
+            if self.ledger.account(asset.creator).assets.get(asset.id) != asset.total:
+                raise TxnError(f"asset {asset.id} can't be destroyed while accounts hold it")
+            del self.ledger.account(asset.creator).assets[asset.id]
+            del self.ledger.assets[asset.id]
+            return
+        asset.manager, asset.reserve = t.config_asset_manager, t.config_asset_reserve
+        asset.freeze, asset.clawback = t.config_asset_freeze, t.config_asset_clawback
+
+    def app_call(self, t: Txn, txns: list[Txn], depth: int, caller: int):
+        if depth > 0:
+            self.budget += APP_CALL_BUDGET
+        ledger = self.ledger
+        self.touched.add(t.sender)
+        if t.application_id == 0:
+            if t.global_num_uint + t.global_num_byte_slice > 64 or t.local_num_uint + t.local_num_byte_slice > 16:
+                raise TxnError("application state schema is too large")
+            app = App(ledger.new_index(), t.sender, t.approval_program, t.clear_state_program,
+                      (t.global_num_uint, t.global_num_byte_slice), (t.local_num_uint, t.local_num_byte_slice),
+                      t.extra_program_pages)
+            ledger.apps[app.id] = app
+            t.created_application_id = app.id
+            self.created_apps.append(app.id)
+        else:
+            app = ledger.apps.get(t.application_id)
+            if app is None:
+                raise TxnError(f"application {t.application_id} does not exist")
+        local = ledger.account(t.sender).local
+        if t.on_completion == OPT_IN:
+            if app.id in local:
+                raise TxnError(f"account {t.sender} has already opted in to app {app.id}")
+            local[app.id] = {}
+        elif t.on_completion in (CLOSE_OUT, CLEAR_STATE) and app.id not in local:
+            raise TxnError(f"account {t.sender} is not opted in to app {app.id}")
+
+        if t.on_completion == CLEAR_STATE:
+            saved = copy.deepcopy((app.state, ledger.accounts))
+            try:
+                Evaluator(self, txns, t.group_index, app, app.clear, depth, caller).run()
+            except LogicError:
+                app.state, ledger.accounts = saved
+            ledger.account(t.sender).local.pop(app.id, None)
+            return
+
+        evaluator = Evaluator(self, txns, t.group_index, app, app.approval, depth, caller)
+        approved = evaluator.run()
+        if depth == 0:
+            self.scratch[t.group_index] = evaluator.scratch
+        if not approved:
+            raise LogicError("rejected by ApprovalProgram", evaluator._line(), "return")
+        if t.on_completion == CLOSE_OUT:
+            local.pop(app.id, None)
+        elif t.on_completion == UPDATE:
+            app.approval, app.clear = t.approval_program, t.clear_state_program
+        elif t.on_completion == DELETE:
+            del ledger.apps[app.id]
+
+
+class Ledger:
+    """Accounts, assets and applications of a network kept in memory"""
+
+    def __init__(self):
+        self.round = 1
+        self.timestamp = GENESIS_TIMESTAMP
+        self.accounts: dict[str, Account] = {}
+        self.apps: dict[int, App] = {}
+        self.assets: dict[int, Asset] = {}
+        self.index = 1000
+        self.confirmed: dict[str, dict] = {}
+        self.blocks: dict[int, list[dict]] = {}
+        self.genesis_accounts: list[SandboxAccount] = []
+        self.last_group: list[Txn] = []
+        self.lock = threading.RLock()
+        """Groups are applied one at a time, the clients may send them from several threads"""
+
+    def new_index(self) -> int:
+        self.index += 1
+        return self.index
+
+    def account(self, addr: str) -> Account:
+        if addr not in self.accounts:
+            self.accounts[addr] = Account()
+        return self.accounts[addr]
+
+    def created(self, addr: str) -> tuple[list[App], list[Asset]]:
+        return ([a for a in self.apps.values() if a.creator == addr],
+                [a for a in self.assets.values() if a.creator == addr])
+
+    def min_balance(self, addr: str) -> int:
+        account = self.accounts.get(addr)
+        if account is None:
+            return 0
+        apps, assets = self.created(addr)
+        total = MIN_BALANCE + ASSET_MIN_BALANCE * len(account.assets)
+        for app_id in account.local:
+            app = self.apps.get(app_id)
+            total += APP_MIN_BALANCE
+            if app:
+                total += schema_min_balance(app.local_schema)
+        for app in apps:
+            total += APP_MIN_BALANCE + APP_PAGE_MIN_BALANCE * app.extra_pages + schema_min_balance(app.global_schema)
+        return total
+
+    def get_accounts(self, n: int = 3) -> list[SandboxAccount]:
+        """Funded accounts, same as the ones of the sandbox wallet"""
+        while len(self.genesis_accounts) < n:
+            self.genesis_accounts.append(self.new_account(ACCOUNT_BALANCE))
+        return self.genesis_accounts[:n]
+
+    def new_account(self, balance: int = 0) -> SandboxAccount:
+        """Account with keys derived from a counter, so the addresses are the same on every run"""
+        seed = hashlib.sha256(f"{GENESIS_ID}/{len(self.accounts)}".encode()).digest()
+        key = SigningKey(seed)
+        private_key = base64.b64encode(seed + bytes(key.verify_key)).decode()
+        address = encoding.encode_address(bytes(key.verify_key))
+        self.account(address).balance += balance
+        return SandboxAccount(address, private_key, AccountTransactionSigner(private_key))
+
+    def advance(self, rounds: int = 1):
+        """Add empty blocks"""
+        for _ in range(rounds):
+            self.round += 1
+            self.timestamp += BLOCK_TIME
+            self.blocks[self.round] = []
+
+    def _working_copy(self) -> "Ledger":
+        working = copy.copy(self)
+        working.accounts = copy.deepcopy(self.accounts)
+        working.apps = copy.deepcopy(self.apps)
+        working.assets = copy.deepcopy(self.assets)
+        return working
+
+    def _evaluate(self, stxns: list, check: bool) -> tuple["Ledger", list[Txn]]:
+        if not stxns or len(stxns) > MAX_GROUP_SIZE:
+            raise TxnError(f"group size {len(stxns)} is not allowed")
+        txns = [Txn.from_sdk(s.transaction) for s in stxns]
+        if check:
+            self._check(stxns, txns)
+        working = self._working_copy()
+        Group(working, txns).run()
+        return working, txns
+
+    def _check(self, stxns: list, txns: list[Txn]):
+        group_id = None
+        if len(stxns) > 1:
+            ungrouped = [copy.copy(s.transaction) for s in stxns]
+            for txn in ungrouped:
+                txn.group = None
+            group_id = transaction.calculate_group_id(ungrouped)
+        for s, t in zip(stxns, txns):
+            if not isinstance(s, transaction.SignedTransaction):
+                raise TxnError("only signed transactions are supported", t.txid)
+            if t.txid in self.confirmed:
+                raise TxnError("transaction already in ledger", t.txid)
+            if s.transaction.genesis_hash != GENESIS_HASH:
+                raise TxnError("genesis hash mismatch", t.txid)
+            if not t.first_valid <= self.round + 1 <= t.last_valid:
+                raise TxnError(f"txn dead: round {self.round + 1} outside of {t.first_valid}--{t.last_valid}",
+                               t.txid)
+            if t.last_valid - t.first_valid > MAX_TXN_LIFE:
+                raise TxnError("validity window too large", t.txid)
+            if group_id is not None and s.transaction.group != group_id:
+                raise TxnError("incomplete group", t.txid)
+            auth = self.accounts[t.sender].auth_addr if t.sender in self.accounts else ZERO_ADDRESS
+            signer = auth if auth != ZERO_ADDRESS else t.sender
+            if (s.authorizing_address or t.sender) != signer:
+                raise TxnError(f"should have been authorized by {signer}", t.txid)
+            message = b"TX" + base64.b64decode(encoding.msgpack_encode(s.transaction))
+            try:
+                VerifyKey(address_bytes(signer)).verify(message, base64.b64decode(s.signature))
+            except BadSignatureError:
+                raise TxnError("invalid signature", t.txid)
+
+    def submit(self, stxns: list) -> list[str]:
+        """Applies the group in a new block, nothing is applied if a transaction fails"""
+        with self.lock:
+            working, txns = self._evaluate(stxns, check=True)
+            self.accounts, self.apps, self.assets, self.index = \
+                working.accounts, working.apps, working.assets, working.index
+            self.advance()
+            for s, t in zip(stxns, txns):
+                info = self.txn_info(t, sig=s.signature)
+                self.confirmed[t.txid] = info
+                self.blocks[self.round].append(info)
+            self.last_group = txns
+            return [t.txid for t in txns]
+
+    def dryrun(self, stxns: list) -> list[dict]:
+        """Evaluates the group without applying it, the signatures are not checked"""
+        with self.lock:
+            working = self._working_copy()
+        txns = [Txn.from_sdk(s.transaction) for s in stxns]
+        group = Group(working, txns)
+        results = []
+        for i, t in enumerate(txns):
+            t.group_index = i
+            result = {"txn": {"txn": t.to_json()}, "logs": [], "app-call-messages": [], "disassembly": [],
+                      "budget-added": APP_CALL_BUDGET if t.type == "appl" else 0, "budget-consumed": 0}
+            try:
+                group.apply(t, txns, 0)
+                if t.type == "appl":
+                    result["app-call-messages"] = ["ApprovalProgram", "PASS"]
+            except (LogicError, TxnError) as e:
+                result["app-call-messages"] = ["ApprovalProgram", "REJECT", str(e)]
+                results.append(result)
+                break
+            finally:
+                result["logs"] = [b64(log) for log in t.logs]
+                result["budget-consumed"] = result["cost"] = t.cost
+            results.append(result)
+        return results
+
+    def txn_info(self, t: Txn, sig: str = "") -> dict:
+        info = {
+            "confirmed-round": self.round,
+            "pool-error": "",
+            "txn": {"sig": sig, "txn": t.to_json()},
+            "logs": [b64(log) for log in t.logs],
+            "inner-txns": [self.txn_info(i) for i in t.inner],
+        }
+        if t.created_application_id:
+            info["application-index"] = t.created_application_id
+        if t.created_asset_id:
+            info["asset-index"] = t.created_asset_id
+        return info
+
+
+def schema_min_balance(schema: tuple[int, int]) -> int:
+    uints, byte_slices = schema
+    return (SCHEMA_MIN_BALANCE + SCHEMA_UINT_MIN_BALANCE) * uints + \
+        (SCHEMA_MIN_BALANCE + SCHEMA_BYTES_MIN_BALANCE) * byte_slices
+
+
+def not_found(msg: str):
+    return AlgodHTTPError(msg, 404)
+
+
+class LocalAlgod:
+    """The algod endpoints used by ApplicationClient and the transaction composer, served by a Ledger"""
+
+    def __init__(self, ledger: Optional[Ledger] = None):
+        self.ledger = ledger or Ledger()
+
+    def compile(self, source: str, source_map: bool = False, **kwargs) -> dict:
+        program = source.encode()
+        load_program(program)
+        result = {"hash": logic.address(program), "result": b64(program)}
+        if source_map:
+            result["sourcemap"] = teal_source_map(source)
+        return result
+
+    def suggested_params(self, **kwargs) -> transaction.SuggestedParams:
+        r = self.ledger.round
+        return transaction.SuggestedParams(0, r, r + MAX_TXN_LIFE, GENESIS_HASH, GENESIS_ID, False, MIN_TXN_FEE)
+
+    def send_transactions(self, txns: list, **kwargs) -> str:
+        try:
+            return self.ledger.submit(list(txns))[0]
+        except LogicError as e:
+            raise AlgodHTTPError(f"TransactionPool.Remember: transaction {e.txid}: logic eval error: {e.msg}. "
+                                 f"Details: pc={e.pc}, opcodes={e.op}", 400)
+        except TxnError as e:
+            raise AlgodHTTPError(f"TransactionPool.Remember: transaction {e.txid}: {e}", 400)
+
+    def send_transaction(self, txn, **kwargs) -> str:
+        return self.send_transactions([txn])
+
+    def send_raw_transaction(self, txn: Union[str, bytes], **kwargs) -> str:
+        """Accepts the msgpack of one signed transaction or of a concatenated group, base64 or raw"""
+        raw = base64.b64decode(txn) if isinstance(txn, str) else txn
+        return self.send_transactions(decode_signed_group(raw))
+
+    def status(self, **kwargs) -> dict:
+        return {"last-round": self.ledger.round, "time-since-last-round": 0, "catchup-time": 0,
+                "last-version": GENESIS_ID, "next-version-round": self.ledger.round + 1}
+
+    def status_after_block(self, block_num: int, **kwargs) -> dict:
+        if self.ledger.round <= block_num:
+            self.ledger.advance(block_num + 1 - self.ledger.round)
+        return self.status()
+
+    def block_info(self, block: int = None, response_format: str = "json", round_num: int = None, **kwargs) -> dict:
+        """The block in the json format of algod, each transaction with the logs and inner transactions it applied"""
+        r = block if block is not None else round_num
+        if r is None or not 0 <= r <= self.ledger.round:
+            raise not_found(f"ledger does not have entry {r}")
+        if response_format != "json":
+            raise AlgodHTTPError("only the json format is supported", 400)
+        return {"block": {"rnd": r, "gen": GENESIS_ID, "gh": GENESIS_HASH,
+                          "txns": [self._block_txn(info) for info in self.ledger.blocks.get(r, [])]}}
+
+    def _block_txn(self, info: dict) -> dict:
+        """Signed transaction in a block, the apply data is under dt"""
+        txn = {"txn": info["txn"]["txn"], "hgi": True}
+        if info["txn"].get("sig"):
+            txn["sig"] = info["txn"]["sig"]
+        if "application-index" in info:
+            txn["apid"] = info["application-index"]
+        dt = {}
+        if info["logs"]:
+            dt["lg"] = info["logs"]
+        if info["inner-txns"]:
+            dt["itx"] = [self._block_txn(i) for i in info["inner-txns"]]
+        if dt:
+            txn["dt"] = dt
+        return txn
+
+    def pending_transaction_info(self, transaction_id: str, **kwargs) -> dict:
+        if transaction_id not in self.ledger.confirmed:
+            raise not_found("txn does not exist")
+        return self.ledger.confirmed[transaction_id]
+
+    def application_info(self, application_id: int, **kwargs) -> dict:
+        app = self.ledger.apps.get(application_id)
+        if app is None:
+            raise not_found("application does not exist")
+        return {"id": app.id, "params": app.params_json()}
+
+    def asset_info(self, asset_id: int, **kwargs) -> dict:
+        asset = self.ledger.assets.get(asset_id)
+        if asset is None:
+            raise not_found("asset does not exist")
+        return {"index": asset.id, "params": asset.params_json()}
+
+    def account_info(self, address: str, **kwargs) -> dict:
+        ledger = self.ledger
+        account = ledger.accounts.get(address) or Account()
+        apps, assets = ledger.created(address)
+        return {
+            "address": address,
+            "amount": account.balance,
+            "amount-without-pending-rewards": account.balance,
+            "min-balance": ledger.min_balance(address),
+            "round": ledger.round,
+            "status": "Offline",
+            "assets": [{"asset-id": i, "amount": a, "is-frozen": False} for i, a in account.assets.items()],
+            "apps-local-state": [self._local_state_json(address, i) for i in account.local],
+            "created-apps": [{"id": a.id, "params": a.params_json()} for a in apps],
+            "created-assets": [{"index": a.id, "params": a.params_json()} for a in assets],
+            "total-apps-opted-in": len(account.local),
+            "total-assets-opted-in": len(account.assets),
+            "total-created-apps": len(apps),
+            "total-created-assets": len(assets),
+            **({"auth-addr": account.auth_addr} if account.auth_addr != ZERO_ADDRESS else {}),
+        }
+
+    def _local_state_json(self, address: str, app_id: int) -> dict:
+        app = self.ledger.apps.get(app_id)
+        schema = app.local_schema if app else (0, 0)
+        return {"id": app_id, "key-value": state_json(self.ledger.accounts[address].local[app_id]),
+                "schema": {"num-uint": schema[0], "num-byte-slice": schema[1]}}
+
+    def account_application_info(self, address: str, application_id: int, **kwargs) -> dict:
+        account = self.ledger.accounts.get(address)
+        if account is None or application_id not in account.local:
+            raise not_found("account application info not found")
+        return {"round": self.ledger.round, "app-local-state": self._local_state_json(address, application_id)}
+
+    def account_asset_info(self, address: str, asset_id: int, **kwargs) -> dict:
+        account = self.ledger.accounts.get(address)
+        if account is None or asset_id not in account.assets:
+            raise not_found("account asset info not found")
+        return {"round": self.ledger.round,
+                "asset-holding": {"asset-id": asset_id, "amount": account.assets[asset_id], "is-frozen": False}}
+
+    def dryrun(self, drr, **kwargs) -> dict:
+        stxns = drr.txns if hasattr(drr, "txns") else drr["txns"]
+        return {"error": "", "protocol-version": GENESIS_ID, "txns": self.ledger.dryrun(stxns)}
+
+
+def decode_signed_group(raw: bytes) -> list:
+    """Split concatenated msgpack signed transactions"""
+    import msgpack
+
+    unpacker = msgpack.Unpacker(raw=False, strict_map_key=False)
+    unpacker.feed(raw)
+    return [encoding.future_msgpack_decode(base64.b64encode(msgpack.packb(t, use_bin_type=True)).decode())
+            for t in unpacker]
@@ -0,0 +1,285 @@
+"""
+Asyncio client to place orders with many placeOrderToken groups in flight.
+
+- PooledAlgodClient keeps one HTTP connection open to algod on each thread, instead of opening
+  a connection for every request.
+- SuggestedParamsCache fetches the suggested params once per round, the cache is invalidated
+  when a confirmation shows a new round.
+- OrderPipeline signs the groups on a thread pool while other groups are sent and confirmed,
+  with a semaphore bounding the groups in flight.
+
+Usage:
+    python -m smartcontract.pipeline [-n 200] [-c 16] [-b 4]
+
+The load generator places n orders from b buyers with at most c groups in flight, on the
+in-process ledger, and reports the sustained orders per second.
+"""
+import argparse
+import asyncio
+import base64
+import functools
+import http.client
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Optional
+from urllib import parse
+
+from algosdk import abi, constants, error
+from algosdk.atomic_transaction_composer import AtomicTransactionComposer, TransactionSigner, TransactionWithSigner
+from algosdk.future import transaction
+from algosdk.logic import get_application_address
+from algosdk.v2client.algod import AlgodClient, api_version_path_prefix
+
+from .contract import Ecommerce
+
+RETURN_PREFIX = bytes.fromhex("151f7c75")
+"""Prefix of the log with the return value of an ABI method"""
+
+
+class PooledAlgodClient(AlgodClient):
+    """AlgodClient reusing a keep-alive HTTP connection per thread"""
+
+    def __init__(self, algod_token, algod_address, headers=None, timeout: float = 30):
+        super().__init__(algod_token, algod_address, headers)
+        url = parse.urlsplit(algod_address)
+        self._connection_class = http.client.HTTPSConnection if url.scheme == "https" else http.client.HTTPConnection
+        self._netloc = url.netloc
+        self._base_path = url.path.rstrip("/")
+        self._timeout = timeout
+        self._local = threading.local()
+        self.connections = 0
+        """Number of connections opened"""
+
+    def _connection(self) -> http.client.HTTPConnection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = self._connection_class(self._netloc, timeout=self._timeout)
+            self.connections += 1
+        return connection
+
+    def _close(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def algod_request(self, method, requrl, params=None, data=None, headers=None, response_format="json"):
+        header = {"User-Agent": "py-algorand-sdk"}
+        if self.headers:
+            header.update(self.headers)
+        if headers:
+            header.update(headers)
+        if requrl not in constants.no_auth:
+            header.update({constants.algod_auth_header: self.algod_token})
+        if requrl not in constants.unversioned_paths:
+            requrl = api_version_path_prefix + requrl
+        if params:
+            requrl = requrl + "?" + parse.urlencode(params)
+
+        # A kept connection may have been closed by algod, the request is sent again on a new one
+        for retry in (False, True):
+            try:
+                connection = self._connection()
+                connection.request(method, self._base_path + requrl, body=data, headers=header)
+                response = connection.getresponse()
+                body = response.read()
+                break
+            except (http.client.HTTPException, OSError):
+                self._close()
+                if retry:
+                    raise
+
+        if response.status >= 400:
+            message = body.decode("utf-8")
+            try:
+                message = json.loads(message)["message"]
+            except (ValueError, KeyError, TypeError):
+                pass
+            raise error.AlgodHTTPError(message, response.status)
+        if response_format == "json":
+            try:
+                return json.loads(body)
+            except ValueError as e:
+                raise error.AlgodResponseError("Failed to parse JSON response from algod") from e
+        return body
+
+
+class AsyncAlgod:
+    """Run the calls of a blocking algod client on an executor"""
+
+    def __init__(self, algod_client, executor: Executor = None):
+        self.algod_client = algod_client
+        self.executor = executor
+
+    async def call(self, name: str, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, functools.partial(getattr(self.algod_client, name), *args, **kwargs))
+
+
+class SuggestedParamsCache:
+    """Suggested params shared by all the transactions of a round"""
+
+    def __init__(self, algod: AsyncAlgod):
+        self.algod = algod
+        self.params: Optional[transaction.SuggestedParams] = None
+        self.fetches = 0
+        self._lock = asyncio.Lock()
+
+    def observe(self, round: int):
+        """
+        A transaction was confirmed on this round, the params fetched before it are dropped. The params
+        fetched on this round are kept, so the confirmations of a round refetch them only once.
+        """
+        if self.params is not None and round > self.params.first:
+            self.params = None
+
+    async def get(self) -> transaction.SuggestedParams:
+        async with self._lock:
+            if self.params is None:
+                self.params = await self.algod.call("suggested_params")
+                self.fetches += 1
+            return self.params
+
+
+class OrderPipeline:
+    """Place orders with placeOrderToken, many groups in flight"""
+
+    def __init__(self,
+                 algod_client,
+                 app_id: int,
+                 contract: abi.Contract,
+                 concurrency: int = 16,
+                 oracle_fees: int = Ecommerce._oracle_fees,
+                 io_executor: Executor = None,
+                 sign_executor: Executor = None,
+                 poll_interval: float = 0.5):
+        self.algod = AsyncAlgod(algod_client, io_executor)
+        self.params = SuggestedParamsCache(self.algod)
+        self.app_id = app_id
+        self.app_addr = get_application_address(app_id)
+        self.method = contract.get_method_by_name("placeOrderToken")
+        self.oracle_fees = oracle_fees
+        self.sign_executor = sign_executor or ThreadPoolExecutor()
+        self.poll_interval = poll_interval
+        self.semaphore = asyncio.Semaphore(concurrency)
+
+    def build(self,
+              sp: transaction.SuggestedParams,
+              sender: str,
+              signer: TransactionSigner,
+              token: int,
+              amount: int,
+              note: bytes) -> AtomicTransactionComposer:
+        """The group of placeOrderToken: the oracle fees, the payment of the products and the application call"""
+        atc = AtomicTransactionComposer()
+        atc.add_method_call(
+            self.app_id, self.method, sender, sp, signer,
+            method_args=[
+                TransactionWithSigner(transaction.PaymentTxn(sender, sp, self.app_addr, self.oracle_fees), signer),
+                TransactionWithSigner(transaction.AssetTransferTxn(sender, sp, self.app_addr, amount, token), signer),
+                token,
+            ],
+            note=note,  # Two orders with the same amount and params must not have the same txid
+        )
+        return atc
+
+    async def confirm(self, txid: str) -> dict:
+        while True:
+            try:
+                info = await self.algod.call("pending_transaction_info", txid)
+            except error.AlgodHTTPError as e:
+                if e.code != 404:
+                    raise
+                info = {}
+            if info.get("confirmed-round", 0) > 0:
+                return info
+            if info.get("pool-error"):
+                raise error.AlgodHTTPError(info["pool-error"], 400)
+            await asyncio.sleep(self.poll_interval)
+
+    async def place_order(self, sender: str, signer: TransactionSigner, token: int, amount: int,
+                          note: bytes = None) -> int:
+        """Send the group of one order and wait for its confirmation, return the value returned by the method"""
+        async with self.semaphore:
+            sp = await self.params.get()
+            atc = self.build(sp, sender, signer, token, amount, note or os.urandom(8))
+            loop = asyncio.get_running_loop()
+            stxns = await loop.run_in_executor(self.sign_executor, atc.gather_signatures)
+            await self.algod.call("send_transactions", stxns)
+            info = await self.confirm(stxns[-1].get_txid())
+            self.params.observe(info["confirmed-round"])
+
+        log = return_log(info)
+        return self.method.returns.type.decode(log[len(RETURN_PREFIX):])
+
+    async def place_orders(self, orders: list[tuple]) -> list[int]:
+        """Place the orders (sender, signer, token, amount) concurrently"""
+        return await asyncio.gather(*(self.place_order(*order) for order in orders))
+
+
+def return_log(info: dict) -> bytes:
+    """The log with the value returned by the ABI method"""
+    logs = [base64.b64decode(log) for log in info.get("logs", [])]
+    if not logs or not logs[-1].startswith(RETURN_PREFIX):
+        raise error.AlgodResponseError("the method didn't log a return value")
+    return logs[-1]
+
+
+def generate_load(orders: int, concurrency: int, buyers: int) -> dict:
+    """Place the orders on the in-process ledger, and measure the orders per second"""
+    from .benchmark import Lifecycle, OPT_IN_FUNDS
+
+    lifecycle = Lifecycle(Ecommerce())
+    algod = lifecycle.algod
+    sp = algod.suggested_params()
+    accounts = []
+    for _ in range(buyers):
+        account = algod.ledger.new_account(OPT_IN_FUNDS * 10)
+        algod.send_transaction(transaction.AssetOptInTxn(account.address, sp, lifecycle.usdc)
+                               .sign(account.private_key))
+        algod.send_transaction(transaction.AssetTransferTxn(
+            lifecycle.admin.address, sp, account.address, orders, lifecycle.usdc).sign(lifecycle.admin.private_key))
+        accounts.append(account)
+
+    async def run() -> tuple[float, OrderPipeline]:
+        # The in-process ledger is not thread safe, the node calls go through one thread
+        with ThreadPoolExecutor(1) as io, ThreadPoolExecutor() as signers:
+            pipeline = OrderPipeline(algod, lifecycle.admin_client.app_id, lifecycle.app.contract,
+                                     concurrency, io_executor=io, sign_executor=signers, poll_interval=0)
+            start = time.perf_counter()
+            results = await pipeline.place_orders([
+                (accounts[i % buyers].address, accounts[i % buyers].signer, lifecycle.usdc, 1) for i in range(orders)
+            ])
+            elapsed = time.perf_counter() - start
+        assert all(r == 1 for r in results)
+        return elapsed, pipeline
+
+    elapsed, pipeline = asyncio.run(run())
+    return {
+        "orders": orders,
+        "concurrency": concurrency,
+        "buyers": buyers,
+        "seconds": round(elapsed, 3),
+        "orders_per_sec": round(orders / elapsed, 1),
+        "suggested_params_fetches": pipeline.params.fetches,
+    }
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-n", "--orders", type=int, default=200, help="number of orders to place")
+    parser.add_argument("-c", "--concurrency", type=int, default=16, help="groups in flight")
+    parser.add_argument("-b", "--buyers", type=int, default=4, help="number of buyers placing the orders")
+    args = parser.parse_args(argv)
+
+    print(json.dumps(generate_load(args.orders, args.concurrency, args.buyers), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
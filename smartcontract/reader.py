@@ -0,0 +1,280 @@
+"""
+Read the state of the Ecommerce application without ABI calls.
+
+The local state of the accounts is fetched from algod and decoded in Python: the order records
+are unpacked from the raw bytes with their static offsets, and the token slot of each record is
+resolved with the token registry of the global state.
+
+The decoded states are kept on a LRU cache. The local state of an account only changes when a call to the
+application names it, as the sender or on the accounts array, so on a new round the reader checks the blocks
+confirmed since the last round it checked and drops only the accounts named by them. The other accounts are
+not fetched again. Passing the round, e.g. the last round read by an EventStream, saves the status call.
+
+Usage:
+    reader = StateReader(algod_client, app_id)
+    for state in reader.accounts([buyer, seller]):
+        print(state.deposits, state.live_orders())
+"""
+import base64
+import hashlib
+import struct
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import NamedTuple, Optional
+
+from algosdk import encoding
+from algosdk.error import AlgodHTTPError
+
+from .contract import Ecommerce
+
+ORDER_KEY_LEN = 8
+ORDER_LIST_MAX = Ecommerce._Ecommerce__ORDER_LIST_MAX
+ORDER_BITMAP_LEN = (ORDER_LIST_MAX + 7) // 8
+ARCHIVE_ROOT = ORDER_BITMAP_LEN + ORDER_KEY_LEN * ORDER_LIST_MAX
+"""Offset of the archive root on the order keys, followed by the number of orders archived"""
+
+RECORD = struct.Struct(">32s32sQBBBQ")
+"""Layout of Ecommerce.OrderRecord: seller, order hash, amount, token slot, status, slot and expiry round"""
+assert RECORD.size == Ecommerce.RECORD_LEN
+
+RECORD_V1_LEN = Ecommerce.RECORD_EXPIRES
+"""Records stored before the expiry round was added end at its offset, they are read with expires 0"""
+
+LEGACY_ORDER = struct.Struct(">32sHQQB")
+"""Head of the Ecommerce.Order tuple stored before migrateOrder, the order id is the tail"""
+
+
+class OrderRecord(NamedTuple):
+    seller: str
+    order_hash: bytes
+    amount: int
+    token: int              # Asset id, 0 is algos
+    status: int
+    index: int              # Slot on the order list
+    expires: int = 0        # Last round the order can stay pending, 0 if it was stored without expiry
+
+    @property
+    def live(self) -> bool:
+        return self.status not in (Ecommerce.ORDER_CANCELLED, Ecommerce.ORDER_COMPLETED)
+
+    def expired(self, round: int) -> bool:
+        """The order can be cancelled by sweepExpired on this round"""
+        return self.status == Ecommerce.ORDER_PENDING and 0 < self.expires < round
+
+
+@dataclass
+class AccountState:
+    """Local state of an account opted in the application, at a confirmed round"""
+    address: str
+    round: int
+    deposits: dict[int, int] = field(default_factory=dict)
+    """Deposit of the buyer in each token of the registry, keyed by asset id, 0 is algos"""
+    incomes: dict[int, int] = field(default_factory=dict)
+    """Income of the seller in each token of the registry"""
+    order_index: int = 0
+    slots: bytes = bytes(ORDER_BITMAP_LEN)
+    """Bitmap of the slots used by live orders"""
+    orders: list[OrderRecord] = field(default_factory=list)
+    """Order stored on each slot below order_index, the archived orders are not stored"""
+    archive_root: bytes = bytes(32)
+    """Root of the orders moved to the archive by archiveOrders, see archive.py"""
+    archived: int = 0
+    """Number of orders archived"""
+
+    def live_orders(self) -> list[OrderRecord]:
+        return [o for o in self.orders if self.slots[o.index // 8] >> (7 - o.index % 8) & 1]
+
+    def expired_orders(self, round: int) -> list[OrderRecord]:
+        """The live orders sweepExpired would cancel on this round"""
+        return [o for o in self.live_orders() if o.expired(round)]
+
+    def find(self, order_id: str) -> Optional[OrderRecord]:
+        """Find the order by its id, as takeOrder does"""
+        order_hash = hashlib.sha256(order_id.encode()).digest()
+        for o in self.orders:
+            if o.order_hash == order_hash:
+                return o
+        return None
+
+
+def decode_state(kv: list[dict]) -> dict[bytes, object]:
+    """Decode a key-value list returned by algod, bytes values stay bytes and uints stay ints"""
+    state = {}
+    for item in kv:
+        value = item["value"]
+        state[base64.b64decode(item["key"])] = (
+            value.get("uint", 0) if value["type"] == 2 else base64.b64decode(value.get("bytes", ""))
+        )
+    return state
+
+
+def decode_tokens(registry: bytes) -> list[int]:
+    """Asset id of each slot of the token registry"""
+    return decode_balances(registry)
+
+
+def decode_balances(balances: bytes) -> list[int]:
+    """The uint64 of each slot of a balance vector"""
+    return [int.from_bytes(balances[i:i + 8], "big") for i in range(0, len(balances), 8)]
+
+
+def is_legacy_order(value: bytes) -> bool:
+    """
+    The value is an old Order tuple: the order id offset is the end of the head and its length prefix
+    matches the value, as migrateOrder checks. The length alone is not enough, a tuple with a 30 or 22
+    chars order id is as long as a record.
+    """
+    return len(value) >= LEGACY_ORDER.size + 2 \
+        and struct.unpack_from(">H", value, 32)[0] == LEGACY_ORDER.size \
+        and struct.unpack_from(">H", value, LEGACY_ORDER.size)[0] == len(value) - LEGACY_ORDER.size - 2
+
+
+def decode_record(value: bytes, tokens: list[int], index: int = None) -> OrderRecord:
+    """
+    Decode an order stored on the local state, the slot of the token is replaced by the asset id.
+    Orders stored with the old Order tuple are decoded too, their index is the slot they were read from.
+    """
+    expires = 0
+    if is_legacy_order(value):
+        seller, offset, amount, token, status = LEGACY_ORDER.unpack_from(value)
+        order_hash = hashlib.sha256(value[offset + 2:]).digest()
+    elif len(value) in (RECORD.size, RECORD_V1_LEN):
+        record = value if len(value) == RECORD.size else value + bytes(RECORD.size - RECORD_V1_LEN)
+        seller, order_hash, amount, slot, status, index, expires = RECORD.unpack(record)
+        token = tokens[slot] if slot < len(tokens) else slot
+    else:
+        raise ValueError(f"not an order: {value.hex()}")
+    return OrderRecord(encoding.encode_address(seller), order_hash, amount, token, status, index, expires)
+
+
+def decode_account(address: str, round: int, kv: list[dict], tokens: list[int]) -> AccountState:
+    state = decode_state(kv)
+    account = AccountState(address, round)
+    # The keys are written on the first update, the balances are 0 until then
+    zero = bytes(8 * len(tokens))
+    account.deposits = dict(zip(tokens, decode_balances(state.get(b"d", zero))))
+    account.incomes = dict(zip(tokens, decode_balances(state.get(b"i", zero))))
+    account.order_index = state.get(b"oi", 0)
+    order_keys = state.get(b"ok", bytes(ARCHIVE_ROOT))
+    account.slots = order_keys[:ORDER_BITMAP_LEN]
+    if len(order_keys) > ARCHIVE_ROOT:  # Written before the archive existed otherwise
+        account.archive_root = order_keys[ARCHIVE_ROOT:ARCHIVE_ROOT + 32]
+        account.archived = int.from_bytes(order_keys[ARCHIVE_ROOT + 32:ARCHIVE_ROOT + 40], "big")
+    for i in range(account.order_index):
+        key = order_keys[ORDER_BITMAP_LEN + i * ORDER_KEY_LEN:ORDER_BITMAP_LEN + (i + 1) * ORDER_KEY_LEN]
+        if key in state:
+            account.orders.append(decode_record(state[key], tokens, i))
+    return account
+
+
+def block_accounts(block: dict, app_id: int) -> set[str]:
+    """Accounts whose local state the calls to the application in the block can change, inner calls included"""
+    accounts = set()
+
+    def walk(txn: dict):
+        if txn["txn"].get("type") == "appl" and txn["txn"].get("apid", txn.get("apid")) == app_id:
+            accounts.add(txn["txn"]["snd"])
+            accounts.update(txn["txn"].get("apat", []))
+        for inner in txn.get("dt", {}).get("itx", []):
+            walk(inner)
+
+    for txn in block.get("txns", []):
+        walk(txn)
+    return accounts
+
+
+class StateReader:
+    """Bulk reader of the local state of the application, with a LRU cache invalidated by the calls to it"""
+
+    def __init__(self, algod_client, app_id: int, cache_size: int = 1024, workers: int = 8, max_blocks: int = 1000):
+        """More than max_blocks since the last round checked are not read, the whole cache is dropped instead."""
+        self.algod_client = algod_client
+        self.app_id = app_id
+        self.cache_size = cache_size
+        self.workers = workers
+        self.max_blocks = max_blocks
+        self.cache: OrderedDict[str, AccountState] = OrderedDict()
+        self.fetches = 0
+        """Number of local states requested to algod"""
+        self.checked = -1
+        """Last round whose calls to the application were checked, the cached states are valid up to it"""
+        self._tokens: tuple[int, list[int]] = (-1, [])
+
+    def last_round(self) -> int:
+        return self.algod_client.status()["last-round"]
+
+    def tokens(self, round: int = None) -> list[int]:
+        """Asset id of each slot of the token registry, read again on each new round"""
+        round = self.last_round() if round is None else round
+        if self._tokens[0] != round:
+            info = self.algod_client.application_info(self.app_id)
+            state = decode_state(info["params"].get("global-state", []))
+            self._tokens = (round, decode_tokens(state.get(b"tk", bytes(8))))
+        return self._tokens[1]
+
+    def _fetch(self, address: str, tokens: list[int]) -> Optional[AccountState]:
+        try:
+            info = self.algod_client.account_application_info(address, self.app_id)
+        except AlgodHTTPError as e:
+            if e.code == 404:
+                return None     # The account is not opted in
+            raise
+        kv = info.get("app-local-state", {}).get("key-value", [])
+        return decode_account(address, info.get("round", 0), kv, tokens)
+
+    def sync(self, round: int):
+        """Drop the cached states of the accounts named by the calls to the application up to the round"""
+        if round <= self.checked:
+            return
+        if self.checked < 0 or round - self.checked > self.max_blocks:
+            self.cache.clear()
+        else:
+            for r in range(self.checked + 1, round + 1):
+                for address in block_accounts(self.algod_client.block_info(r)["block"], self.app_id):
+                    self.cache.pop(address, None)
+        self.checked = round
+
+    def accounts(self, addresses: list[str], round: int = None) -> list[Optional[AccountState]]:
+        """
+        Return the state of the accounts at the last round, None for the accounts not opted in.
+        Only the accounts not cached, or named by a call since they were read, are fetched, in parallel.
+        """
+        round = self.last_round() if round is None else round
+        self.sync(round)
+        states = {}
+        missing = []
+        for address in dict.fromkeys(addresses):
+            cached = self.cache.get(address)
+            if cached is not None:
+                self.cache.move_to_end(address)
+                states[address] = cached
+            else:
+                missing.append(address)
+
+        if missing:
+            tokens = self.tokens(round)
+            with ThreadPoolExecutor(min(self.workers, len(missing))) as pool:
+                fetched = list(pool.map(lambda a: self._fetch(a, tokens), missing))
+            self.fetches += len(missing)
+            for address, state in zip(missing, fetched):
+                states[address] = state
+                if state is not None:
+                    self._store(state)
+        return [states[a] for a in addresses]
+
+    def account(self, address: str, round: int = None) -> Optional[AccountState]:
+        return self.accounts([address], round)[0]
+
+    def invalidate(self, address: str = None):
+        """Drop the cached state of the account, or of all the accounts"""
+        if address is None:
+            self.cache.clear()
+        else:
+            self.cache.pop(address, None)
+
+    def _store(self, state: AccountState):
+        self.cache[state.address] = state
+        self.cache.move_to_end(state.address)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
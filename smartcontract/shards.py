@@ -0,0 +1,89 @@
+"""
+Route the buyers to the shards of a ShardFactory, and drive the shards in parallel.
+
+Each buyer is served by one shard, the one at the index sha256(address) mod N as ShardFactory.getShard
+computes it, so the oracle workers find the shard of an order without calling the factory. The work
+of the oracle is split by shard: the calls to one shard are made in order, and the shards are
+driven in parallel from a thread pool, each shard sequences only the calls of its own buyers.
+
+Usage:
+    router = ShardRouter(algod_client, factory_id)
+    clients = router.clients(worker.signer)
+
+    def post(shard_id, orders):
+        for order in orders:
+            clients[shard_id].call(Ecommerce.oPostOrderUsdc, ...)
+
+    router.run(post, orders, key=lambda order: order.buyer)
+"""
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, TypeVar
+
+from algosdk import encoding
+from algosdk.atomic_transaction_composer import TransactionSigner
+from beaker import client
+
+from .contract import Ecommerce
+from .reader import decode_state
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def shard_index(address: str, shards: int) -> int:
+    """Index of the shard of the buyer, the first 8 bytes of the sha256 of its public key modulo the shards"""
+    digest = hashlib.sha256(encoding.decode_address(address)).digest()
+    return int.from_bytes(digest[:8], "big") % shards
+
+
+class ShardRouter:
+    """Find the shard of each buyer, from the shards read on the global state of the factory"""
+
+    def __init__(self, algod_client, factory_id: int, workers: int = 8):
+        self.algod_client = algod_client
+        self.factory_id = factory_id
+        self.workers = workers
+        self.shards: list[int] = []
+        """Application id of each shard, 0 while it is not created"""
+        self.refresh()
+
+    def refresh(self) -> list[int]:
+        """Read the shards again, after createShard"""
+        info = self.algod_client.application_info(self.factory_id)
+        state = decode_state(info["params"].get("global-state", []))
+        self.shards = [state.get(i.to_bytes(8, "big"), 0) for i in range(state.get(b"n", 0))]
+        return self.shards
+
+    def shard(self, address: str) -> int:
+        """Application id of the shard of the buyer"""
+        index = shard_index(address, len(self.shards))
+        if not self.shards[index]:
+            raise LookupError(f"shard {index} of {address} is not created")
+        return self.shards[index]
+
+    def group(self, items: Iterable[T], key: Callable[[T], str] = lambda item: item) -> dict[int, list[T]]:
+        """Split the items by the shard of the buyer given by key, each list keeps the order of the items"""
+        groups: dict[int, list[T]] = {}
+        for item in items:
+            groups.setdefault(self.shard(key(item)), []).append(item)
+        return groups
+
+    def run(self, work: Callable[[int, list[T]], R], items: Iterable[T],
+            key: Callable[[T], str] = lambda item: item) -> dict[int, R]:
+        """
+        Call work with each shard and its items, the shards in parallel. Return the result for each shard,
+        the first exception raised by a call is raised once all the calls are done.
+        """
+        groups = self.group(items, key)
+        if not groups:
+            return {}
+        with ThreadPoolExecutor(min(self.workers, len(groups))) as pool:
+            futures = {shard: pool.submit(work, shard, batch) for shard, batch in groups.items()}
+        return {shard: future.result() for shard, future in futures.items()}
+
+    def clients(self, signer: TransactionSigner, app: Ecommerce = None) -> dict[int, client.ApplicationClient]:
+        """An application client for each shard created, signing with the key of the oracle worker"""
+        app = app or Ecommerce()
+        return {shard: client.ApplicationClient(self.algod_client, app, shard, signer=signer)
+                for shard in self.shards if shard}
@@ -0,0 +1,208 @@
+import json
+
+import pytest
+
+from .analyze import (
+    APP_CALL_BUDGET, Program, analyze, regressions, ecommerce_loop_bounds, ecommerce_program, ecommerce_report
+)
+from .contract import Ecommerce
+
+TEAL = """#pragma version 7
+txn NumAppArgs
+intc_0 // 0
+==
+bnz main_l4
+txna ApplicationArgs 0
+pushbytes 0x01020304 // "count(uint64)void"
+==
+bnz main_l3
+err
+main_l3:
+callsub count_0
+intc_1 // 1
+return
+main_l4:
+intc_1 // 1
+return
+count_0:
+intc_0 // 0
+store 0
+count_0_l1:
+load 0
+pushint 8 // 8
+<
+bz count_0_l3
+load 0
+sha256
+pop
+load 0
+intc_1 // 1
++
+store 0
+b count_0_l1
+count_0_l3:
+retsub
+"""
+
+NESTED = """#pragma version 7
+txna ApplicationArgs 0
+pushbytes 0x05060708 // "nested()void"
+==
+bnz main_l2
+err
+main_l2:
+callsub nested_0
+intc_1 // 1
+return
+nested_0:
+intc_0 // 0
+store 0
+nested_0_l1:
+load 0
+pushint 2 // 2
+<
+bz nested_0_l5
+intc_0 // 0
+store 1
+nested_0_l3:
+load 1
+pushint 3 // 3
+<
+bz nested_0_l4
+load 1
+intc_1 // 1
++
+store 1
+b nested_0_l3
+nested_0_l4:
+load 0
+intc_1 // 1
++
+store 0
+b nested_0_l1
+nested_0_l5:
+retsub
+"""
+
+
+class TestAnalyze:
+
+    def test_selectors(self):
+        program = Program(TEAL, loop_bound=8)
+        assert program.selectors == {"count(uint64)void": "main_l3"}
+
+    def test_loop_bound(self):
+        report = analyze(TEAL, loop_bound=8)
+        method = report["methods"]["count(uint64)void"]
+        assert method["dispatch_cost"] == 8, "The router checks the args and compares one selector"
+        # Handler (3), subroutine setup (2), 8 times the loop condition (4) and body with sha256 (42),
+        # the condition once more to exit, retsub
+        assert method["opcode_cost"] == 8 + 3 + 2 + 8 * (4 + 42) + 4 + 1
+        assert method["scratch_accesses"] == 1 + 8 * 4 + 1
+
+        smaller = analyze(TEAL, loop_bound=4)["methods"]["count(uint64)void"]
+        assert smaller["opcode_cost"] < method["opcode_cost"]
+
+    def test_nested_loops(self):
+        """The inner loop runs on each iteration of the outer loop, each one with its own bound"""
+        program = Program(NESTED, loop_bound=8, loop_bounds={"nested": (2, 3)})
+        inner = 3 * (4 + 5) + 4     # 3 times the condition and the step, the condition once more
+        outer = 2 * (4 + 2 + inner + 5) + 4
+        assert program.subroutine_cost("nested_0").opcodes == 2 + outer + 1
+        assert set(program.loops) == {("nested", 0), ("nested", 1)}
+
+        deeper = Program(NESTED, loop_bound=8, loop_bounds={"nested": (2,)})
+        assert deeper.subroutine_cost("nested_0").opcodes == 2 + 2 * (4 + 2 + 2 * (4 + 5) + 4 + 5) + 4 + 1, \
+            "The loops deeper than the bounds take the last one"
+        assert Program(NESTED, loop_bound=8).subroutine_cost("nested_0").opcodes > \
+            program.subroutine_cost("nested_0").opcodes
+
+    def test_extra_pages(self):
+        assert analyze(TEAL, loop_bound=8)["program"]["max_bytes"] == 2048
+        assert analyze(TEAL, loop_bound=8, extra_pages=3)["program"]["max_bytes"] == 4 * 2048
+
+    def test_regressions(self):
+        report = analyze(TEAL, loop_bound=8)
+        baseline = json.loads(json.dumps(report))
+        assert regressions(report, baseline) == []
+
+        baseline["methods"]["count(uint64)void"]["opcode_cost"] -= 1
+        assert len(regressions(report, baseline)) == 1
+
+    def test_ecommerce_report(self):
+        report = ecommerce_report()
+        methods = report["methods"]
+        assert len(methods) == len(Ecommerce().contract.methods)
+        for signature, method in methods.items():
+            assert method["opcode_cost"] > method["dispatch_cost"] > 0, signature
+            assert 0 < method["bytes"] <= report["program"]["bytes"], signature
+        assert report["program"]["bytes"] <= report["program"]["max_bytes"]
+
+    def test_ecommerce_loop_bounds(self):
+        """Every loop of the contract is bounded by a constant of the contract, not the default bound"""
+        program = ecommerce_program()
+        for handler in program.selectors.values():
+            program.worst_case(handler)
+        bounds = ecommerce_loop_bounds()
+        assert program.loops
+        for subroutine, depth in program.loops:
+            assert subroutine in bounds, subroutine
+            assert depth < len(bounds[subroutine]), subroutine
+
+    def test_hot_methods_budget(self):
+        """The hot methods of one order fit on the budget of one app call, the batches request more"""
+        batches = {"placeOrderCart", "oPostOrdersBatch", "settleOrders"}
+        methods = ecommerce_report()["methods"]
+        for signature, method in methods.items():
+            if signature.split("(")[0] in set(Ecommerce.HOT_METHODS) - batches:
+                assert method["opcode_cost"] <= APP_CALL_BUDGET, signature
+
+    def test_post_order_budget(self):
+        """The budget requested for each order of a batch must cover the worst case of postOrder"""
+        program = ecommerce_program()
+        post_order = next(label for label in program.order if label.startswith("postOrder_"))
+        assert program.subroutine_cost(post_order).opcodes <= Ecommerce._post_order_cost
+
+    def test_settle_order_budget(self):
+        """The budget requested for each order settled must cover the worst case of settleOrder"""
+        program = ecommerce_program()
+        settle_order = next(label for label in program.order if label.startswith("settleOrder_"))
+        assert program.subroutine_cost(settle_order).opcodes <= Ecommerce._settle_order_cost
+
+    def test_sweep_account_budget(self):
+        """The budget requested for each account swept must cover the scan of its order list, besides the settlements"""
+        program = ecommerce_program()
+        sweep = next(label for label in program.order if label.startswith("sweepExpired_"))
+        settle_order = next(label for label in program.order if label.startswith("settleOrder_"))
+        program.subroutine_cost(sweep)
+        account = program.loops[("sweepExpired", 0)].opcodes
+        scan = account - Ecommerce._Ecommerce__ORDER_LIST_MAX * program.subroutine_cost(settle_order).opcodes
+        assert scan <= Ecommerce._sweep_account_cost
+
+    def test_archive_order_budget(self):
+        """
+        The budget requested for each order archived must cover its leaf and one merge of the peaks: an append
+        merges one peak on average, the merges beyond one for each order are bounded by the height of the archive.
+        """
+        program = ecommerce_program()
+        archive = next(label for label in program.order if label.startswith("archiveOrders_"))
+        program.subroutine_cost(archive)
+        order, merge = program.loops[("archiveOrders", 0)].opcodes, program.loops[("archiveOrders", 1)].opcodes
+        leaf = order - ecommerce_loop_bounds()["archiveOrders"][1] * merge
+        assert leaf + merge <= Ecommerce._archive_order_cost
+
+    def test_ensure_budget_bound(self):
+        """The OpUp loop is bounded by the largest budget requested, a sweep of the max orders"""
+        sweep = 4 * Ecommerce._sweep_account_cost + Ecommerce._Ecommerce__SWEEP_MAX * Ecommerce._settle_order_cost
+        assert ecommerce_loop_bounds()["ensureBudget"] == (-(-sweep // APP_CALL_BUDGET),)
+
+    def test_hot_methods_dispatch(self):
+        """The router compares the selectors of the hot methods first, in the order given"""
+        methods = ecommerce_report()["methods"]
+        dispatch = {signature.split("(")[0]: method["dispatch_cost"] for signature, method in methods.items()}
+        hot = [dispatch[name] for name in Ecommerce.HOT_METHODS]
+        assert hot == sorted(hot)
+        assert max(hot) < min(cost for name, cost in dispatch.items() if name not in Ecommerce.HOT_METHODS)
+
+        with pytest.raises(ValueError, match="takeOrders"):
+            Ecommerce(artifacts_dir=None, dispatch_order=["takeOrders"])
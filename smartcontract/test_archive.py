@@ -0,0 +1,93 @@
+import hashlib
+
+import pytest
+from beaker import client
+
+from .archive import ArchiveStore, MerkleArchive, verify
+from .benchmark import Lifecycle
+from .contract import Ecommerce
+from .events import EventStream
+from .reader import StateReader
+
+
+def record(n: int) -> bytes:
+    return n.to_bytes(Ecommerce.RECORD_LEN, "big")
+
+
+class TestArchive:
+    app = Ecommerce()
+
+    def test_proofs(self):
+        archive = MerkleArchive()
+        for count in range(1, 19):
+            archive.append(record(count - 1))
+            root = archive.root()
+            for leaf in range(count):
+                proof = archive.proof(leaf)
+                assert verify(root, count, record(leaf), leaf, proof)
+                assert not verify(root, count, record(leaf + 1), leaf, proof)
+                assert not verify(root, count + 1, record(leaf), leaf, proof)
+        assert MerkleArchive(archive.records).peaks() == archive.peaks()
+        with pytest.raises(IndexError):
+            archive.proof(len(archive))
+
+    def test_archive_orders(self, tmp_path):
+        lifecycle = Lifecycle(self.app)
+        buyer = lifecycle.buyer.address
+        stream = EventStream(lifecycle.algod, lifecycle.admin_client.app_id)
+        reader = StateReader(lifecycle.algod, lifecycle.admin_client.app_id)
+        store = ArchiveStore()
+        lifecycle.opt_in()
+        for i in range(5):
+            lifecycle.place_order()
+            lifecycle.post_order(i)
+
+        sp = lifecycle.algod.suggested_params()
+        sp.flat_fee = True
+        sp.fee = 10000
+
+        def settle(*order_ids):
+            lifecycle.admin_client.call(
+                Ecommerce.settleOrders, orders=[(1, f"order-{i}", Ecommerce.ORDER_CANCELLED) for i in order_ids],
+                accounts=[buyer, lifecycle.seller.address], foreign_assets=[lifecycle.usdc], suggested_params=sp)
+
+        def archive():
+            store.ingest(stream.poll())
+            return lifecycle.seller_client.call(Ecommerce.archiveOrders, acct=buyer, peaks=store.peaks(buyer),
+                                                suggested_params=sp).return_value
+
+        settle(0, 2, 3)
+        assert archive() == 3
+        store.ingest(stream.poll())
+        state = reader.account(buyer)
+        assert (state.archived, state.archive_root) == (3, store.archive(buyer).root())
+        assert sorted(o.index for o in state.orders) == [1, 4], "The archived records must be deleted"
+        orders = lifecycle.admin_client.call(Ecommerce.getOrders, start=0, count=8, acct=buyer).return_value
+        assert [index for *_, index, _ in orders] == [1, 4], "The archived slots must be skipped"
+
+        leaf = store.find(buyer, "order-2")
+        archived, proof = store.proof(buyer, leaf)
+        assert archived[Ecommerce.RECORD_HASH:Ecommerce.RECORD_AMOUNT] == hashlib.sha256(b"order-2").digest()
+        assert lifecycle.admin_client.call(Ecommerce.verifyArchivedOrder, acct=buyer, record=archived,
+                                           leaf=leaf, proof=proof).return_value is True
+        assert lifecycle.admin_client.call(Ecommerce.verifyArchivedOrder, acct=buyer, record=archived,
+                                           leaf=leaf - 1, proof=proof).return_value is False
+
+        # A slot freed by the archive is used again, and archived again
+        lifecycle.place_order()
+        lifecycle.post_order(5)
+        settle(5, 1)
+        with pytest.raises(client.LogicException):   # The peaks must match the root
+            lifecycle.seller_client.call(Ecommerce.archiveOrders, acct=buyer, peaks=bytes(32), suggested_params=sp)
+        assert archive() == 2
+        store.ingest(stream.poll())
+        assert reader.account(buyer).archive_root == store.archive(buyer).root()
+        for leaf in range(5):
+            archived, proof = store.proof(buyer, leaf)
+            assert lifecycle.admin_client.call(Ecommerce.verifyArchivedOrder, acct=buyer, record=archived,
+                                               leaf=leaf, proof=proof).return_value is True
+
+        path = str(tmp_path / "archive.json")
+        store.save(path)
+        assert ArchiveStore.load(path).archive(buyer).root() == store.archive(buyer).root()
+        assert ArchiveStore.load(str(tmp_path / "missing.json")).archives == {}
@@ -0,0 +1,54 @@
+import json
+import os
+
+import pytest
+from beaker import client
+
+from .artifacts import MANIFEST, build, load, update_app
+from .contract import Ecommerce
+from .localnet import Ledger, LocalAlgod
+
+
+@pytest.fixture(scope="module")
+def directory(tmp_path_factory):
+    directory = str(tmp_path_factory.mktemp("artifacts"))
+    build(directory)
+    return directory
+
+
+class TestArtifacts:
+
+    def test_load(self, directory):
+        artifacts = load(directory)
+        assert artifacts is not None
+        app = Ecommerce(artifacts_dir=None)
+        assert artifacts.approval == app.approval_program
+        assert artifacts.clear == app.clear_program
+        assert artifacts.contract.dictify() == app.contract.dictify()
+
+    def test_stale(self, directory, tmp_path):
+        assert load(str(tmp_path)) is None, "A missing directory is stale"
+        for name in ("approval.teal", "clear.teal", "contract.json"):
+            with open(os.path.join(directory, name)) as src, open(tmp_path / name, "w") as dst:
+                dst.write(src.read())
+        with open(tmp_path / MANIFEST, "w") as f:
+            json.dump({"fingerprint": "0" * 64}, f)
+        assert load(str(tmp_path)) is None, "Artifacts of another source must be compiled again"
+
+    def test_written_on_compile(self, tmp_path):
+        """A stale or missing cache is written by the compile, the next instance loads it"""
+        app = Ecommerce(artifacts_dir=str(tmp_path))
+        artifacts = load(str(tmp_path))
+        assert artifacts is not None
+        assert artifacts.approval == app.approval_program
+        assert Ecommerce(artifacts_dir=str(tmp_path)).approval_program == app.approval_program
+
+    def test_update_app(self, directory):
+        algod = LocalAlgod(Ledger())
+        admin, other, _ = algod.ledger.get_accounts()
+        app_id, _, _ = client.ApplicationClient(algod, Ecommerce(artifacts_dir=directory),
+                                                signer=admin.signer).create()
+
+        with pytest.raises(client.LogicException):
+            update_app(algod, app_id, other.signer, directory)
+        update_app(algod, app_id, admin.signer, directory)
@@ -0,0 +1,48 @@
+import base64
+import json
+
+from .benchmark import BASELINE, STEPS, benchmark, dispatch_savings, opt_in_savings, regressions, state_bytes
+
+
+def kv(key: bytes, uint: int = None, value: bytes = None) -> dict:
+    if uint is not None:
+        return {"key": base64.b64encode(key).decode(), "value": {"type": 2, "uint": uint, "bytes": ""}}
+    return {"key": base64.b64encode(key).decode(), "value": {"type": 1, "uint": 0, "bytes": base64.b64encode(value).decode()}}
+
+
+class TestBenchmark:
+
+    def test_state_bytes(self):
+        before = [kv(b"a", uint=1), kv(b"bb", value=b"xyz"), kv(b"c", uint=5)]
+        after = [kv(b"a", uint=2), kv(b"bb", value=b"xyz"), kv(b"dd", value=b"0123")]
+        # a changed (1 + 8), c deleted (1), dd added (2 + 4), bb untouched
+        assert state_bytes(before, after) == 9 + 1 + 6
+
+    def test_no_regressions(self):
+        """The lifecycle must not cost more than on the stored baseline"""
+        with open(BASELINE) as f:
+            baseline = json.load(f)
+        report = benchmark(baseline["orders"])
+        assert regressions(report, baseline) == []
+        for steps in report["scenarios"].values():
+            assert tuple(sorted(steps)) == tuple(sorted(STEPS))
+
+    def test_order_list_scales(self):
+        """Posting and taking an order costs the same with a full or an empty order list"""
+        scenarios = benchmark()["scenarios"]
+        # The first order of an account also creates its local state keys
+        second, last = scenarios["2"], scenarios[str(len(scenarios))]
+        for step in ("oPostOrderUsdc", "takeOrder"):
+            assert last[step]["opcode_cost"] == second[step]["opcode_cost"], step
+
+    def test_opt_in_savings(self):
+        """The opt-in doesn't write the local state"""
+        report = opt_in_savings(4)
+        assert report["lazy"]["state_bytes"] == 0
+        assert report["saved"]["opcode_cost"] > 0
+        assert report["saved"]["fees"] == 0
+
+    def test_dispatch_savings(self):
+        """The router reaches the hot methods with fewer selector comparisons"""
+        report = dispatch_savings()
+        assert all(saved > 0 for saved in report["saved"].values()), report["saved"]
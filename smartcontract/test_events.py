@@ -0,0 +1,45 @@
+import hashlib
+
+from .benchmark import Lifecycle
+from .contract import Ecommerce
+from .events import EventStream
+
+
+class TestEvents:
+    app = Ecommerce()
+
+    def test_stream(self):
+        lifecycle = Lifecycle(self.app)
+        buyer = lifecycle.buyer.address
+        stream = EventStream(lifecycle.algod, lifecycle.admin_client.app_id)
+        lifecycle.opt_in()
+        lifecycle.place_order()
+        lifecycle.post_order(1)
+        assert [e.name for e in stream.poll()] == ["OrderPlaced", "OrderStored", "Deposit"]
+
+        lifecycle.take_order(1)
+        lifecycle.admin_client.call(Ecommerce.addDeposit, acct=buyer, token=0, amt=5)
+        events = stream.poll()
+        assert [e.name for e in events] == ["OrderStatus", "Deposit"]
+        assert events[0].args == {
+            "buyer": buyer,
+            "order_hash": hashlib.sha256(b"order-1").digest(),
+            "status": Ecommerce.ORDER_ACCEPTED,
+        }
+        assert events[1].args == {"account": buyer, "token": 0, "amount": 5, "balance": 5}
+        assert stream.poll() == [], "The blocks already read must not be read again"
+
+    def test_payload(self):
+        lifecycle = Lifecycle(self.app)
+        stream = EventStream(lifecycle.algod, lifecycle.admin_client.app_id)
+        lifecycle.opt_in()
+        lifecycle.place_order()
+        lifecycle.post_order(1)
+        lifecycle.post_order(2)
+
+        placed, stored, deposit, _, second = stream.poll()
+        assert placed.args == {"buyer": lifecycle.buyer.address, "token": lifecycle.usdc, "amount": 1}
+        assert stored.args["seller"] == lifecycle.seller.address
+        assert (stored.args["token"], stored.args["status"], stored.args["index"]) == (1, Ecommerce.ORDER_PENDING, 0)
+        assert second.args["balance"] == 2, "The event must carry the balance after the deposit"
+        assert stored.round < second.round
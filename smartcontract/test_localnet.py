@@ -0,0 +1,106 @@
+import base64
+
+import pytest
+from algosdk.error import AlgodHTTPError
+from algosdk.future import transaction
+from beaker.client.logic_error import parse_logic_error
+
+from .localnet import Ledger, LocalAlgod, MIN_TXN_FEE
+
+TEAL = """#pragma version 7
+txn ApplicationID
+bz create
+txna ApplicationArgs 0
+btoi
+store 0
+loop:
+load 0
+bz done
+load 0
+pushint 1
+-
+store 0
+b loop
+done:
+pushint 1
+assert
+create:
+pushint 1
+return
+"""
+
+
+class TestLocalnet:
+    @pytest.fixture
+    def network(self):
+        ledger = Ledger()
+        return ledger, LocalAlgod(ledger), ledger.get_accounts()
+
+    def create_app(self, algod, account) -> int:
+        sp = algod.suggested_params()
+        program = base64.b64decode(algod.compile(TEAL)["result"])
+        txn = transaction.ApplicationCreateTxn(
+            account.address, sp, transaction.OnComplete.NoOpOC, program, program,
+            transaction.StateSchema(0, 0), transaction.StateSchema(0, 0),
+        )
+        algod.send_transaction(txn.sign(account.private_key))
+        return algod.pending_transaction_info(txn.get_txid())["application-index"]
+
+    def test_group_is_atomic(self, network):
+        ledger, algod, (a, b, c) = network
+        sp = algod.suggested_params()
+        pay = transaction.PaymentTxn(a.address, sp, b.address, 1000)
+        overspend = transaction.PaymentTxn(c.address, sp, b.address, 10**15)
+        transaction.assign_group_id([pay, overspend])
+        balance = ledger.accounts[a.address].balance
+
+        with pytest.raises(AlgodHTTPError, match="overspend"):
+            algod.send_transactions([pay.sign(a.private_key), overspend.sign(c.private_key)])
+        assert ledger.accounts[a.address].balance == balance, "A failed group must not change the ledger"
+
+    def test_signature(self, network):
+        _, algod, (a, b, _) = network
+        txn = transaction.PaymentTxn(a.address, algod.suggested_params(), b.address, 1000)
+        with pytest.raises(AlgodHTTPError, match="should have been authorized by"):
+            algod.send_transaction(txn.sign(b.private_key))
+
+    def test_budget_is_pooled(self, network):
+        _, algod, (a, _, _) = network
+        app_id = self.create_app(algod, a)
+        sp = algod.suggested_params()
+
+        # 100 iterations cost more than one call budget, but less than the budget of two calls
+        call = transaction.ApplicationCallTxn(a.address, sp, app_id, transaction.OnComplete.NoOpOC, app_args=[100])
+        with pytest.raises(AlgodHTTPError, match="dynamic cost budget exceeded"):
+            algod.send_transaction(call.sign(a.private_key))
+
+        calls = [
+            transaction.ApplicationCallTxn(a.address, sp, app_id, transaction.OnComplete.NoOpOC, app_args=[100]),
+            transaction.ApplicationCallTxn(a.address, sp, app_id, transaction.OnComplete.NoOpOC, app_args=[0]),
+        ]
+        transaction.assign_group_id(calls)
+        algod.send_transactions([t.sign(a.private_key) for t in calls])
+        assert algod.pending_transaction_info(calls[0].get_txid())["txn"]["txn"]["fee"] == MIN_TXN_FEE
+
+    def test_logic_error_format(self, network):
+        _, algod, (a, _, _) = network
+        app_id = self.create_app(algod, a)
+        call = transaction.ApplicationCallTxn(a.address, algod.suggested_params(), app_id,
+                                              transaction.OnComplete.NoOpOC, app_args=[1000])
+        with pytest.raises(AlgodHTTPError) as e:
+            algod.send_transaction(call.sign(a.private_key))
+
+        txid, msg, pc = parse_logic_error(str(e.value))
+        assert txid == call.get_txid()
+        assert msg == "dynamic cost budget exceeded"
+        assert TEAL.splitlines()[pc].split()[0] in ("load", "bz", "pushint", "-", "store", "b"), \
+            "The pc must be a line of the loop"
+
+    def test_block_info(self, network):
+        _, algod, (a, b, _) = network
+        txn = transaction.PaymentTxn(a.address, algod.suggested_params(), b.address, 1000)
+        algod.send_transaction(txn.sign(a.private_key))
+        block = algod.block_info(algod.status()["last-round"])["block"]
+        assert [t["txn"]["rcv"] for t in block["txns"]] == [b.address]
+        with pytest.raises(AlgodHTTPError, match="ledger does not have entry"):
+            algod.block_info(block["rnd"] + 1)
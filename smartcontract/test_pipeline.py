@@ -0,0 +1,74 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from algosdk.error import AlgodHTTPError
+
+from .localnet import Ledger, LocalAlgod
+from .pipeline import AsyncAlgod, PooledAlgodClient, SuggestedParamsCache, generate_load
+
+
+class StatusHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections = set()
+
+    def do_GET(self):
+        self.connections.add(self.client_address)
+        if self.path == "/v2/status":
+            status, body = 200, {"last-round": 7}
+        else:
+            status, body = 404, {"message": "not found"}
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestPipeline:
+    @pytest.fixture
+    def server(self):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), StatusHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        yield server
+        server.shutdown()
+        server.server_close()
+
+    def test_pooled_connection(self, server):
+        StatusHandler.connections.clear()
+        algod = PooledAlgodClient("", f"http://127.0.0.1:{server.server_address[1]}")
+        for _ in range(3):
+            assert algod.status()["last-round"] == 7
+        with pytest.raises(AlgodHTTPError, match="not found") as e:
+            algod.account_info("unknown")
+        assert e.value.code == 404
+        assert algod.connections == 1 and len(StatusHandler.connections) == 1, "All the requests must use one connection"
+
+    def test_load(self):
+        report = generate_load(orders=24, concurrency=8, buyers=3)
+        assert report["orders_per_sec"] > 0
+        assert report["suggested_params_fetches"] < report["orders"], "Groups sent on the same round must share the params"
+
+    def test_params_cache(self):
+        ledger = Ledger()
+        cache = SuggestedParamsCache(AsyncAlgod(LocalAlgod(ledger)))
+
+        async def confirm(rounds: int, confirmations: int):
+            ledger.advance(rounds)
+            for _ in range(confirmations):
+                cache.observe(ledger.round)
+                await cache.get()
+
+        asyncio.run(cache.get())
+        asyncio.run(confirm(1, 4))
+        assert cache.fetches == 2, "The confirmations of a round must refetch the params once"
+        asyncio.run(confirm(0, 3))
+        assert cache.fetches == 2
+        asyncio.run(confirm(1, 1))
+        assert cache.fetches == 3
@@ -0,0 +1,83 @@
+import hashlib
+
+import pytest
+
+from .benchmark import Lifecycle
+from .contract import Ecommerce
+from .reader import StateReader, decode_record
+
+
+class TestReader:
+    app = Ecommerce()
+
+    @pytest.fixture
+    def lifecycle(self) -> Lifecycle:
+        lifecycle = Lifecycle(self.app)
+        lifecycle.opt_in()
+        for i in range(3):
+            lifecycle.admin_client.call(Ecommerce.oPostOrderUsdc, acct=lifecycle.buyer.address, amt=10,
+                                        o=lifecycle.order(i), accounts=[lifecycle.seller.address])
+        return lifecycle
+
+    def test_decode(self, lifecycle):
+        buyer = lifecycle.buyer.address
+        state = StateReader(lifecycle.algod, lifecycle.admin_client.app_id).account(buyer)
+
+        (deposits, incomes, order_index), orders = lifecycle.admin_client.call(
+            Ecommerce.getAccountSnapshot, acct=buyer).return_value
+        assert state.order_index == order_index
+        assert state.deposits == {0: deposits[0], lifecycle.usdc: deposits[1]} == {0: 0, lifecycle.usdc: 30}
+        assert state.incomes == {0: 0, lifecycle.usdc: 0}
+        assert [(seller, bytes(order_hash), amount, status, index, expires)
+                for seller, order_hash, amount, _, status, index, expires in orders] == \
+            [(o.seller, o.order_hash, o.amount, o.status, o.index, o.expires) for o in state.orders]
+        assert {o.token for o in state.orders} == {lifecycle.usdc}, "The token slot must be resolved to the asset id"
+        assert state.find("order-1").index == 1
+        assert len(state.live_orders()) == 3
+
+    def test_legacy_order(self):
+        seller = bytes(range(32))
+        head = seller + (51).to_bytes(2, "big") + (7).to_bytes(8, "big") + (5).to_bytes(8, "big") + bytes([1])
+        record = decode_record(head + (3).to_bytes(2, "big") + b"xx1", [0], 4)
+        assert record.order_hash == hashlib.sha256(b"xx1").digest()
+        assert (record.amount, record.token, record.status, record.index) == (7, 5, 1, 4)
+
+        # Tuples as long as a record, with a 30 or 22 chars order id
+        for order_id in (b"a" * 30, b"b" * 22):
+            value = head + len(order_id).to_bytes(2, "big") + order_id
+            assert len(value) in (Ecommerce.RECORD_LEN, Ecommerce.RECORD_EXPIRES)
+            record = decode_record(value, [0], 4)
+            assert record.order_hash == hashlib.sha256(order_id).digest()
+            assert (record.amount, record.token, record.status, record.index) == (7, 5, 1, 4)
+        with pytest.raises(ValueError):
+            decode_record(head, [0])
+
+        # A record stored before the expiry round was added
+        record = decode_record(seller + bytes(32) + (7).to_bytes(8, "big") + bytes([1, 0, 2]), [0, 5])
+        assert (record.token, record.index, record.expires) == (5, 2, 0)
+        assert not record.expired(10**9), "A record without expiry round never expires"
+
+    def test_cache(self, lifecycle):
+        buyer = lifecycle.buyer.address
+        reader = StateReader(lifecycle.algod, lifecycle.admin_client.app_id)
+        unknown = lifecycle.algod.ledger.new_account(10**6).address
+        assert reader.accounts([buyer, unknown])[1] is None, "The account is not opted in"
+        fetches = reader.fetches
+
+        reader.account(buyer)
+        assert reader.fetches == fetches, "An account read on the same round must not be fetched again"
+
+        lifecycle.algod.ledger.advance(3)
+        lifecycle.admin_client.call(Ecommerce.setOrderTtl, rounds=100)
+        reader.account(buyer)
+        assert reader.fetches == fetches, "An account not named by the calls since it was read must not be fetched"
+
+        lifecycle.take_order(1)
+        state = reader.account(buyer)
+        assert reader.fetches == fetches + 1
+        assert state.find("order-1").status == Ecommerce.ORDER_ACCEPTED
+
+    def test_lru(self, lifecycle):
+        reader = StateReader(lifecycle.algod, lifecycle.admin_client.app_id, cache_size=1)
+        reader.accounts([lifecycle.buyer.address, lifecycle.seller.address])
+        assert list(reader.cache) == [lifecycle.seller.address], "The least recently read account must be evicted"
@@ -0,0 +1,122 @@
+import pytest
+from algosdk.atomic_transaction_composer import AtomicTransactionComposer, TransactionWithSigner
+from algosdk.future import transaction
+from beaker import client
+
+from .contract import Ecommerce
+from .factory import ShardFactory
+from .localnet import Ledger, LocalAlgod
+from .reader import StateReader, decode_balances, decode_state
+from .shards import ShardRouter, shard_index
+
+SHARDS = 3
+AMOUNT = 1000
+
+
+class TestShards:
+    app = Ecommerce()
+    factory = ShardFactory()
+
+    def test_shard_index(self):
+        algod = LocalAlgod(Ledger())
+        addresses = [a.address for a in algod.ledger.get_accounts(32)]
+        assert all(shard_index(a, SHARDS) == shard_index(a, SHARDS) < SHARDS for a in addresses)
+        assert len({shard_index(a, SHARDS) for a in addresses}) == SHARDS
+
+    def test_shards(self):
+        algod = LocalAlgod(Ledger())
+        admin, seller, worker, *buyers = algod.ledger.get_accounts(9)
+        factory = client.ApplicationClient(algod, self.factory, signer=admin.signer)
+        factory.create(shards=SHARDS)
+        sp = algod.suggested_params()
+        algod.send_transaction(transaction.PaymentTxn(admin.address, sp, factory.app_addr, int(1e8))
+                               .sign(admin.private_key))
+
+        def fee(inner: int):
+            sp = algod.suggested_params()
+            sp.flat_fee = True
+            sp.fee = 1000 * (1 + inner)
+            return sp
+
+        shards = [factory.call(ShardFactory.createShard, suggested_params=fee(2)).return_value for _ in range(SHARDS)]
+        with pytest.raises(client.LogicException):
+            factory.call(ShardFactory.createShard, suggested_params=fee(2))
+        router = ShardRouter(algod, factory.app_id)
+        assert router.shards == shards
+        for shard in shards:
+            info = algod.application_info(shard)["params"]
+            assert info["creator"] == factory.app_addr, "The factory must be the creator of the shards"
+
+        usdc = self._create_usdc(algod, admin, [seller, *buyers])
+        factory.call(ShardFactory.addToken, a=usdc, foreign_apps=shards, suggested_params=fee(3 * SHARDS))
+        factory.call(ShardFactory.addOracle, a=worker.address, foreign_apps=shards, suggested_params=fee(SHARDS))
+        readers = {shard: StateReader(algod, shard) for shard in shards}
+        assert all(r.tokens() == [0, usdc] for r in readers.values()), "The registries must have the same slots"
+
+        for buyer in buyers:
+            assert factory.call(ShardFactory.getShard, acct=buyer.address).return_value == router.shard(buyer.address)
+        groups = router.group(buyers, key=lambda b: b.address)
+        assert len(groups) > 1
+
+        # The sellers opt in to all the shards, each buyer to its own
+        for shard in shards:
+            client.ApplicationClient(algod, self.app, shard, signer=seller.signer).opt_in()
+        for buyer in buyers:
+            shard = router.shard(buyer.address)
+            buyer_client = client.ApplicationClient(algod, self.app, shard, signer=buyer.signer)
+            buyer_client.opt_in()
+            sp = algod.suggested_params()
+            buyer_client.call(
+                Ecommerce.placeOrderToken,
+                oracle_pay=TransactionWithSigner(transaction.PaymentTxn(
+                    buyer.address, sp, buyer_client.app_addr, Ecommerce._oracle_fees), buyer.signer),
+                product_pay=TransactionWithSigner(transaction.AssetTransferTxn(
+                    buyer.address, sp, buyer_client.app_addr, AMOUNT, usdc), buyer.signer),
+                token_=usdc,
+            )
+
+        # The worker drives the shards in parallel, the calls to each shard are made in order
+        workers = router.clients(worker.signer, self.app)
+        sellers = router.clients(seller.signer, self.app)
+
+        def run_orders(shard: int, batch: list) -> int:
+            for buyer in batch:
+                order = [seller.address, f"order-{buyer.address[:8]}", AMOUNT, usdc, Ecommerce.ORDER_PENDING]
+                workers[shard].call(Ecommerce.oPostOrderUsdc, acct=buyer.address, amt=AMOUNT, o=order,
+                                    accounts=[seller.address])
+                sellers[shard].call(Ecommerce.takeOrder, acct=buyer.address, order_id=order[1])
+                atc = workers[shard].add_method_call(
+                    AtomicTransactionComposer(), Ecommerce.settleOrders,
+                    orders=[(1, order[1], Ecommerce.ORDER_COMPLETED)], accounts=[buyer.address, seller.address],
+                    foreign_assets=[usdc], suggested_params=fee(4))
+                atc.execute(algod, 4)
+            return len(batch)
+
+        done = router.run(run_orders, buyers, key=lambda b: b.address)
+        assert done == {shard: len(batch) for shard, batch in groups.items()}
+        for buyer in buyers:
+            state = readers[router.shard(buyer.address)].account(buyer.address)
+            assert [o.status for o in state.orders] == [Ecommerce.ORDER_COMPLETED]
+
+        comission = AMOUNT * Ecommerce._comission_fees // Ecommerce._Ecommerce__FEE_BASE
+        earnings = factory.call(ShardFactory.syncEarnings, foreign_apps=shards).return_value
+        assert earnings[:2] == [0, comission * len(buyers)]
+        for shard, batch in groups.items():
+            state = decode_state(algod.application_info(shard)["params"]["global-state"])
+            assert decode_balances(state[b"e"])[1] == comission * len(batch)
+        assert factory.call(ShardFactory.syncEarnings, foreign_apps=shards).return_value == earnings, \
+            "The sync must replace the earnings"
+        with pytest.raises(client.LogicException):     # The shards must be on the foreign apps
+            factory.call(ShardFactory.syncEarnings, foreign_apps=shards[:1])
+
+    @staticmethod
+    def _create_usdc(algod: LocalAlgod, admin, holders: list) -> int:
+        sp = algod.suggested_params()
+        txn = transaction.AssetCreateTxn(admin.address, sp, 10**12, 6, False, unit_name="tusdc", asset_name="USDC")
+        algod.send_transaction(txn.sign(admin.private_key))
+        usdc = algod.pending_transaction_info(txn.get_txid())["asset-index"]
+        for account in holders:
+            algod.send_transaction(transaction.AssetOptInTxn(account.address, sp, usdc).sign(account.private_key))
+            algod.send_transaction(transaction.AssetTransferTxn(
+                admin.address, sp, account.address, 10**6, usdc).sign(admin.private_key))
+        return usdc
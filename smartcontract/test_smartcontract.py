@@ -1,6 +1,9 @@
 from ast import Constant
+import hashlib
+import os
 import pytest
 from algosdk.atomic_transaction_composer import *
+from algosdk import account
 from algosdk.future import transaction
 from algosdk.v2client.algod import AlgodClient
 from algosdk.encoding import decode_address
@@ -8,21 +11,30 @@ from beaker import client, sandbox
 from beaker.client.application_client import ApplicationClient
 
 from .contract import Ecommerce
+from .localnet import Ledger, LocalAlgod
+from .reader import decode_balances, decode_state
 
-class TestEcommerce:
-    accounts = sandbox.get_accounts()
-    print(type(accounts[0]))
-    algod_client:AlgodClient = sandbox.get_algod_client()
-    addr = accounts[0].address
-    sk = accounts[0].private_key
+USE_SANDBOX = os.environ.get("ALGOMARKET_SANDBOX") == "1"
+"""Run the tests against the sandbox node instead of the in-process ledger"""
 
+class TestEcommerce:
     app = Ecommerce()
-    app_client = client.ApplicationClient(algod_client,app,signer=AccountTransactionSigner(sk))
-    app_addr = ""
     _USDC_SUPPLY = 446744073709
     _USDC_DECIMALS = 6
 
-    tokens = []
+    @pytest.fixture(autouse=True)
+    def network(self):
+        """Each test starts with its own ledger, so the tests don't depend on each other and can run in parallel."""
+        if USE_SANDBOX:
+            self.accounts = sandbox.get_accounts()
+            self.algod_client = sandbox.get_algod_client()
+        else:
+            ledger = Ledger()
+            self.accounts = ledger.get_accounts()
+            self.algod_client = LocalAlgod(ledger)
+        self.app_client = client.ApplicationClient(self.algod_client,self.app,signer=self.accounts[0].signer)
+        self.tokens = []
+
     @pytest.fixture
     def admin_acc(self) -> tuple[str,str,AccountTransactionSigner]:
         addr, sk = self.accounts[0].address, self.accounts[0].private_key
@@ -80,6 +92,34 @@ class TestEcommerce:
 
         return r['asset-index']
 
+    @pytest.fixture
+    def app_created(self) -> int:
+        app_id,_,_ = self.app_client.create()
+        return app_id
+
+    @pytest.fixture
+    def app_funded(self,app_created,create_usdc):
+        """The application received some algos, and the usdc token was created"""
+        self.tokens.append(create_usdc)
+        sp = self.algod_client.suggested_params()
+        ptxn = TransactionWithSigner(
+            txn = transaction.PaymentTxn(
+                self.app_client.get_sender(), sp, self.app_client.app_addr,int(1e7)
+            ),
+            signer = self.app_client.get_signer(),
+        )
+        self.app_client.call(self.app.setup,t = ptxn)
+
+    @pytest.fixture
+    def token_added(self,app_funded):
+        self.app_client.call(self.app.addToken,a = self.tokens[0])
+
+    @pytest.fixture
+    def opted_in(self,token_added,seller_acc,buyer_acc):
+        """Seller and buyer registered into the smartcontract"""
+        for _,_,signer in (seller_acc,buyer_acc):
+            client.ApplicationClient(self.algod_client,self.app,self.app_client.app_id,signer=signer).opt_in()
+
     def test_app_create(self):
         self.app,self.app_addr,_ = self.app_client.create()
         app_state = self.app_client.get_application_state()
@@ -88,7 +128,7 @@ class TestEcommerce:
         assert app_state[Ecommerce.admin.str_key()] == decode_address(sender).hex(), "The admin should be the first address"
         assert self.app_client.app_id > 0, "No app id created"
 
-    def test_setup(self,create_usdc: int):
+    def test_setup(self,app_created,create_usdc: int):
         usdc = create_usdc
         self.tokens.append(usdc)
         sp = self.algod_client.suggested_params()
@@ -103,7 +143,7 @@ class TestEcommerce:
         # assert app_state["t"] == usdc, "Token for trading must be usdc"
 
         assert r.return_value == "setup_successfull", "Application must str message"
-    def test_opt_token(self):
+    def test_opt_token(self,app_funded):
         sp = self.algod_client.suggested_params()
         ptxn = TransactionWithSigner(
             txn = transaction.PaymentTxn(
@@ -115,7 +155,7 @@ class TestEcommerce:
         print("### contract opt-in asset")
         print(r.return_value)
 
-    def test_seller_opt_in(self,seller_acc:tuple[str,str,AccountTransactionSigner]):
+    def test_seller_opt_in(self,app_created,seller_acc:tuple[str,str,AccountTransactionSigner]):
         addr,sk,signer =  seller_acc
         app_client = client.ApplicationClient(self.algod_client,self.app,self.app_client.app_id,signer=signer)
         r = app_client.opt_in()
@@ -126,13 +166,14 @@ class TestEcommerce:
         # assert client_state[Ecommerce.is_seller.str_key()] == 0, "The the account can't be a seller by default"
 
 
-    def test_buyer_opt_in(self,buyer_acc:tuple[str,str,AccountTransactionSigner]):
+    def test_buyer_opt_in(self,app_created,buyer_acc:tuple[str,str,AccountTransactionSigner]):
         addr,sk,signer =  buyer_acc
         app_client = client.ApplicationClient(self.algod_client,self.app,self.app_client.app_id,signer=signer)
         r = app_client.opt_in()
         client_state = app_client.get_account_state()
 
-    def test_become_seller(self,seller_acc: tuple[str,str,AccountTransactionSigner]):
+    @pytest.mark.skip(reason="setSeller is not part of the contract anymore")
+    def test_become_seller(self,app_created,seller_acc: tuple[str,str,AccountTransactionSigner]):
         addr,sk,signer =  seller_acc
         app_client = client.ApplicationClient(self.algod_client,self.app,self.app_client.app_id,signer=signer)
         sp = self.algod_client.suggested_params()
@@ -164,7 +205,7 @@ class TestEcommerce:
     #     print(r.return_value)
 
     def test_make_order(self,
-
+                        opted_in,
                         seller_acc:tuple[str,str,AccountTransactionSigner],
                         buyer_acc:tuple[str,str,AccountTransactionSigner]):
         baddr,bsk,bs = buyer_acc
@@ -176,7 +217,7 @@ class TestEcommerce:
 
         # asset_id = app_state[Ecommerce.token.str_key()]
         r = app_client.call(
-            Ecommerce.placeOrder,
+            Ecommerce.placeOrderToken,
             oracle_pay = TransactionWithSigner(
                 txn=transaction.PaymentTxn(baddr,sp,self.app_client.app_addr,1000,note="paying for the oracle"),
                 signer=bs
@@ -192,54 +233,41 @@ class TestEcommerce:
 
 
     def test_oracle_order_success(self,
+                                  opted_in,
                                   seller_acc:tuple[str,str,AccountTransactionSigner],
                                   buyer_acc:tuple[str,str,AccountTransactionSigner]):
         saddr,_,_ = seller_acc
         baddr,bsk,bs = buyer_acc
-        order = {"seller": baddr, "order_id": "xx1","amount":1,"token":2002, "status":0 }
-        sp = self.algod_client.suggested_params()
+        order = [baddr, "xx1", 1, self.tokens[0], Ecommerce.ORDER_PENDING]
 
-        r = self.app_client.call(
-            Ecommerce.oPlaceOrderSuccess,
-            acc=baddr,
-            order=order,
-            i=1,
-            d={"token_id": self.tokens[0],"amount":10000},
-        )
-        print(r.return_value)
-        # assert r.return_value == order["order_id"], "Application must return 1"
+        self.app_client.call(Ecommerce.oPostOrderUsdc, acct=baddr, amt=10000, o=order, accounts=[saddr])
+        r = self.app_client.call(Ecommerce.getOrderIndex, i=0, acct=baddr)
+        assert r.return_value[0] == baddr, "The order must be stored on the first slot"
 
     def test_get_deposit_after(self,
-                         buyer_acc:tuple[str,str,AccountTransactionSigner]):
+                               opted_in,
+                               seller_acc:tuple[str,str,AccountTransactionSigner],
+                               buyer_acc:tuple[str,str,AccountTransactionSigner]):
+        saddr,_,_ = seller_acc
         baddr,bsk,bs = buyer_acc
         app_client = client.ApplicationClient(self.algod_client,self.app,self.app_client.app_id,signer=bs)
-        sp = self.algod_client.suggested_params()
+        order = [saddr, "xx1", 1, self.tokens[0], Ecommerce.ORDER_PENDING]
+        self.app_client.call(Ecommerce.oPostOrderUsdc, acct=baddr, amt=10000, o=order, accounts=[saddr])
 
-
-        # asset_id = app_state[Ecommerce.token.str_key()]
-        r = app_client.call(
-            Ecommerce.getDeposit,
-            addr = baddr,
-            i = 1)
-        print(r.return_value)
+        r = app_client.call(Ecommerce.getDeposit, acct = baddr, token = self.tokens[0])
+        assert r.return_value == 10000, "The deposit must increase with the amount of the order"
 
     def test_oracle_order_success_2(self,
+                                    opted_in,
                                     seller_acc:tuple[str,str,AccountTransactionSigner],
                                     buyer_acc:tuple[str,str,AccountTransactionSigner]):
         saddr,_,_ = seller_acc
         baddr,bsk,bs = buyer_acc
-        order = {"seller": saddr, "order_id": "xx2","amount":1,"token":2002,"status": 0}
-        sp = self.algod_client.suggested_params()
+        order = [saddr, "xx2", 1, self.tokens[0], Ecommerce.ORDER_PENDING]
 
-
-        r = self.app_client.call(
-            Ecommerce.oPlaceOrderSuccess,
-            acc=baddr,
-            order=order,
-            i=0,
-            d={"token_id": self.tokens[0],"amount":12340},
-        )
-        print(r.return_value)
+        self.app_client.call(Ecommerce.oPostOrderUsdc, acct=baddr, amt=12340, o=order, accounts=[saddr])
+        r = self.app_client.call(Ecommerce.getOrderIndex, i=0, acct=baddr)
+        assert r.return_value[0] == saddr, "The order must keep the seller address"
 
 
     # def test_accept_order(self,
@@ -257,3 +285,458 @@ class TestEcommerce:
     #         order_id="xx2",
     #     )
     #     print(r.return_value)
+
+    def test_take_order(self,
+                        opted_in,
+                        seller_acc:tuple[str,str,AccountTransactionSigner],
+                        buyer_acc:tuple[str,str,AccountTransactionSigner]):
+        saddr,_,ss = seller_acc
+        baddr,_,_ = buyer_acc
+        order = [saddr, "xx3", 1, self.tokens[0], Ecommerce.ORDER_PENDING]
+        self.app_client.call(Ecommerce.oPostOrderUsdc, acct=baddr, amt=1, o=order, accounts=[saddr])
+
+        app_client = client.ApplicationClient(self.algod_client,self.app,self.app_client.app_id,signer=ss)
+        r = app_client.call(Ecommerce.takeOrder, acct=baddr, order_id="xx3")
+        assert r.return_value == "status_order_updated", "The seller must find the order by its id"
+
+        r = app_client.call(Ecommerce.takeOrder, acct=baddr, order_id="xx4")
+        assert r.return_value == "order_not_found", "An unknown order id must not be found"
+
+    def test_slot_reuse(self,
+                        opted_in,
+                        seller_acc:tuple[str,str,AccountTransactionSigner],
+                        buyer_acc:tuple[str,str,AccountTransactionSigner]):
+        saddr,_,_ = seller_acc
+        baddr,_,_ = buyer_acc
+        order = [saddr, "xx4", 1, self.tokens[0], Ecommerce.ORDER_PENDING]
+        self.app_client.call(Ecommerce.oPostOrderUsdc, acct=baddr, amt=1, o=order, accounts=[saddr])
+        live, free = self.app_client.call(Ecommerce.getSlotUsage, acct=baddr).return_value
+
+        # Cancel the order on the first slot, it must be reused by the next order
+        order = [saddr, "xx5", 1, self.tokens[0], Ecommerce.ORDER_CANCELLED]
+        self.app_client.call(Ecommerce.setOrderIndex, i=0, o=order, acct=baddr)
+        r = self.app_client.call(Ecommerce.getSlotUsage, acct=baddr)
+        assert r.return_value == [live - 1, free + 1], "A cancelled order must free its slot"
+
+        index = self.app_client.call(Ecommerce.getCurrentIndex, acct=baddr).return_value
+        order = [saddr, "xx6", 1, self.tokens[0], Ecommerce.ORDER_PENDING]
+        self.app_client.call(Ecommerce.oPostOrderUsdc, acct=baddr, amt=1, o=order, accounts=[saddr])
+        r = self.app_client.call(Ecommerce.getSlotUsage, acct=baddr)
+        assert r.return_value == [live, free], "The new order must use the free slot"
+        r = self.app_client.call(Ecommerce.getCurrentIndex, acct=baddr)
+        assert r.return_value == index, "Reusing a slot must not move the current index"
+
+    def test_oracle_post_batch(self,
+                               opted_in,
+                               seller_acc:tuple[str,str,AccountTransactionSigner],
+                               buyer_acc:tuple[str,str,AccountTransactionSigner]):
+        saddr,_,_ = seller_acc
+        baddr,_,_ = buyer_acc
+        sp = self.algod_client.suggested_params()
+        sp.flat_fee = True
+        sp.fee = 3000 # Pay for the inner calls that increase the opcode budget
+        live, _ = self.app_client.call(Ecommerce.getSlotUsage, acct=baddr).return_value
+
+        # The buyer is the first foreign account, index 1 on the accounts array, the seller holds the pending queue
+        orders = [
+            [1, 1, [saddr, "xx7", 1, self.tokens[0], Ecommerce.ORDER_PENDING]],
+            [1, 1, [saddr, "xx8", 1, self.tokens[0], Ecommerce.ORDER_PENDING]],
+        ]
+        self.app_client.call(Ecommerce.oPostOrdersBatch, orders=orders, accounts=[baddr, saddr],
+                             suggested_params=sp)
+        r = self.app_client.call(Ecommerce.getSlotUsage, acct=baddr)
+        assert r.return_value[0] == live + 2, "All the orders of the batch must be posted"
+
+    def test_order_record(self,
+                          opted_in,
+                          seller_acc:tuple[str,str,AccountTransactionSigner],
+                          buyer_acc:tuple[str,str,AccountTransactionSigner]):
+        saddr,_,_ = seller_acc
+        baddr,_,_ = buyer_acc
+        order = [saddr, "xx9", 5, self.tokens[0], Ecommerce.ORDER_PENDING]
+        self.app_client.call(Ecommerce.setOrderIndex, i=1, o=order, acct=baddr)
+        stored_round = self.algod_client.status()["last-round"]
+
+        r = self.app_client.call(Ecommerce.getOrderIndex, i=1, acct=baddr)
+        seller, order_hash, amount, token, status, index, expires = r.return_value
+        assert seller == saddr
+        assert bytes(order_hash) == hashlib.sha256(b"xx9").digest(), "The order id must be stored as its hash"
+        assert amount == 5
+        assert token == 1, "The first token added must use the slot 1 of the registry"
+        assert status == Ecommerce.ORDER_PENDING
+        assert index == 1, "The record must know its slot on the order list"
+        assert expires == stored_round + Ecommerce._order_ttl, "The order must expire after the time to live"
+
+    def test_token_balances(self,
+                            opted_in,
+                            seller_acc:tuple[str,str,AccountTransactionSigner],
+                            buyer_acc:tuple[str,str,AccountTransactionSigner]):
+        saddr,_,_ = seller_acc
+        baddr,_,_ = buyer_acc
+        self.app_client.call(Ecommerce.addDeposit, acct=baddr, token=0, amt=7)
+        order = [saddr, "xt1", 1, 0, Ecommerce.ORDER_PENDING]
+        self.app_client.call(Ecommerce.oPostOrderUsdc, acct=baddr, amt=5, o=order, accounts=[saddr])
+        order = [saddr, "xt2", 1, self.tokens[0], Ecommerce.ORDER_PENDING]
+        self.app_client.call(Ecommerce.oPostOrderUsdc, acct=baddr, amt=3, o=order, accounts=[saddr])
+
+        r = self.app_client.call(Ecommerce.getDeposit, acct=baddr, token=0)
+        assert r.return_value == 12, "The algo orders must be credited on the slot 0"
+        r = self.app_client.call(Ecommerce.getDeposit, acct=baddr, token=self.tokens[0])
+        assert r.return_value == 3, "Each token must have its own balance"
+        # Read-only calls are dryrun, a rejected call has no return value
+        r = self.app_client.call(Ecommerce.getDeposit, acct=baddr, token=self.tokens[0] + 1)
+        assert r.return_value is None, "A token not on the registry must be rejected"
+
+    def test_account_snapshot(self,
+                              opted_in,
+                              seller_acc:tuple[str,str,AccountTransactionSigner],
+                              buyer_acc:tuple[str,str,AccountTransactionSigner]):
+        saddr,_,_ = seller_acc
+        baddr,_,_ = buyer_acc
+        for i in range(3):
+            order = [saddr, f"xs{i}", 1, self.tokens[0], Ecommerce.ORDER_PENDING]
+            self.app_client.call(Ecommerce.oPostOrderUsdc, acct=baddr, amt=100, o=order, accounts=[saddr])
+
+        balances, orders = self.app_client.call(Ecommerce.getAccountSnapshot, acct=baddr).return_value
+        deposits, incomes, order_index = balances
+        assert deposits[1] == self.app_client.call(Ecommerce.getDeposit, acct=baddr, token=self.tokens[0]).return_value == 300
+        assert deposits[0] == incomes[1] == 0
+        assert order_index == self.app_client.call(Ecommerce.getCurrentIndex, acct=baddr).return_value == 3
+        assert orders == [self.app_client.call(Ecommerce.getOrderIndex, i=i, acct=baddr).return_value
+                          for i in range(3)], "The snapshot must hold the orders of all the used slots"
+
+        r = self.app_client.call(Ecommerce.getOrders, start=1, count=5, acct=baddr)
+        assert r.return_value == orders[1:], "The page must stop at the last used slot"
+        r = self.app_client.call(Ecommerce.getOrders, start=4, count=2, acct=baddr)
+        assert r.return_value == []
+
+    def test_place_order_direct(self,
+                                opted_in,
+                                seller_acc:tuple[str,str,AccountTransactionSigner],
+                                buyer_acc:tuple[str,str,AccountTransactionSigner]):
+        saddr,_,_ = seller_acc
+        baddr,_,bs = buyer_acc
+        app_client = client.ApplicationClient(self.algod_client,self.app,self.app_client.app_id,signer=bs)
+        sp = self.algod_client.suggested_params()
+        order = [saddr, "xd1", 2000, self.tokens[0], Ecommerce.ORDER_PENDING]
+
+        def pay(amount, asset_id):
+            return TransactionWithSigner(
+                transaction.AssetTransferTxn(baddr, sp, self.app_client.app_addr, amount, asset_id), bs)
+
+        r = app_client.call(Ecommerce.placeOrderDirect, product_pay=pay(2000, self.tokens[0]), o=order,
+                            accounts=[saddr])
+        assert r.return_value == "order_placed"
+        r = app_client.call(Ecommerce.getDeposit, acct=baddr, token=self.tokens[0])
+        assert r.return_value == 2000, "The deposit must be credited in the same group"
+        r = app_client.call(Ecommerce.takeOrder, acct=baddr, order_id="xd1")
+        assert r.return_value == "sender_is_not_the_seller_order", "The order must be stored"
+
+        order[1] = "xd2"
+        with pytest.raises(client.LogicException):
+            app_client.call(Ecommerce.placeOrderDirect, product_pay=pay(1999, self.tokens[0]), o=order,
+                            accounts=[saddr])
+        order[3] = 0
+        with pytest.raises(client.LogicException):
+            app_client.call(Ecommerce.placeOrderDirect, product_pay=pay(2000, self.tokens[0]), o=order,
+                            accounts=[saddr])
+
+    def test_place_order_cart(self,
+                              opted_in,
+                              admin_acc:tuple[str,str,AccountTransactionSigner],
+                              seller_acc:tuple[str,str,AccountTransactionSigner],
+                              buyer_acc:tuple[str,str,AccountTransactionSigner]):
+        addr,_,_ = admin_acc
+        saddr,_,_ = seller_acc
+        baddr,_,bs = buyer_acc
+        usdc = self.tokens[0]
+        self.app_client.opt_in()    # The admin sells too
+        buyer_client = client.ApplicationClient(self.algod_client,self.app,self.app_client.app_id,signer=bs)
+        sp = self.algod_client.suggested_params()
+        sp.flat_fee = True
+        sp.fee = 4000   # The inner calls increasing the opcode budget
+
+        def cart(items, amount):
+            return buyer_client.call(
+                Ecommerce.placeOrderCart,
+                oracle_pay=TransactionWithSigner(
+                    transaction.PaymentTxn(baddr, sp, self.app_client.app_addr, Ecommerce._oracle_fees), bs),
+                product_pay=TransactionWithSigner(
+                    transaction.AssetTransferTxn(baddr, sp, self.app_client.app_addr, amount, usdc), bs),
+                items=items,
+                accounts=[saddr, addr],
+                suggested_params=sp,
+            )
+
+        r = cart([(saddr, "xc1", 100), (saddr, "xc2", 200), (addr, "xc3", 300)], 600)
+        assert r.return_value == 3
+        r = self.app_client.call(Ecommerce.getDeposit, acct=baddr, token=usdc)
+        assert r.return_value == 600, "One transfer must pay all the orders of the cart"
+        orders = self.app_client.call(Ecommerce.getOrders, start=0, count=8, acct=baddr).return_value
+        assert [(seller, amount, status) for seller, _, amount, _, status, _, _ in orders] == \
+            [(saddr, 100, Ecommerce.ORDER_PENDING), (saddr, 200, Ecommerce.ORDER_PENDING),
+             (addr, 300, Ecommerce.ORDER_PENDING)]
+        r = self.app_client.call(Ecommerce.getSellerQueue, seller=addr)
+        assert [bytes(key) for _, key in r.return_value] == [hashlib.sha256(b"xc3").digest()[:8]]
+
+        with pytest.raises(client.LogicException):
+            cart([(saddr, "xc4", 100), (addr, "xc5", 100)], 199)    # The transfer must pay the whole cart
+
+    def test_settle_orders(self,
+                           opted_in,
+                           seller_acc:tuple[str,str,AccountTransactionSigner],
+                           buyer_acc:tuple[str,str,AccountTransactionSigner]):
+        saddr,_,ss = seller_acc
+        baddr,_,bs = buyer_acc
+        usdc = self.tokens[0]
+        buyer_client = client.ApplicationClient(self.algod_client,self.app,self.app_client.app_id,signer=bs)
+        sp = self.algod_client.suggested_params()
+        for order_id in ("xp1", "xp2"):
+            buyer_client.call(
+                Ecommerce.placeOrderDirect,
+                product_pay=TransactionWithSigner(
+                    transaction.AssetTransferTxn(baddr, sp, self.app_client.app_addr, 10000, usdc), bs),
+                o=[saddr, order_id, 10000, usdc, Ecommerce.ORDER_PENDING],
+                accounts=[saddr],
+            )
+        seller_client = client.ApplicationClient(self.algod_client,self.app,self.app_client.app_id,signer=ss)
+        seller_client.call(Ecommerce.takeOrder, acct=baddr, order_id="xp1")
+
+        def balance(addr):
+            return self.algod_client.account_asset_info(addr, usdc)["asset-holding"]["amount"]
+
+        seller_before, buyer_before = balance(saddr), balance(baddr)
+        sp.flat_fee = True
+        sp.fee = 6000 # The payouts and the inner calls increasing the budget are paid by this transaction
+        orders = [[1, "xp1", Ecommerce.ORDER_COMPLETED], [1, "xp2", Ecommerce.ORDER_CANCELLED]]
+        self.app_client.call(Ecommerce.settleOrders, orders=orders, accounts=[baddr, saddr],
+                             foreign_assets=[usdc], suggested_params=sp)
+
+        comission = 10000 * Ecommerce._comission_fees // 100000
+        assert balance(saddr) == seller_before + 10000 - comission, "The seller must be paid minus the comission"
+        assert balance(baddr) == buyer_before + 10000, "The cancelled order must be refunded"
+        r = self.app_client.call(Ecommerce.getDeposit, acct=baddr, token=usdc)
+        assert r.return_value == 0
+        state = decode_state(self.algod_client.application_info(self.app_client.app_id)["params"]["global-state"])
+        assert decode_balances(state[b"e"])[1] == comission, "The comission must be added to the earnings of the token"
+
+        with pytest.raises(client.LogicException):
+            self.app_client.call(Ecommerce.settleOrders, orders=orders[:1], accounts=[baddr, saddr],
+                                 foreign_assets=[usdc], suggested_params=sp)
+
+    def test_seller_queue(self,
+                          opted_in,
+                          seller_acc:tuple[str,str,AccountTransactionSigner],
+                          buyer_acc:tuple[str,str,AccountTransactionSigner]):
+        saddr,_,ss = seller_acc
+        baddr,_,bs = buyer_acc
+        buyer_client = client.ApplicationClient(self.algod_client,self.app,self.app_client.app_id,signer=bs)
+        sp = self.algod_client.suggested_params()
+        keys = {}
+        for order_id in ("xq1", "xq2", "xq3"):
+            buyer_client.call(
+                Ecommerce.placeOrderDirect,
+                product_pay=TransactionWithSigner(
+                    transaction.AssetTransferTxn(baddr, sp, self.app_client.app_addr, 100, self.tokens[0]), bs),
+                o=[saddr, order_id, 100, self.tokens[0], Ecommerce.ORDER_PENDING],
+                accounts=[saddr],
+            )
+            keys[order_id] = hashlib.sha256(order_id.encode()).digest()[:8]
+
+        def queue():
+            r = self.app_client.call(Ecommerce.getSellerQueue, seller=saddr)
+            return [(buyer, bytes(key)) for buyer, key in r.return_value]
+
+        assert queue() == [(baddr, keys[i]) for i in ("xq1", "xq2", "xq3")], "The pending orders must be on the seller queue"
+
+        seller_client = client.ApplicationClient(self.algod_client,self.app,self.app_client.app_id,signer=ss)
+        r = seller_client.call(Ecommerce.takeOrderByKey, acct=baddr, order_key=keys["xq2"])
+        assert r.return_value == "status_order_updated", "The seller must take the order with the key of the queue"
+        assert queue() == [(baddr, keys["xq1"]), (baddr, keys["xq3"])], "An accepted order must leave the queue"
+
+        sp.flat_fee = True
+        sp.fee = 6000
+        orders = [[1, "xq1", Ecommerce.ORDER_CANCELLED], [1, "xq3", Ecommerce.ORDER_CANCELLED]]
+        self.app_client.call(Ecommerce.settleOrders, orders=orders, accounts=[baddr, saddr],
+                             foreign_assets=[self.tokens[0]], suggested_params=sp)
+        assert queue() == [], "A cancelled order must leave the queue"
+        state = self.algod_client.account_application_info(saddr, self.app_client.app_id)["app-local-state"]
+        assert state.get("key-value", []) == [], "The empty pages must be deleted from the seller local state"
+
+    def test_seller_queue_full(self,
+                               opted_in,
+                               admin_acc:tuple[str,str,AccountTransactionSigner],
+                               seller_acc:tuple[str,str,AccountTransactionSigner],
+                               buyer_acc:tuple[str,str,AccountTransactionSigner]):
+        addr,_,_ = admin_acc
+        saddr,_,_ = seller_acc
+        baddr,_,bs = buyer_acc
+        self.app_client.opt_in()
+        capacity = Ecommerce._Ecommerce__QUEUE_PAGES * Ecommerce._Ecommerce__QUEUE_PAGE_REFS
+        list_max = Ecommerce._Ecommerce__ORDER_LIST_MAX
+        for n in range(capacity + 1):
+            order = [saddr, f"xf{n}", 1, self.tokens[0], Ecommerce.ORDER_PENDING]
+            self.app_client.call(Ecommerce.oPostOrderUsdc, acct=baddr if n < list_max else addr, amt=1, o=order,
+                                 accounts=[saddr])
+        r = self.app_client.call(Ecommerce.getSellerQueue, seller=saddr)
+        assert len(r.return_value) == capacity
+        r = self.app_client.call(Ecommerce.getSlotUsage, acct=addr)
+        assert r.return_value[0] == capacity + 1 - list_max, "The order must be stored when the queue is full"
+
+        buyer_client = client.ApplicationClient(self.algod_client,self.app,self.app_client.app_id,signer=bs)
+        sp = self.algod_client.suggested_params()
+        with pytest.raises(client.LogicException):     # An order without amount is rejected
+            buyer_client.call(
+                Ecommerce.placeOrderDirect,
+                product_pay=TransactionWithSigner(
+                    transaction.AssetTransferTxn(baddr, sp, self.app_client.app_addr, 0, self.tokens[0]), bs),
+                o=[saddr, "xf0", 0, self.tokens[0], Ecommerce.ORDER_PENDING],
+                accounts=[saddr],
+            )
+
+    def test_oracle_workers(self,
+                            opted_in,
+                            admin_acc:tuple[str,str,AccountTransactionSigner],
+                            seller_acc:tuple[str,str,AccountTransactionSigner],
+                            buyer_acc:tuple[str,str,AccountTransactionSigner]):
+        addr,sk,_ = admin_acc
+        saddr,_,ss = seller_acc
+        baddr,_,_ = buyer_acc
+        wsk, waddr = account.generate_account()
+        sp = self.algod_client.suggested_params()
+        self.algod_client.send_transaction(transaction.PaymentTxn(addr, sp, waddr, int(1e6)).sign(sk))
+        worker = client.ApplicationClient(self.algod_client,self.app,self.app_client.app_id,
+                                          signer=AccountTransactionSigner(wsk))
+        seller = client.ApplicationClient(self.algod_client,self.app,self.app_client.app_id,signer=ss)
+
+        def post(app_client, order_id):
+            order = [saddr, order_id, 1, self.tokens[0], Ecommerce.ORDER_PENDING]
+            app_client.call(Ecommerce.oPostOrderUsdc, acct=baddr, amt=1, o=order, accounts=[saddr])
+
+        with pytest.raises(client.LogicException):
+            post(worker, "xw1")
+        r = self.app_client.call(Ecommerce.addOracle, a=waddr)
+        assert r.return_value == "oracle_added"
+        post(worker, "xw1")
+        with pytest.raises(client.LogicException):
+            self.app_client.call(Ecommerce.addOracle, a=waddr)
+
+        r = self.app_client.call(Ecommerce.rotateOracle, old=waddr, new=saddr)
+        assert r.return_value == "oracle_rotated"
+        with pytest.raises(client.LogicException):
+            post(worker, "xw2")
+        post(seller, "xw2")
+
+        r = self.app_client.call(Ecommerce.removeOracle, a=saddr)
+        assert r.return_value == "oracle_removed"
+        with pytest.raises(client.LogicException):
+            post(seller, "xw3")
+        r = self.app_client.call(Ecommerce.getCurrentIndex, acct=baddr)
+        assert r.return_value == 2, "Only the orders of registered workers must be posted"
+
+    def test_sweep_max(self,
+                       opted_in,
+                       admin_acc:tuple[str,str,AccountTransactionSigner],
+                       seller_acc:tuple[str,str,AccountTransactionSigner],
+                       buyer_acc:tuple[str,str,AccountTransactionSigner]):
+        """A sweep of the max orders must fit on the logs of a call, with more orders expired"""
+        addr,_,signer = admin_acc
+        saddr,_,ss = seller_acc
+        baddr,_,bs = buyer_acc
+        usdc = self.tokens[0]
+        sweep_max = Ecommerce._Ecommerce__SWEEP_MAX
+        admin_client = client.ApplicationClient(self.algod_client,self.app,self.app_client.app_id,signer=signer)
+        admin_client.opt_in()
+        self.app_client.call(Ecommerce.setOrderTtl, rounds=1)
+        buyers = [(baddr, bs)] * Ecommerce._Ecommerce__ORDER_LIST_MAX + [(addr, signer)] * 2
+        assert len(buyers) > sweep_max
+        for n, (buyer, bsigner) in enumerate(buyers):
+            sp = self.algod_client.suggested_params()
+            client.ApplicationClient(self.algod_client,self.app,self.app_client.app_id,signer=bsigner).call(
+                Ecommerce.placeOrderDirect,
+                product_pay=TransactionWithSigner(
+                    transaction.AssetTransferTxn(buyer, sp, self.app_client.app_addr, 100, usdc), bsigner),
+                o=[saddr, f"xm{n}", 100, usdc, Ecommerce.ORDER_PENDING],
+                accounts=[saddr],
+            )
+        self.app_client.call(Ecommerce.setOrderTtl, rounds=1000)
+
+        seller_client = client.ApplicationClient(self.algod_client,self.app,self.app_client.app_id,signer=ss)
+
+        def sweep(max_orders):
+            sweep_sp = self.algod_client.suggested_params()
+            sweep_sp.flat_fee = True
+            sweep_sp.fee = 40000
+            return seller_client.call(Ecommerce.sweepExpired, max_orders=max_orders, accounts=[baddr, addr, saddr],
+                                      foreign_assets=[usdc], suggested_params=sweep_sp).return_value
+
+        with pytest.raises(client.LogicException):
+            sweep(sweep_max + 1)
+        assert sweep(sweep_max) == sweep_max
+        assert sweep(sweep_max) == len(buyers) - sweep_max, "The orders left must be swept on the next call"
+
+    def test_oracle_max(self,app_funded):
+        oracle_max = Ecommerce._Ecommerce__ORACLE_MAX
+        workers = [account.generate_account()[1] for _ in range(oracle_max + 1)]
+        for waddr in workers[:oracle_max]:
+            self.app_client.call(Ecommerce.addOracle, a=waddr)
+        with pytest.raises(client.LogicException):
+            self.app_client.call(Ecommerce.addOracle, a=workers[-1])
+
+        r = self.app_client.call(Ecommerce.addToken, a=self.tokens[0])
+        assert r.return_value == "new_token_added", "The workers must not take the keys of the token slots"
+        self.app_client.call(Ecommerce.removeOracle, a=workers[0])
+        r = self.app_client.call(Ecommerce.addOracle, a=workers[-1])
+        assert r.return_value == "oracle_added", "A removed worker must free its place"
+
+    def test_sweep_expired(self,
+                           opted_in,
+                           seller_acc:tuple[str,str,AccountTransactionSigner],
+                           buyer_acc:tuple[str,str,AccountTransactionSigner]):
+        saddr,_,ss = seller_acc
+        baddr,_,bs = buyer_acc
+        usdc = self.tokens[0]
+        buyer_client = client.ApplicationClient(self.algod_client,self.app,self.app_client.app_id,signer=bs)
+        sp = self.algod_client.suggested_params()
+
+        def place(order_id):
+            buyer_client.call(
+                Ecommerce.placeOrderDirect,
+                product_pay=TransactionWithSigner(
+                    transaction.AssetTransferTxn(baddr, sp, self.app_client.app_addr, 100, usdc), bs),
+                o=[saddr, order_id, 100, usdc, Ecommerce.ORDER_PENDING],
+                accounts=[saddr],
+            )
+
+        r = self.app_client.call(Ecommerce.setOrderTtl, rounds=1)
+        assert r.return_value == "order_ttl_updated"
+        place("xe1")
+        place("xe2")
+        self.app_client.call(Ecommerce.setOrderTtl, rounds=1000)
+        place("xe3")
+        seller_client = client.ApplicationClient(self.algod_client,self.app,self.app_client.app_id,signer=ss)
+        seller_client.call(Ecommerce.takeOrder, acct=baddr, order_id="xe2")
+
+        def balance(addr):
+            return self.algod_client.account_asset_info(addr, usdc)["asset-holding"]["amount"]
+
+        buyer_before = balance(baddr)
+        # Anyone can sweep, the seller pays the refunds and the inner calls increasing the budget
+        sweep_sp = self.algod_client.suggested_params()
+        sweep_sp.flat_fee = True
+        sweep_sp.fee = 10000
+        r = seller_client.call(Ecommerce.sweepExpired, max_orders=4, accounts=[baddr, saddr],
+                               foreign_assets=[usdc], suggested_params=sweep_sp)
+        assert r.return_value == 1, "Only the pending order past its expiry round must be swept"
+        assert balance(baddr) == buyer_before + 100, "The expired order must be refunded"
+        r = self.app_client.call(Ecommerce.getDeposit, acct=baddr, token=usdc)
+        assert r.return_value == 200, "The accepted and the not expired orders keep their deposit"
+        statuses = {bytes(order_hash): status for _, order_hash, _, _, status, _, _ in
+                   self.app_client.call(Ecommerce.getOrders, start=0, count=8, acct=baddr).return_value}
+        assert statuses[hashlib.sha256(b"xe1").digest()] == Ecommerce.ORDER_CANCELLED
+        r = self.app_client.call(Ecommerce.getSellerQueue, seller=saddr)
+        assert [bytes(key) for _, key in r.return_value] == [hashlib.sha256(b"xe3").digest()[:8]]
+
+        r = seller_client.call(Ecommerce.sweepExpired, max_orders=2, accounts=[baddr, saddr],
+                               foreign_assets=[usdc], suggested_params=sweep_sp)
+        assert r.return_value == 0, "A cancelled order must not be swept again"